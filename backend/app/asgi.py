@@ -10,14 +10,23 @@ django.setup()
 
 from chat.routing import websocket_urlpatterns
 from chat.authentication import FirebaseWebSocketAuthMiddleware
+from chat.throttling import ConnectionRateLimitMiddleware
 
-# Aplicação ASGI com middleware personalizado para Firebase
+# Aplicação ASGI com middleware personalizado para Firebase. O limite por IP
+# fica antes da autenticação para recusar tempestades de reconexão sem
+# verificar tokens; o limite por usuário precisa do usuário já autenticado.
 application = ProtocolTypeRouter(
     {
         "http": get_asgi_application(),
         "websocket": AllowedHostsOriginValidator(
-            FirebaseWebSocketAuthMiddleware(
-                URLRouter(websocket_urlpatterns)
+            ConnectionRateLimitMiddleware(
+                FirebaseWebSocketAuthMiddleware(
+                    ConnectionRateLimitMiddleware(
+                        URLRouter(websocket_urlpatterns),
+                        by='user',
+                    )
+                ),
+                by='ip',
             )
         ),
     },
@@ -0,0 +1,130 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+
+# Contadores do processo, expostos em chat/api/metrics/
+counters = {
+    'records_queued': 0,
+    'records_dropped': 0,
+    'records_sampled_out': 0,
+}
+
+_counters_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        counters[name] += 1
+
+
+def _handler_by_name(name):
+    # logging.getHandlerByName só existe a partir do Python 3.12
+    if hasattr(logging, 'getHandlerByName'):
+        return logging.getHandlerByName(name)
+    return logging._handlers.get(name)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of low-severity records.
+
+    rates maps a logger name prefix to the fraction of records kept (the
+    longest matching prefix wins). WARNING and above always pass, so
+    sampling never hides errors.
+    """
+
+    def __init__(self, rates=None, min_level='WARNING'):
+        super().__init__()
+        self.rates = sorted((rates or {}).items(), key=lambda item: -len(item[0]))
+        self.min_level = logging._checkLevel(min_level)
+
+    def filter(self, record):
+        if record.levelno >= self.min_level:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + '.'):
+                if rate >= 1 or random.random() < rate:
+                    return True
+                _count('records_sampled_out')
+                return False
+        return True
+
+
+class QueueListenerHandler(logging.handlers.QueueHandler):
+    """Hand records to a background thread instead of writing them inline.
+
+    The calling thread (or the event loop) only interpolates the message and
+    puts the record on a bounded queue; the listener thread formats it and
+    does the actual I/O on the handlers named in `handlers`. When the queue
+    is full the record is dropped and counted instead of blocking.
+    """
+
+    def __init__(self, handlers, maxsize=10000, respect_handler_level=True):
+        super().__init__(queue.Queue(maxsize))
+        self._handler_names = handlers
+        self._respect_handler_level = respect_handler_level
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        # Os handlers de destino só existem depois do dictConfig, por isso
+        # são resolvidos no primeiro registro
+        with self._start_lock:
+            if self._listener is not None:
+                return
+            targets = [_handler_by_name(name) for name in self._handler_names]
+            self._listener = logging.handlers.QueueListener(
+                self.queue,
+                *[handler for handler in targets if handler is not None],
+                respect_handler_level=self._respect_handler_level,
+            )
+            self._listener.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def prepare(self, record):
+        # Só interpolar a mensagem aqui; a formatação fica para a thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            _count('records_queued')
+        except queue.Full:
+            _count('records_dropped')
+
+    def emit(self, record):
+        if self._listener is None:
+            self._start()
+        super().emit(record)
@@ -0,0 +1,204 @@
+import mimetypes
+import os
+import re
+import stat
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.urls import re_path
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+# Servidor de MEDIA_ROOT para produção, no lugar de django.conf.urls.static
+# (que é só para DEBUG): Range, ETag / Last-Modified com 304 e cache longo
+# para os arquivos com hash no nome. Com MEDIA_SENDFILE o corpo fica com o
+# proxy na frente (nginx / Apache); sem ele, no WSGI o arquivo vai pelo
+# wsgi.file_wrapper (sendfile do servidor) e no ASGI em blocos lidos numa
+# thread, sem carregar o arquivo inteiro na memória.
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Nomes gerados por user/photos.py: <sha256>.<ext> e <sha256>_<variante>.<ext>
+CONTENT_ADDRESSED_RE = re.compile(r'^[0-9a-f]{64}(_\w+)?\.\w+$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """(start, end) of a single-range Range header, end inclusive.
+
+    None means "send the whole file": no header, a multi-range or otherwise
+    unsupported one. Raises RangeNotSatisfiable when it is out of bounds.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        return None
+
+    start, end = match.groups()
+    if not start:
+        # bytes=-N: os últimos N bytes
+        length = int(end)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    if start >= size:
+        raise RangeNotSatisfiable()
+    end = min(int(end), size - 1) if end else size - 1
+    if end < start:
+        return None
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    """Whether a Range may be honoured given the request's If-Range"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def cache_control(path):
+    if CONTENT_ADDRESSED_RE.match(os.path.basename(path)):
+        return IMMUTABLE_CACHE_CONTROL
+    return f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+
+
+def _read_block(fd, length, offset):
+    return os.pread(fd, length, offset)
+
+
+async def file_blocks(path, start, length, block_size):
+    """Async iterator over a byte range of a file, reading in a worker thread"""
+    fd = os.open(path, os.O_RDONLY)
+    read = sync_to_async(_read_block, thread_sensitive=False)
+    try:
+        offset, end = start, start + length
+        while offset < end:
+            block = await read(fd, min(block_size, end - offset), offset)
+            if not block:
+                break
+            offset += len(block)
+            yield block
+    finally:
+        os.close(fd)
+
+
+def file_range(path, start, length, block_size):
+    """Sync counterpart of file_blocks, for WSGI"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(block_size, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def body_response(request, path, start, length, status):
+    block_size = getattr(settings, 'MEDIA_BLOCK_SIZE', 256 * 1024)
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            file_blocks(path, start, length, block_size), status=status
+        )
+    elif status == 200:
+        # O servidor WSGI manda o arquivo com sendfile (wsgi.file_wrapper)
+        response = FileResponse(open(path, 'rb'))
+        response.block_size = block_size
+    else:
+        response = StreamingHttpResponse(
+            file_range(path, start, length, block_size), status=status
+        )
+    response['Content-Length'] = length
+    return response
+
+
+def sendfile_response(path):
+    """Empty response telling the fronting proxy to send the file itself"""
+    response = HttpResponse()
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    if mode == 'x-accel':
+        relative = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + relative
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve a file from MEDIA_ROOT with caching, conditional and range support"""
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('Arquivo não encontrado.')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('Arquivo não encontrado.')
+
+    size = st.st_size
+    last_modified = int(st.st_mtime)
+    etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+    content_type, _ = mimetypes.guess_type(fullpath)
+
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': cache_control(fullpath),
+        'Accept-Ranges': 'bytes',
+    }
+
+    # 304 (If-None-Match / If-Modified-Since) ou 412 (If-Match / If-Unmodified-Since)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    if getattr(settings, 'MEDIA_SENDFILE', None):
+        response = sendfile_response(fullpath)
+    else:
+        byte_range = None
+        if if_range_matches(request, etag, last_modified):
+            try:
+                byte_range = parse_range(request.headers.get('Range'), size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+        if request.method == 'HEAD':
+            response = HttpResponse()
+            response['Content-Length'] = size
+        elif byte_range is None:
+            response = body_response(request, fullpath, 0, size, 200)
+        else:
+            start, end = byte_range
+            response = body_response(request, fullpath, start, end - start + 1, 206)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    for header, value in headers.items():
+        response[header] = value
+    response['Content-Type'] = content_type or 'application/octet-stream'
+    return response
+
+
+def media_urlpatterns():
+    """URL pattern for serve_media under MEDIA_URL, if SERVE_MEDIA is on"""
+    if not getattr(settings, 'SERVE_MEDIA', True):
+        return []
+    prefix = re.escape(settings.MEDIA_URL.lstrip('/'))
+    return [re_path(rf'^{prefix}(?P<path>.*)$', serve_media, name='media')]
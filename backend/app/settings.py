@@ -159,6 +159,65 @@ AUTH_USER_MODEL = 'user.CustomUser'
 
 ASGI_APPLICATION = 'app.asgi.application'
 
+# Consumer do chat: "async" (AsyncWebsocketConsumer, padrão) ou "sync"
+# (WebsocketConsumer original, com async_to_sync em cada operação de grupo)
+CHAT_CONSUMER_MODE = os.environ.get('CHAT_CONSUMER_MODE', 'async')
+
+# Histórico do chat: as mensagens são gravadas em lote (bulk_create) a cada
+# CHAT_HISTORY_FLUSH_SIZE mensagens ou CHAT_HISTORY_FLUSH_INTERVAL_MS ms.
+# Leituras não forçam o flush: o resume vê o buffer do próprio worker, e o
+# que está no buffer de outro worker aparece depois do próximo flush dele
+CHAT_HISTORY_FLUSH_SIZE = 50
+CHAT_HISTORY_FLUSH_INTERVAL_MS = 500
+
+# Tamanho máximo de página do histórico e quantas mensagens enviar junto com
+# connection_established quando o cliente não pede ?history=K
+CHAT_HISTORY_MAX_PAGE = 100
+CHAT_CONNECT_HISTORY = 0
+
+# Salas abertas a qualquer conexão (testes, demonstração). As demais salas
+# ("<uid>_<uid>") só aceitam os participantes ou um psicólogo com sessões
+# com todos eles, e o histórico sempre exige login
+CHAT_PUBLIC_ROOMS = []
+
+# Por quanto tempo (s) um client_id é lembrado para descartar reenvios
+CHAT_CLIENT_ID_TTL = 86400
+
+# Presença nas salas: cada conexão renova sua entrada a cada TTL/3 segundos;
+# entradas sem renovação por CHAT_PRESENCE_TTL segundos são removidas
+CHAT_PRESENCE_TTL = 60
+
+# Máximo de salas inscritas numa mesma conexão multiplexada (ws/chat/)
+CHAT_MAX_SUBSCRIPTIONS = 100
+
+# Fila de saída por conexão: no Daphne os frames esperam nela enquanto o
+# buffer de escrita do socket estiver cheio (cliente lento). Acima do limite,
+# frames efêmeros (presença, typing) são descartados; se só restarem mensagens
+# de chat e o limite seguir estourado por CHAT_OUTBOX_GRACE_SECONDS, o cliente
+# é desconectado (4008)
+CHAT_OUTBOX_MAX_MESSAGES = 500
+CHAT_OUTBOX_MAX_BYTES = 1024 * 1024
+CHAT_OUTBOX_GRACE_SECONDS = 10
+
+# Token buckets (tokens por segundo, capacidade) para frames recebidos e para
+# admissão de conexões WebSocket. Ficam no Redis do channel layer quando
+# disponível; senão, na memória do processo.
+CHAT_RATE_LIMITS = {
+    'frame_connection': (5, 20),
+    'frame_user': (10, 40),
+    'connect_ip': (1, 20),
+    'connect_user': (0.5, 10),
+}
+
+# Cache local de cada processo; com Redis disponível, SHARED_CACHE aponta
+# para um cache compartilhado entre os workers do Daphne
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+SHARED_CACHE = None
+
 # Configuração de canais com fallback para InMemory
 try:
     import redis
@@ -174,6 +233,11 @@ try:
             },
         },
     }
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    }
+    SHARED_CACHE = 'shared'
 except Exception as e:
     print(f"⚠️ Redis não disponível ({e}) - usando InMemoryChannelLayer")
     print("💡 Para chat em tempo real, inicie o Redis: python start_redis_local.py")
@@ -183,6 +247,95 @@ except Exception as e:
         },
     }
 
+# Cache de ID tokens do Firebase já verificados (chave = sha256 do token),
+# válido até o exp do token. Usado pela API REST e pelo WebSocket.
+FIREBASE_TOKEN_CACHE_ENABLED = True
+FIREBASE_TOKEN_CACHE_SIZE = 10000
+FIREBASE_TOKEN_CACHE = SHARED_CACHE
+
+# Verificações de token do WebSocket rodam neste pool (fora do event loop);
+# as chaves públicas do Google são buscadas na primeira verificação (na
+# thread do pool, nunca no event loop) e renovadas em background antes de
+# expirar.
+FIREBASE_VERIFY_WORKERS = 4
+FIREBASE_CERT_PREFETCH = True
+
+# Cache UID do Firebase -> usuário usado na autenticação. A cópia local de
+# cada worker vale USER_CACHE_LOCAL_TTL segundos (é o atraso máximo para
+# outro worker ver uma alteração); a compartilhada, USER_CACHE_TTL.
+USER_CACHE_SIZE = 10000
+USER_CACHE_LOCAL_TTL = 30
+USER_CACHE_TTL = 300
+USER_CACHE = SHARED_CACHE
+
+# Perfis serializados (GET /api/users/<id>/), invalidados a cada alteração do
+# usuário. Sem Redis fica no cache local de cada worker.
+PROFILE_CACHE = SHARED_CACHE or 'default'
+PROFILE_CACHE_TTL = 300
+
+# Fotos de perfil: guardadas pelo SHA-256 do conteúdo (iguais são
+# deduplicadas), com variantes WebP + JPEG geradas em PHOTO_WORKERS threads.
+# Uploads acima de FILE_UPLOAD_MAX_MEMORY_SIZE vão para um arquivo temporário
+# em vez de ficar na memória.
+PHOTO_VARIANTS = {'thumb': 96, 'medium': 512}
+PHOTO_WORKERS = 2
+PHOTO_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
+
+# Arquivos de MEDIA_ROOT servidos pelo próprio app (app/media.py). Com um proxy
+# na frente, SERVE_MEDIA = False, ou MEDIA_SENDFILE = 'x-accel' (nginx, com
+# location internal em MEDIA_ACCEL_PREFIX) / 'x-sendfile' (Apache) para o
+# proxy mandar o arquivo. Nomes com hash (fotos) têm cache de um ano; os
+# demais, MEDIA_CACHE_MAX_AGE segundos.
+SERVE_MEDIA = True
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 3600
+MEDIA_BLOCK_SIZE = 256 * 1024
+
+# Hash de senha (cadastro e troca de senha) em um pool de processos, para não
+# travar o worker no PBKDF2. No máximo PASSWORD_HASH_MAX_PENDING hashes na fila;
+# quem esperar mais de PASSWORD_HASH_WAIT_SECONDS por uma vaga recebe 503.
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_MAX_PENDING = 32
+PASSWORD_HASH_WAIT_SECONDS = 2.0
+
+# Máximo de ids por chamada em GET /api/users/?ids=1,2,3
+USER_BATCH_MAX_IDS = 100
+
+# Máximo de check-ins por página em GET /api/checkins/<id>/?limit=
+CHECKINS_MAX_PAGE_SIZE = 100
+
+# Sincronização offline (POST /api/checkins/sync/): no máximo
+# CHECKIN_SYNC_MAX_ITEMS por lote. Com CHECKIN_SYNC_ATOMIC, um item inválido
+# faz o lote inteiro ser recusado (o cliente pode mandar "atomic" no corpo).
+CHECKIN_SYNC_MAX_ITEMS = 366
+CHECKIN_SYNC_ATOMIC = False
+
+# Estatísticas de humor (user/mood.py, GET /api/mood-stats/<id>/): médias
+# móveis exponenciais com peso equivalente a MOOD_EMA_SPAN check-ins.
+# Depois de importar check-ins por fora da API: manage.py rebuild_mood_stats
+MOOD_EMA_SPAN = 7
+
+# Análises da coorte do psicólogo (user/analytics.py, GET /api/analytics/cohort/):
+# até ANALYTICS_MAX_DAYS de histórico, em cache até o próximo check-in de um
+# paciente. Em queda: inclinação da média das escalas nos últimos
+# ANALYTICS_TREND_DAYS dias de no máximo -ANALYTICS_DECLINE_SLOPE pontos por
+# dia, com pelo menos ANALYTICS_TREND_MIN_POINTS check-ins.
+ANALYTICS_CACHE = SHARED_CACHE or 'default'
+ANALYTICS_CACHE_TTL = 3600
+ANALYTICS_MAX_DAYS = 730
+ANALYTICS_TREND_DAYS = 28
+ANALYTICS_TREND_MIN_POINTS = 7
+ANALYTICS_DECLINE_SLOPE = 0.05
+
+# Exportação dos dados de um usuário (GET /api/export/<id>/ e
+# manage.py export_user_data): linhas lidas do banco EXPORT_CHUNK_SIZE por
+# vez e enviadas em blocos de EXPORT_BUFFER_SIZE bytes. A memória usada é
+# da ordem de EXPORT_CHUNK_SIZE check-ins (com as notas), não do histórico.
+EXPORT_CHUNK_SIZE = 500
+EXPORT_BUFFER_SIZE = 64 * 1024
+
 # Configurações de logging para debug
 LOGGING = {
     'version': 1,
@@ -214,4 +367,67 @@ LOGGING = {
         'handlers': ['console'],
         'level': 'INFO',
     },
-}
\ No newline at end of file
+}
+
+# LOG_MODE=async: os registros vão para uma fila limitada e uma thread faz a
+# escrita (JSON, uma linha por registro), sem bloquear o event loop do Daphne.
+# Logs abaixo de WARNING do chat e do channels são amostrados (LOG_SAMPLE_RATES);
+# se a fila encher, os registros são descartados e contados em chat/api/metrics/.
+LOG_MODE = os.environ.get('LOG_MODE', 'sync')
+
+LOG_QUEUE_SIZE = 10000
+
+LOG_SAMPLE_RATES = {
+    'chat': 0.1,
+    'channels': 0.1,
+}
+
+if LOG_MODE == 'async':
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'json': {
+                '()': 'app.log.JsonFormatter',
+            },
+        },
+        'filters': {
+            'sampling': {
+                '()': 'app.log.SamplingFilter',
+                'rates': LOG_SAMPLE_RATES,
+            },
+        },
+        'handlers': {
+            'console': {
+                'class': 'logging.StreamHandler',
+                'formatter': 'json',
+            },
+            'file': {
+                'class': 'logging.FileHandler',
+                'filename': 'debug.log',
+                'formatter': 'json',
+            },
+            'queue': {
+                '()': 'app.log.QueueListenerHandler',
+                'handlers': ['console', 'file'],
+                'maxsize': LOG_QUEUE_SIZE,
+                'filters': ['sampling'],
+            },
+        },
+        # Só o root tem handler, para cada registro entrar na fila uma vez
+        'loggers': {
+            'django': {
+                'level': 'INFO',
+            },
+            'chat': {
+                'level': 'INFO',
+            },
+            'channels': {
+                'level': 'INFO',
+            },
+        },
+        'root': {
+            'handlers': ['queue'],
+            'level': 'INFO',
+        },
+    }
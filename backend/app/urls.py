@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
+
+from .media import media_urlpatterns
 
 
 urlpatterns = [
@@ -9,4 +9,4 @@ urlpatterns = [
     path('api/', include('user.urls')),
     path('api/', include('motivational.urls')),
     path("chat/", include("chat.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+] + media_urlpatterns()
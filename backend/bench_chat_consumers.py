@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark do chat - compara o ChatConsumer (sync) com o AsyncChatConsumer
+
+Roda tudo em processo com InMemoryChannelLayer, sem Daphne nem Redis:
+cada cliente é um WebsocketCommunicator. Mede mensagens por segundo e a
+latência de fan-out (envio -> recebimento em cada membro da sala), p50/p99.
+
+Uso:
+    python bench_chat_consumers.py --members 20 --messages 200
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'channels',
+            'user',
+            'chat',
+        ],
+        AUTH_USER_MODEL='user.CustomUser',
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'),
+            },
+        },
+        USE_TZ=True,
+        # Clientes anônimos: as salas do benchmark precisam ser públicas
+        CHAT_PUBLIC_ROOMS=['bench_chatconsumer', 'bench_asyncchatconsumer'],
+        # Sem rate limit: o benchmark envia o mais rápido possível
+        CHAT_RATE_LIMITS={
+            'frame_connection': (1e9, 1e9),
+            'frame_user': (1e9, 1e9),
+        },
+        CHANNEL_LAYERS={
+            'default': {
+                'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                'CONFIG': {'capacity': 100000},
+            },
+        },
+        LOGGING_CONFIG=None,
+    )
+    django.setup()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.urls import re_path  # noqa: E402
+from channels.routing import URLRouter  # noqa: E402
+
+from chat.consumers import AsyncChatConsumer, ChatConsumer  # noqa: E402
+
+
+def build_app(consumer_class):
+    return URLRouter([
+        re_path(r"ws/chat/(?P<room_name>\w+)/$", consumer_class.as_asgi()),
+    ])
+
+
+async def drain_until(communicator, frame_type, timeout=10):
+    while True:
+        data = json.loads(await communicator.receive_from(timeout=timeout))
+        if data.get('type') == frame_type:
+            return data
+
+
+async def run_benchmark(consumer_class, members, messages):
+    app = build_app(consumer_class)
+    room = f"bench_{consumer_class.__name__.lower()}"
+
+    clients = []
+    for _ in range(members):
+        communicator = WebsocketCommunicator(app, f"/ws/chat/{room}/")
+        connected, _ = await communicator.connect()
+        assert connected, "Falha ao conectar"
+        await drain_until(communicator, 'connection_established')
+        clients.append(communicator)
+
+    sender, receivers = clients[0], clients[1:]
+    latencies = []
+
+    async def receive_all(communicator):
+        for _ in range(messages):
+            data = await drain_until(communicator, 'chat_message')
+            sent_at = float(data['message'])
+            latencies.append(time.perf_counter() - sent_at)
+
+    receiver_tasks = [asyncio.create_task(receive_all(c)) for c in receivers]
+
+    started = time.perf_counter()
+    for _ in range(messages):
+        await sender.send_to(text_data=json.dumps({
+            'type': 'chat_message',
+            'message': repr(time.perf_counter()),
+        }))
+        await drain_until(sender, 'message_sent')
+    await asyncio.gather(*receiver_tasks)
+    elapsed = time.perf_counter() - started
+
+    for communicator in clients:
+        await communicator.disconnect()
+
+    latencies.sort()
+    return {
+        'consumer': consumer_class.__name__,
+        'messages_per_second': messages / elapsed,
+        'deliveries_per_second': messages * len(receivers) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main(args):
+    # Os consumers logam cada mensagem; aqui interessa só o custo do transporte
+    logging.disable(logging.CRITICAL)
+
+    print("🧪 Benchmark de fan-out do chat")
+    print("=" * 50)
+    print(f"👥 Membros por sala: {args.members}")
+    print(f"💬 Mensagens: {args.messages}")
+
+    for consumer_class in (ChatConsumer, AsyncChatConsumer):
+        result = await run_benchmark(consumer_class, args.members, args.messages)
+        print(f"\n📊 {result['consumer']}")
+        print(f"   mensagens/s:  {result['messages_per_second']:.1f}")
+        print(f"   entregas/s:   {result['deliveries_per_second']:.1f}")
+        print(f"   fan-out p50:  {result['p50_ms']:.2f} ms")
+        print(f"   fan-out p99:  {result['p99_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
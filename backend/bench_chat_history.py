@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Benchmark do histórico do chat - INSERT por mensagem vs buffer write-behind
+
+Compara ChatMessage.objects.create() por mensagem (o que o hot path do
+WebSocket faria sem buffer) com o MessageWriteBuffer, que grava em lote com
+bulk_create. Para o buffer são medidos o tempo gasto no hot path (add) e o
+tempo até tudo estar gravado (close).
+
+Uso:
+    python bench_chat_history.py --engine sqlite --messages 5000
+    python bench_chat_history.py --engine mysql   # usa serviceAccountKey.json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+
+def database_config(engine):
+    if engine == 'mysql':
+        with open(os.path.join(BASE_DIR, 'serviceAccountKey.json')) as f:
+            secrets = json.load(f)
+        return {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': secrets["db"]["NAME"],
+            'USER': secrets["db"]["USER"],
+            'PASSWORD': secrets["db"]["PASSWORD"],
+            'HOST': secrets["db"]["HOST"],
+            'PORT': secrets["db"]["PORT"],
+            'OPTIONS': {
+                'charset': 'utf8mb4',
+            },
+        }
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'),
+    }
+
+
+def setup(engine):
+    settings.configure(
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'user',
+            'chat',
+        ],
+        AUTH_USER_MODEL='user.CustomUser',
+        DATABASES={'default': database_config(engine)},
+        USE_TZ=True,
+        LOGGING_CONFIG=None,
+    )
+    django.setup()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def make_message(i):
+    from chat.models import ChatMessage
+
+    return ChatMessage(
+        room='bench_room',
+        sender_id='bench_user',
+        sender_name='Benchmark',
+        message=f'Mensagem de teste número {i}',
+    )
+
+
+def bench_unbuffered(messages):
+    started = time.perf_counter()
+    for i in range(messages):
+        make_message(i).save()
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed
+
+
+def bench_buffered(messages, flush_size, flush_interval):
+    from chat.buffer import MessageWriteBuffer
+
+    buffer = MessageWriteBuffer(flush_size=flush_size, flush_interval=flush_interval)
+    started = time.perf_counter()
+    for i in range(messages):
+        buffer.add(make_message(i))
+    hot_path = time.perf_counter() - started
+    buffer.close()
+    return hot_path, time.perf_counter() - started
+
+
+def main(args):
+    setup(args.engine)
+    logging.disable(logging.CRITICAL)
+
+    from chat.models import ChatMessage
+
+    print("🧪 Benchmark de gravação do histórico do chat")
+    print("=" * 50)
+    print(f"🗄️ Banco: {args.engine}")
+    print(f"💬 Mensagens: {args.messages}")
+
+    results = [
+        ('INSERT por mensagem', bench_unbuffered(args.messages)),
+        (f'buffer ({args.flush_size} msgs / {args.flush_interval_ms} ms)',
+         bench_buffered(args.messages, args.flush_size, args.flush_interval_ms / 1000)),
+    ]
+
+    for label, (hot_path, total) in results:
+        print(f"\n📊 {label}")
+        print(f"   hot path:        {hot_path * 1000:.1f} ms ({hot_path / args.messages * 1e6:.1f} µs/msg)")
+        print(f"   até gravar tudo: {total * 1000:.1f} ms ({args.messages / total:.0f} msgs/s)")
+
+    stored = ChatMessage.objects.filter(room='bench_room').count()
+    print(f"\n✅ Mensagens gravadas: {stored} (esperado {args.messages * 2})")
+    ChatMessage.objects.filter(room='bench_room').delete()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--engine', choices=['sqlite', 'mysql'], default='sqlite')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--flush-size', type=int, default=50)
+    parser.add_argument('--flush-interval-ms', type=int, default=500)
+    main(parser.parse_args())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Benchmark do custo de logging por mensagem do chat
+
+Reproduz os logs que o consumer emite para cada mensagem (recebida,
+processando, transmitindo, transmitida) e mede o tempo gasto na thread que
+chama o logger - no Daphne, o event loop. Compara:
+
+  - sync:  configuração original (f-string, FileHandler + console na thread)
+  - lazy:  mesmos handlers, argumentos no estilo %s
+  - async: LOG_MODE=async (fila + amostragem + JSON em thread separada)
+
+Os quatro registros são emitidos em INFO nos três modos; no consumer eles
+passaram a DEBUG e, com o nível INFO, nem chegam aos handlers.
+
+Com --slow-ms é simulado um disco/terminal lento em cada escrita, para
+mostrar quanto disso chega ao event loop em cada modo.
+
+Uso:
+    python bench_chat_logging.py --messages 20000
+    python bench_chat_logging.py --messages 2000 --slow-ms 1
+"""
+import argparse
+import logging
+import logging.config
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+from app.log import counters  # noqa: E402
+
+
+class SlowFileHandler(logging.FileHandler):
+    """FileHandler que espera slow_ms a cada registro"""
+
+    def __init__(self, filename, slow_ms=0):
+        super().__init__(filename)
+        self.slow = slow_ms / 1000
+
+    def emit(self, record):
+        if self.slow:
+            time.sleep(self.slow)
+        super().emit(record)
+
+
+def sink_handlers(log_dir, slow_ms, formatter=None):
+    handlers = {
+        'console': {
+            'class': 'logging.FileHandler',
+            'filename': os.devnull,
+        },
+        'file': {
+            '()': SlowFileHandler,
+            'filename': os.path.join(log_dir, 'debug.log'),
+            'slow_ms': slow_ms,
+        },
+    }
+    if formatter:
+        for handler in handlers.values():
+            handler['formatter'] = formatter
+    return handlers
+
+
+def config_for(mode, log_dir, slow_ms):
+    if mode in ('sync', 'lazy'):
+        return {
+            'version': 1,
+            'disable_existing_loggers': False,
+            'handlers': sink_handlers(log_dir, slow_ms),
+            'loggers': {
+                'chat': {'handlers': ['console', 'file'], 'level': 'INFO', 'propagate': False},
+            },
+        }
+
+    return {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {'json': {'()': 'app.log.JsonFormatter'}},
+        'filters': {
+            'sampling': {'()': 'app.log.SamplingFilter', 'rates': {'chat': 0.1}},
+        },
+        'handlers': {
+            **sink_handlers(log_dir, slow_ms, formatter='json'),
+            'queue': {
+                '()': 'app.log.QueueListenerHandler',
+                'handlers': ['console', 'file'],
+                'maxsize': 10000,
+                'filters': ['sampling'],
+            },
+        },
+        'loggers': {
+            'chat': {'handlers': ['queue'], 'level': 'INFO', 'propagate': False},
+        },
+    }
+
+
+def log_message_eager(logger, user_name, room, message):
+    # Como o consumer logava antes: f-string montada mesmo se o nível estiver desligado
+    logger.info(f"📨 Mensagem recebida - Tipo: chat_message, De: {user_name}")
+    logger.info(f"💬 Processando mensagem de {user_name}: '{message[:50]}...'")
+    logger.info(f"📡 Transmitindo mensagem de {user_name} para grupo chat_{room}")
+    logger.info(f"✅ Mensagem transmitida com sucesso para grupo chat_{room}")
+
+
+def log_message_lazy(logger, user_name, room, message):
+    # Mesmos registros em INFO (no consumer eles agora são DEBUG) para medir
+    # só o caminho dos handlers
+    logger.info("📨 Mensagem recebida - Tipo: %s, De: %s", 'chat_message', user_name)
+    logger.info("💬 Processando mensagem de %s: '%s...'", user_name, message[:50])
+    logger.info("📡 Transmitindo mensagem de %s para grupo chat_%s", user_name, room)
+    logger.info("✅ Mensagem transmitida com sucesso para grupo chat_%s", room)
+
+
+def run(mode, messages, slow_ms):
+    log_dir = tempfile.mkdtemp()
+    logging.config.dictConfig(config_for(mode, log_dir, slow_ms))
+    logger = logging.getLogger('chat.consumers')
+    log_message = log_message_eager if mode == 'sync' else log_message_lazy
+    counters.update(dict.fromkeys(counters, 0))
+
+    samples = []
+    started = time.perf_counter()
+    for i in range(messages):
+        t0 = time.perf_counter()
+        log_message(logger, 'Usuário Benchmark', 'bench_room', f'Mensagem de teste número {i}')
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+
+    for handler in logging.getLogger('chat').handlers:
+        if hasattr(handler, 'stop'):
+            handler.stop()
+    samples.sort()
+    return {
+        'per_message': elapsed / messages,
+        'p50': statistics.median(samples),
+        'p99': samples[int(len(samples) * 0.99) - 1],
+        'max': samples[-1],
+        'counters': dict(counters),
+    }
+
+
+def main(args):
+    print("🧪 Benchmark de logging por mensagem do chat")
+    print("=" * 50)
+    print(f"💬 Mensagens: {args.messages}")
+    print(f"🐢 Atraso por escrita: {args.slow_ms} ms")
+
+    for mode in ('sync', 'lazy', 'async'):
+        result = run(mode, args.messages, args.slow_ms)
+        print(f"\n📊 {mode}")
+        print(f"   por mensagem: {result['per_message'] * 1e6:.1f} µs")
+        print(f"   p50 / p99 / máx: {result['p50'] * 1e6:.1f} / {result['p99'] * 1e6:.1f} / {result['max'] * 1e6:.1f} µs")
+        if mode == 'async':
+            print(f"   contadores: {result['counters']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--slow-ms', type=float, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Benchmark das análises da coorte - laço no ORM por paciente vs NumPy
+(user/analytics.py)
+
+Cria um psicólogo com N pacientes e D dias de check-in de cada um, e mede o
+painel da coorte (agregados por semana, variância, correlações entre as
+escalas e pacientes em queda) de três jeitos:
+
+- "ORM por paciente": uma consulta por paciente e as contas em Python, como
+  seria sem o módulo de análises;
+- "NumPy (sem cache)": um values_list da coorte e as contas vetorizadas;
+- "NumPy (com cache)": a mesma chamada com o resultado já no cache, que custa
+  só a consulta da versão (MoodStats).
+
+Uso:
+    python bench_cohort_analytics.py --patients 1000 --days 730 --rounds 3
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'rest_framework',
+            'user',
+        ],
+        AUTH_USER_MODEL='user.CustomUser',
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'),
+            },
+        },
+        USE_TZ=True,
+        LOGGING_CONFIG=None,
+    )
+    django.setup()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+from django.db import connection, reset_queries  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from user import analytics  # noqa: E402
+from user.models import CustomUser, DailyCheckin, Session  # noqa: E402
+from user.mood import SCALES  # noqa: E402
+
+
+def populate(patients, days):
+    rng = random.Random(42)
+    today = timezone.localdate()
+    psychologist = CustomUser.objects.create(username='dra', email='dra@bench.local', type='psychologist')
+    CustomUser.objects.bulk_create(
+        CustomUser(username=f'p{i}', email=f'p{i}@bench.local', type='user') for i in range(patients)
+    )
+    users = list(CustomUser.objects.filter(type='user').order_by('id'))
+    Session.objects.bulk_create(Session(psychologist=psychologist, user=user) for user in users)
+
+    batch = []
+    for user in users:
+        level = rng.randint(3, 8)
+        for offset in range(days):
+            level = min(max(level + rng.choice((-1, 0, 0, 1)), 0), 10)
+            batch.append(DailyCheckin(
+                user=user, date=today - timedelta(days=offset),
+                intensity=level, energy=rng.randint(0, 10), stability=min(max(level + rng.randint(-2, 2), 0), 10),
+            ))
+            if len(batch) >= 20000:
+                DailyCheckin.objects.bulk_create(batch)
+                batch = []
+    DailyCheckin.objects.bulk_create(batch)
+    # As estatísticas por paciente (MoodStats) dão a versão do cache
+    call_command('rebuild_mood_stats', verbosity=0, stdout=open(os.devnull, 'w'))
+    return psychologist, today
+
+
+def orm_per_patient(psychologist, days, today):
+    """The same numbers with one query per patient and plain Python"""
+    start = today - timedelta(days=days - 1)
+    result = {}
+    patient_ids = Session.objects.filter(psychologist=psychologist).values_list('user_id', flat=True)
+    for user_id in patient_ids:
+        rows = list(
+            DailyCheckin.objects.filter(user_id=user_id, date__gte=start)
+            .order_by('date').values_list('date', *SCALES)
+        )
+        if not rows:
+            continue
+        weeks = {}
+        for row in rows:
+            weeks.setdefault(row[0] - timedelta(days=row[0].weekday()), []).append(row[1:])
+        columns = list(zip(*(row[1:] for row in rows)))
+        recent = [row for row in rows if (today - row[0]).days < 28]
+        result[user_id] = {
+            'weeks': {
+                week: [statistics.fmean(values) for values in zip(*items)] for week, items in weeks.items()
+            },
+            'mean': [statistics.fmean(column) for column in columns],
+            'variance': [statistics.pvariance(column) for column in columns],
+            'correlation': [
+                statistics.correlation(columns[a], columns[b]) if len(rows) > 1 else None
+                for a, b in analytics.PAIRS
+            ],
+            'trend': statistics.linear_regression(
+                [row[0].toordinal() for row in recent],
+                [sum(row[1:]) / 3 for row in recent],
+            ).slope if len(recent) > 1 else None,
+        }
+    return result
+
+
+def timed(label, func, rounds):
+    timings = []
+    for _ in range(rounds):
+        reset_queries()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    queries = len(connection.queries)
+    print(f"   {label:<22} {statistics.median(timings) * 1000:>9.1f} ms  ({queries} consultas)")
+    return statistics.median(timings)
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)
+    settings.DEBUG = True  # conta as consultas
+
+    print("🧪 Benchmark das análises da coorte (ORM por paciente vs NumPy)")
+    print("=" * 50)
+    print(f"👥 Pacientes: {args.patients}")
+    print(f"📅 Dias de histórico: {args.days}")
+    print(f"🔁 Rodadas: {args.rounds}")
+
+    started = time.perf_counter()
+    psychologist, today = populate(args.patients, args.days)
+    print(f"⏱️  {DailyCheckin.objects.count()} check-ins criados em {time.perf_counter() - started:.1f}s")
+
+    cache = analytics.get_analytics_cache()
+    for days in (90, args.days):
+        print(f"\n📊 Janela de {days} dias, por semana")
+
+        def numpy_cold():
+            cache.clear()
+            analytics.cohort_analytics(psychologist.id, 'week', days, today=today)
+
+        def numpy_cached():
+            analytics.cohort_analytics(psychologist.id, 'week', days, today=today)
+
+        orm = timed('ORM por paciente', lambda: orm_per_patient(psychologist, days, today), args.rounds)
+        cold = timed('NumPy (sem cache)', numpy_cold, args.rounds)
+        cached = timed('NumPy (com cache)', numpy_cached, args.rounds)
+        print(f"   ⚡ {orm / cold:.1f}x mais rápido sem cache, {orm / cached:.0f}x com cache")
+
+        started = time.perf_counter()
+        user_ids, dates, scores = analytics.load_checkins(psychologist.id, today - timedelta(days=days - 1))
+        loaded = time.perf_counter()
+        analytics.compute(user_ids, dates, scores, 'week', today)
+        print(f"   consulta + arrays {(loaded - started) * 1000:.1f} ms, "
+              f"contas {(time.perf_counter() - loaded) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--rounds', type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Benchmark da autenticação Firebase - com e sem cache de tokens verificados
+
+Faz requisições DRF autenticadas (FirebaseAuthentication) e mede a latência
+com FIREBASE_TOKEN_CACHE_ENABLED ligado e desligado. Os ID tokens são
+assinados com uma chave RSA local e os certificados são servidos em memória,
+no lugar do endpoint do Google: a verificação do firebase_admin (parse dos
+certificados + RSA) roda de verdade, só a rede fica de fora.
+
+Uso:
+    python bench_firebase_auth.py --users 50 --requests 2000
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+PROJECT_ID = 'bench-project'
+KEY_ID = 'bench-key'
+
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'rest_framework',
+            'user',
+        ],
+        AUTH_USER_MODEL='user.CustomUser',
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'),
+            },
+        },
+        USE_TZ=True,
+        LOGGING_CONFIG=None,
+    )
+    django.setup()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+import firebase_admin  # noqa: E402
+from cryptography import x509  # noqa: E402
+from cryptography.hazmat.primitives import hashes, serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+from cryptography.x509.oid import NameOID  # noqa: E402
+from firebase_admin import auth, credentials  # noqa: E402
+from google.auth import crypt, jwt  # noqa: E402
+from google.auth.transport import Response  # noqa: E402
+
+
+class LocalCertResponse(Response):
+    def __init__(self, body):
+        self._body = body
+
+    @property
+    def status(self):
+        return 200
+
+    @property
+    def headers(self):
+        return {'cache-control': 'public, max-age=3600'}
+
+    @property
+    def data(self):
+        return self._body
+
+
+class LocalCertRequest:
+    """Transport que responde qualquer GET com os certificados locais"""
+
+    def __init__(self, certs):
+        self.body = json.dumps(certs).encode()
+
+    def __call__(self, url, method='GET', **kwargs):
+        return LocalCertResponse(self.body)
+
+
+def setup_firebase():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'bench')])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate({
+            'type': 'service_account',
+            'project_id': PROJECT_ID,
+            'private_key': pem,
+            'client_email': f'bench@{PROJECT_ID}.iam.gserviceaccount.com',
+            'token_uri': 'https://oauth2.googleapis.com/token',
+        }))
+    client = auth._get_client(None)
+    client._token_verifier.request = LocalCertRequest(
+        {KEY_ID: cert.public_bytes(serialization.Encoding.PEM).decode()}
+    )
+    return crypt.RSASigner.from_string(pem, key_id=KEY_ID)
+
+
+def make_token(signer, uid):
+    now = int(time.time())
+    payload = {
+        'iss': f'https://securetoken.google.com/{PROJECT_ID}',
+        'aud': PROJECT_ID,
+        'sub': uid,
+        'auth_time': now,
+        'iat': now,
+        'exp': now + 3600,
+        'email': f'{uid}@bench.local',
+        'name': f'Usuário {uid}',
+    }
+    return jwt.encode(signer, payload).decode()
+
+
+def bench(tokens, requests, cache_enabled):
+    from django.test import RequestFactory, override_settings
+    from rest_framework.decorators import api_view, authentication_classes
+    from rest_framework.response import Response as DRFResponse
+
+    from user.authentication import FirebaseAuthentication
+    from user.tokens import counters, get_token_cache
+
+    @api_view(['GET'])
+    @authentication_classes([FirebaseAuthentication])
+    def whoami(request):
+        return DRFResponse({'id': request.user.id})
+
+    factory = RequestFactory()
+    get_token_cache().clear()
+    counters.update(dict.fromkeys(counters, 0))
+
+    samples = []
+    with override_settings(FIREBASE_TOKEN_CACHE_ENABLED=cache_enabled):
+        for i in range(requests):
+            request = factory.get('/whoami/', HTTP_AUTHORIZATION=f'Bearer {tokens[i % len(tokens)]}')
+            started = time.perf_counter()
+            response = whoami(request)
+            samples.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.data
+
+    samples.sort()
+    return {
+        'mean': statistics.mean(samples),
+        'p50': statistics.median(samples),
+        'p99': samples[int(len(samples) * 0.99) - 1],
+        'counters': dict(counters),
+    }
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)
+    signer = setup_firebase()
+    tokens = [make_token(signer, f'bench_user_{i}') for i in range(args.users)]
+
+    print("🧪 Benchmark de autenticação Firebase")
+    print("=" * 50)
+    print(f"👥 Usuários (tokens distintos): {args.users}")
+    print(f"📨 Requisições: {args.requests}")
+
+    # Aquecer: cria os usuários no banco para as duas rodadas partirem do mesmo estado
+    bench(tokens, len(tokens), cache_enabled=False)
+
+    for label, enabled in (('sem cache', False), ('com cache', True)):
+        result = bench(tokens, args.requests, enabled)
+        print(f"\n📊 {label}")
+        print(f"   média: {result['mean'] * 1000:.3f} ms")
+        print(f"   p50 / p99: {result['p50'] * 1000:.3f} / {result['p99'] * 1000:.3f} ms")
+        if enabled:
+            hits = result['counters']['token_cache_hits']
+            print(f"   acertos: {hits}/{args.requests} ({hits / args.requests:.1%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    main(parser.parse_args())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Benchmark de arquivos de mídia - static() do Django vs app/media.py
+
+Serve arquivos de MEDIA_ROOT direto pelo ASGIHandler do Django (o que o
+Daphne chama) com N downloads simultâneos, pela rota antiga
+(django.conf.urls.static / django.views.static.serve) e pela nova
+(app.media.serve_media). Mede requisições por segundo, MB/s, latência e o
+pico de memória alocada durante a rodada, para uma miniatura, uma foto
+média e um arquivo grande. Também mede a revalidação (If-None-Match -> 304)
+e um pedido de Range na rota nova. O pico de memória (tracemalloc) só é
+medido com --memory, porque o tracemalloc deixa tudo mais lento.
+
+Uso:
+    python bench_media_serving.py --concurrency 100 --rounds 3
+    python bench_media_serving.py --memory
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=[],
+        ROOT_URLCONF=__name__,
+        ALLOWED_HOSTS=['testserver'],
+        MEDIA_ROOT=MEDIA_ROOT,
+        MEDIA_URL='/media/',
+        USE_TZ=True,
+        LOGGING_CONFIG=None,
+    )
+    django.setup()
+
+from django.conf.urls.static import static  # noqa: E402
+from django.core.handlers.asgi import ASGIHandler  # noqa: E402
+from django.urls import re_path  # noqa: E402
+
+from app.media import serve_media  # noqa: E402
+
+# static() só gera a rota com DEBUG; aqui ela é montada do mesmo jeito
+settings.DEBUG = True
+urlpatterns = static('/static-media/', document_root=MEDIA_ROOT) + [
+    re_path(r'^media/(?P<path>.*)$', serve_media),
+]
+settings.DEBUG = False
+
+FILES = {
+    # nome com hash, como os gerados por user/photos.py
+    'miniatura (4 KB)': ('a' * 64 + '_thumb.webp', 4 * 1024),
+    'foto média (60 KB)': ('b' * 64 + '_medium.webp', 60 * 1024),
+    'arquivo grande (8 MB)': ('c' * 64 + '.png', 8 * 1024 * 1024),
+}
+
+
+async def get(app, url, headers=()):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': url,
+        'raw_path': url.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), *headers],
+        'client': ('127.0.0.1', 40000),
+        'server': ('testserver', 80),
+    }
+    disconnected = asyncio.Event()
+    sent = []
+
+    async def receive():
+        if not sent:
+            sent.append(None)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Cliente continua conectado até a resposta ser enviada
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    status = None
+    received = 0
+    response_headers = {}
+
+    async def send(message):
+        nonlocal status, received
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            response_headers.update((k.decode(), v.decode()) for k, v in message['headers'])
+        else:
+            received += len(message.get('body', b''))
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    disconnected.set()
+    return status, received, response_headers, time.perf_counter() - started
+
+
+async def run(app, url, concurrency, headers=(), expected=200):
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(get(app, url, headers) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] - before
+
+    statuses = {status for status, _, _, _ in results}
+    assert statuses == {expected}, statuses
+    latencies = sorted(latency for _, _, _, latency in results)
+    return {
+        'rps': concurrency / elapsed,
+        'mbps': sum(received for _, received, _, _ in results) / elapsed / 1024 / 1024,
+        'p99': latencies[int(len(latencies) * 0.99) - 1],
+        'peak_mb': peak / 1024 / 1024,
+        'headers': results[0][2],
+    }
+
+
+def report(label, rounds):
+    line = (f"   {label:<22} {statistics.mean(r['rps'] for r in rounds):>8.0f} req/s "
+            f"{statistics.mean(r['mbps'] for r in rounds):>8.1f} MB/s  "
+            f"p99 {statistics.mean(r['p99'] for r in rounds) * 1000:>7.1f} ms")
+    if tracemalloc.is_tracing():
+        line += f"  pico de memória {max(r['peak_mb'] for r in rounds):>7.1f} MB"
+    print(line)
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)
+    for name, size in FILES.values():
+        with open(os.path.join(MEDIA_ROOT, name), 'wb') as f:
+            f.write(os.urandom(size))
+
+    app = ASGIHandler()
+    if args.memory:
+        tracemalloc.start()
+
+    print("🧪 Benchmark de mídia (static() vs app/media.py)")
+    print("=" * 50)
+    print(f"🔀 Downloads simultâneos: {args.concurrency}")
+    print(f"🔁 Rodadas: {args.rounds}")
+
+    async def bench():
+        for label, (name, size) in FILES.items():
+            concurrency = args.concurrency if size < 1024 * 1024 else max(args.concurrency // 10, 1)
+            print(f"\n📊 {label}, {concurrency} simultâneos")
+            old = [await run(app, f'/static-media/{name}', concurrency) for _ in range(args.rounds)]
+            new = [await run(app, f'/media/{name}', concurrency) for _ in range(args.rounds)]
+            report('static()', old)
+            report('serve_media', new)
+
+            etag = new[0]['headers']['ETag'].encode()
+            revalidate = [
+                await run(app, f'/media/{name}', concurrency, [(b'if-none-match', etag)], 304)
+                for _ in range(args.rounds)
+            ]
+            report('serve_media (304)', revalidate)
+            ranged = [
+                await run(app, f'/media/{name}', concurrency, [(b'range', b'bytes=0-1023')], 206)
+                for _ in range(args.rounds)
+            ]
+            report('serve_media (Range)', ranged)
+            print(f"   Cache-Control: {new[0]['headers']['Cache-Control']}")
+
+    asyncio.run(bench())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--memory', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Benchmark de pico de cadastros - hash de senha na thread da requisição vs
+pool de processos (user/hashing.py)
+
+Dispara N cadastros (POST /api/users/) de uma vez direto no ASGIHandler do
+Django, enquanto um usuário já logado faz GET /api/users/<id>/ em sequência.
+Mede cadastros por segundo sustentados, quantos receberam 503 (fila de hash
+cheia) e a latência dos GETs durante o pico.
+
+No modo "inline" o hash roda como antes (make_password via sync_to_async,
+na thread da requisição); no modo "pool" passa pelo PasswordHashingService.
+O hasher é o padrão do Django (PBKDF2, mesmas iterações de produção).
+
+Uso:
+    python bench_signup_burst.py --signups 64 --workers 2 --max-pending 32
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.urls import path
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'rest_framework',
+            'user',
+        ],
+        AUTH_USER_MODEL='user.CustomUser',
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'),
+                'OPTIONS': {'timeout': 30},
+            },
+        },
+        ROOT_URLCONF=__name__,
+        ALLOWED_HOSTS=['testserver'],
+        USE_TZ=True,
+        REST_FRAMEWORK={
+            'DEFAULT_AUTHENTICATION_CLASSES': ['user.authentication.FirebaseAuthentication'],
+        },
+        LOGGING_CONFIG=None,
+    )
+    django.setup()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+from asgiref.sync import sync_to_async  # noqa: E402
+from bench_firebase_auth import make_token, setup_firebase  # noqa: E402
+from django.contrib.auth.hashers import make_password  # noqa: E402
+from django.core.handlers.asgi import ASGIHandler  # noqa: E402
+
+# O app do firebase_admin precisa existir antes de importar as views
+SIGNER = setup_firebase()
+
+from user import async_views, hashing  # noqa: E402
+
+urlpatterns = [
+    path('users/', async_views.create_user_view),
+    path('users/<int:user_id>/', async_views.user_detail_view),
+]
+
+
+async def call(app, method, url, token=None, body=b''):
+    headers = [(b'host', b'testserver'), (b'content-type', b'application/json')]
+    if token:
+        headers.append((b'authorization', f'Bearer {token}'.encode()))
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': url,
+        'raw_path': url.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': headers,
+        'client': ('127.0.0.1', 40000),
+        'server': ('testserver', 80),
+    }
+    disconnected = asyncio.Event()
+    sent = []
+
+    async def receive():
+        if not sent:
+            sent.append(None)
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # Cliente continua conectado até a resposta ser enviada
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    status = None
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    disconnected.set()
+    return status, time.perf_counter() - started
+
+
+def signup_body(run, i):
+    return json.dumps({
+        'name': f'Pessoa {i}',
+        'email': f'{run}_{i}@bench.local',
+        'username': f'{run}_{i}',
+        'password': 'senha-forte-123',
+        'type': 'user',
+        'birth': '1990-01-01',
+        'phone': '11999999999',
+    }).encode()
+
+
+async def burst(app, run, signups, reader_url, token):
+    done = asyncio.Event()
+    probes = []
+
+    async def reader():
+        while not done.is_set():
+            status, latency = await call(app, 'GET', reader_url, token)
+            assert status == 200, status
+            probes.append(latency)
+
+    reader_task = asyncio.create_task(reader())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        call(app, 'POST', '/users/', body=signup_body(run, i)) for i in range(signups)
+    ))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await reader_task
+
+    statuses = [status for status, _ in results]
+    assert set(statuses) <= {201, 503}, set(statuses)
+    probes.sort()
+    return {
+        'created': statuses.count(201),
+        'busy': statuses.count(503),
+        'elapsed': elapsed,
+        'probe_p50': statistics.median(probes),
+        'probe_p99': probes[max(int(len(probes) * 0.99) - 1, 0)],
+        'probes': len(probes),
+    }
+
+
+def report(label, result):
+    print(f"\n📊 {label}")
+    print(f"   cadastros/s: {result['created'] / result['elapsed']:.1f} "
+          f"({result['created']} em {result['elapsed']:.2f}s)")
+    print(f"   recusados (503): {result['busy']}")
+    print(f"   GET durante o pico: {result['probes']} requisições, p50 / p99 "
+          f"{result['probe_p50'] * 1000:.1f} / {result['probe_p99'] * 1000:.1f} ms")
+
+
+def main(args):
+    from user.accounts import get_or_create_firebase_user
+
+    logging.disable(logging.CRITICAL)
+    reader = get_or_create_firebase_user(
+        {'uid': 'bench_reader', 'email': 'reader@bench.local', 'name': 'Leitor'}
+    )
+    token = make_token(SIGNER, 'bench_reader')
+    reader_url = f'/users/{reader.id}/'
+    app = ASGIHandler()
+
+    hashing._service = hashing.PasswordHashingService(
+        workers=args.workers, max_pending=args.max_pending, wait=args.wait,
+    )
+    # Sobe os processos do pool antes de medir
+    for _ in range(args.workers):
+        hashing.hash_password('aquecimento')
+
+    print("🧪 Benchmark de pico de cadastros (hash inline vs pool de processos)")
+    print("=" * 50)
+    print(f"👥 Cadastros simultâneos: {args.signups}")
+    print(f"⚙️  Pool: {args.workers} processos, até {args.max_pending} na fila, "
+          f"espera máx. {args.wait}s")
+    print(f"🖥️  CPUs: {os.cpu_count()}")
+
+    async def bench():
+        # Aquecer token e cache do leitor
+        await call(app, 'GET', reader_url, token)
+
+        inline = sync_to_async(make_password)
+        with mock.patch.object(async_views, 'ahash_password', inline):
+            report('inline (make_password na thread da requisição)',
+                   await burst(app, 'inline', args.signups, reader_url, token))
+
+        report('pool de processos',
+               await burst(app, 'pool', args.signups, reader_url, token))
+
+    asyncio.run(bench())
+    hashing.get_hashing_service().shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--signups', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-pending', type=int, default=32)
+    parser.add_argument('--wait', type=float, default=2.0)
+    main(parser.parse_args())
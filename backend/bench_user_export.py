@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Benchmark da exportação de dados de um usuário - tudo em memória vs
+streaming (user/export.py)
+
+Cria um usuário sintético com N anos de check-ins diários (com notas de
+tamanho configurável) e uma sessão por semana, e baixa a exportação dele por
+GET /api/export/<id>/ direto no ASGIHandler do Django (o que o Daphne chama).
+Cada modo roda em um processo separado, para o pico de RSS (ru_maxrss) de um
+não contaminar o outro:
+
+- "em memória": todas as linhas em listas, json.dumps e HttpResponse, como
+  seria sem user/export.py;
+- NDJSON, CSV e NDJSON + gzip pelo streaming.
+
+Mede o tempo, os bytes enviados e quanto o pico de RSS do processo subiu
+durante a exportação.
+
+Uso:
+    python bench_user_export.py --years 10 --notes-size 2000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.urls import path
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+# O processo filho recebe o banco já populado pelo pai
+DB_PATH = os.environ.get('BENCH_EXPORT_DB') or os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'rest_framework',
+            'user',
+        ],
+        AUTH_USER_MODEL='user.CustomUser',
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': DB_PATH,
+            },
+        },
+        REST_FRAMEWORK={
+            'DEFAULT_AUTHENTICATION_CLASSES': ['user.authentication.FirebaseAuthentication'],
+            'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
+        },
+        ROOT_URLCONF=__name__,
+        ALLOWED_HOSTS=['testserver'],
+        USE_TZ=True,
+        LOGGING_CONFIG=None,
+    )
+    django.setup()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+from bench_firebase_auth import make_token, setup_firebase  # noqa: E402
+from django.core.handlers.asgi import ASGIHandler  # noqa: E402
+from django.core.serializers.json import DjangoJSONEncoder  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+# O app do firebase_admin precisa existir antes de importar as views (e o DRF,
+# que importa user.authentication)
+SIGNER = setup_firebase()
+
+from rest_framework.decorators import api_view  # noqa: E402
+from user import views  # noqa: E402
+from user.export import CHECKIN_FIELDS, PROFILE_FIELDS, SESSION_FIELDS  # noqa: E402
+from user.models import CustomUser, DailyCheckin, Session  # noqa: E402
+
+
+@api_view(['GET'])
+def export_in_memory(request, user_id):
+    """The export without user/export.py: every row loaded, one json.dumps"""
+    user = CustomUser.objects.get(pk=user_id)
+    data = {
+        'profile': {field: getattr(user, field) for field in PROFILE_FIELDS if field != 'photo'},
+        'checkins': list(DailyCheckin.objects.filter(user=user).order_by('date').values(*CHECKIN_FIELDS)),
+        'sessions': list(Session.objects.filter(user=user).values(*SESSION_FIELDS)),
+    }
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder), content_type='application/json')
+
+
+urlpatterns = [
+    path('export/<int:user_id>/', views.export_user_data),
+    path('export-in-memory/<int:user_id>/', export_in_memory),
+]
+
+MODES = {
+    'em memória': ('/export-in-memory/{id}/', ''),
+    'NDJSON': ('/export/{id}/', ''),
+    'CSV': ('/export/{id}/', 'output=csv'),
+    'NDJSON + gzip': ('/export/{id}/', 'gzip=1'),
+}
+
+
+def populate(years, notes_size):
+    from user.accounts import get_or_create_firebase_user
+
+    user = get_or_create_firebase_user({'uid': 'bench_export', 'email': 'export@bench.local', 'name': 'Export'})
+    psychologist = CustomUser.objects.create(username='dra', email='dra@bench.local', type='psychologist')
+    today = timezone.localdate()
+    days = 365 * years
+    note = ('Dia comum, dormi bem e trabalhei. ' * (notes_size // 34 + 1))[:notes_size]
+    batch = []
+    for offset in range(days):
+        batch.append(DailyCheckin(
+            user=user, date=today - timedelta(days=offset),
+            intensity=offset % 11, energy=(offset * 3) % 11, stability=(offset * 7) % 11,
+            notes=note, tags=['sono', 'trabalho'],
+        ))
+        if len(batch) >= 5000:
+            DailyCheckin.objects.bulk_create(batch)
+            batch = []
+    DailyCheckin.objects.bulk_create(batch)
+    Session.objects.bulk_create(
+        Session(psychologist=psychologist, user=user, date=today - timedelta(days=offset))
+        for offset in range(0, days, 7)
+    )
+    return user
+
+
+async def download(app, url, query, token):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': url,
+        'raw_path': url.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode())],
+        'client': ('127.0.0.1', 40000),
+        'server': ('testserver', 80),
+    }
+    disconnected = asyncio.Event()
+    sent = []
+
+    async def receive():
+        if not sent:
+            sent.append(None)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Cliente continua conectado até a resposta ser enviada
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    status = None
+    received = 0
+    messages = 0
+
+    async def send(message):
+        nonlocal status, received, messages
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        else:
+            # O corpo é descartado, como um cliente que grava em disco
+            received += len(message.get('body', b''))
+            messages += 1
+
+    await app(scope, receive, send)
+    disconnected.set()
+    return status, received, messages
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(mode):
+    """Run one export in this process and print its numbers as JSON"""
+    logging.disable(logging.CRITICAL)
+    user = CustomUser.objects.get(username='bench_export')
+    token = make_token(SIGNER, 'bench_export')
+    url, query = MODES[mode]
+    url = url.format(id=user.id)
+    app = ASGIHandler()
+
+    # Aquecer imports, token e conexão com uma exportação de outro usuário
+    asyncio.run(download(app, url.replace(str(user.id), str(user.id + 1)), query, token))
+    before = max_rss_mb()
+    started = time.perf_counter()
+    status, received, messages = asyncio.run(download(app, url, query, token))
+    elapsed = time.perf_counter() - started
+    assert status == 200, status
+    print(json.dumps({
+        'elapsed': elapsed, 'bytes': received, 'messages': messages,
+        'before': before, 'peak': max_rss_mb(),
+    }))
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)
+    print("🧪 Benchmark da exportação de dados (em memória vs streaming)")
+    print("=" * 50)
+    print(f"📅 Anos de check-ins diários: {args.years}")
+    print(f"📝 Tamanho das notas: {args.notes_size} caracteres")
+
+    started = time.perf_counter()
+    populate(args.years, args.notes_size)
+    print(f"⏱️  {DailyCheckin.objects.count()} check-ins e {Session.objects.count()} sessões "
+          f"criados em {time.perf_counter() - started:.1f}s")
+
+    env = {**os.environ, 'BENCH_EXPORT_DB': DB_PATH}
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', mode],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"\n📊 {mode}")
+        print(f"   {result['elapsed'] * 1000:.0f} ms, {result['bytes'] / 1024 / 1024:.1f} MB "
+              f"em {result['messages']} mensagens ASGI")
+        print(f"   pico de RSS: {result['peak']:.1f} MB "
+              f"(+{result['peak'] - result['before']:.1f} MB durante a exportação)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--notes-size', type=int, default=2000)
+    parser.add_argument('--child', choices=list(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+    else:
+        main(args)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Benchmark das views de usuário - DRF sync vs views async no ASGI
+
+Dispara N requisições simultâneas de GET /api/users/<id>/ direto no
+ASGIHandler do Django (o que o Daphne chama), autenticadas com ID tokens
+Firebase locais (veja bench_firebase_auth.py). Compara a view DRF sync
+(sync_user_detail, a view @api_view que user_detail_view substituiu, executada
+via sync_to_async) com a async
+(async_views.user_detail_view) em requisições por segundo, latência e
+número máximo de threads do processo durante a rodada.
+
+Uso:
+    python bench_user_views_async.py --concurrency 500 --rounds 3
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.urls import path
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'rest_framework',
+            'user',
+        ],
+        AUTH_USER_MODEL='user.CustomUser',
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'),
+            },
+        },
+        ROOT_URLCONF=__name__,
+        ALLOWED_HOSTS=['testserver'],
+        REST_FRAMEWORK={
+            'DEFAULT_AUTHENTICATION_CLASSES': ['user.authentication.FirebaseAuthentication'],
+            'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
+        },
+        USE_TZ=True,
+        LOGGING_CONFIG=None,
+    )
+    django.setup()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+from bench_firebase_auth import make_token, setup_firebase  # noqa: E402
+from django.core.handlers.asgi import ASGIHandler  # noqa: E402
+
+# O app do firebase_admin precisa existir antes de importar as views
+SIGNER = setup_firebase()
+
+from rest_framework import status  # noqa: E402
+from rest_framework.decorators import api_view  # noqa: E402
+from rest_framework.response import Response  # noqa: E402
+from user import async_views, views  # noqa: E402
+from user.accounts import get_profile_cache, profile_key  # noqa: E402
+from user.models import CustomUser  # noqa: E402
+
+
+@api_view(['GET'])
+def sync_user_detail(request, user_id):
+    """GET of user_detail_view as a DRF sync view, with the same profile cache"""
+    cache = get_profile_cache()
+    entry = cache.get(profile_key(user_id))
+    if entry is None:
+        user = CustomUser.objects.filter(id=user_id).first()
+        if user is None:
+            return Response({'error': 'Usuário não encontrado.'}, status=status.HTTP_404_NOT_FOUND)
+        entry = views.profile_entry(user)
+        cache.set(profile_key(user_id), entry, timeout=300)
+    response = Response(views.profile_payload(request, entry), status=status.HTTP_200_OK)
+    return views.conditional_response(request, response, entry['etag'], entry['last_modified'])
+
+
+urlpatterns = [
+    path('sync/users/<int:user_id>/', sync_user_detail),
+    path('async/users/<int:user_id>/', async_views.user_detail_view),
+]
+
+
+async def get(app, url, token):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': url,
+        'raw_path': url.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode())],
+        'client': ('127.0.0.1', 40000),
+        'server': ('testserver', 80),
+    }
+    disconnected = asyncio.Event()
+    sent = []
+
+    async def receive():
+        if not sent:
+            sent.append(None)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Cliente continua conectado até a resposta ser enviada
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    status = None
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    disconnected.set()
+    return status, time.perf_counter() - started
+
+
+async def sample_threads(stop, peak):
+    while not stop.is_set():
+        peak[0] = max(peak[0], threading.active_count())
+        await asyncio.sleep(0.005)
+
+
+async def run(app, prefix, users, tokens, concurrency):
+    stop = asyncio.Event()
+    peak = [threading.active_count()]
+    sampler = asyncio.create_task(sample_threads(stop, peak))
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        get(app, f'/{prefix}/users/{users[i % len(users)].id}/', tokens[i % len(tokens)])
+        for i in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await sampler
+    statuses = [status for status, _ in results]
+    latencies = sorted(latency for _, latency in results)
+    assert all(status == 200 for status in statuses), set(statuses)
+    return {
+        'rps': concurrency / elapsed,
+        'p50': statistics.median(latencies),
+        'p99': latencies[int(len(latencies) * 0.99) - 1],
+        'threads': peak[0],
+    }
+
+
+def main(args):
+    from user.accounts import get_or_create_firebase_user
+
+    logging.disable(logging.CRITICAL)
+    uids = [f'bench_user_{i}' for i in range(args.users)]
+    tokens = [make_token(SIGNER, uid) for uid in uids]
+    users = [
+        get_or_create_firebase_user({'uid': uid, 'email': f'{uid}@bench.local', 'name': uid})
+        for uid in uids
+    ]
+    app = ASGIHandler()
+
+    print("🧪 Benchmark das views de usuário (sync vs async)")
+    print("=" * 50)
+    print(f"🔀 Requisições simultâneas: {args.concurrency}")
+    print(f"🔁 Rodadas: {args.rounds}")
+
+    async def bench():
+        # Aquecer: tokens verificados e usuários em cache para as duas views
+        await run(app, 'async', users, tokens, len(tokens))
+        for label, prefix in (('DRF sync', 'sync'), ('async', 'async')):
+            rounds = [await run(app, prefix, users, tokens, args.concurrency) for _ in range(args.rounds)]
+            print(f"\n📊 {label}")
+            print(f"   req/s: {statistics.mean(r['rps'] for r in rounds):.0f}")
+            print(f"   latência p50 / p99: {statistics.mean(r['p50'] for r in rounds) * 1000:.1f} / "
+                  f"{statistics.mean(r['p99'] for r in rounds) * 1000:.1f} ms")
+            print(f"   threads (máx): {max(r['threads'] for r in rounds)}")
+
+    asyncio.run(bench())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--users', type=int, default=50)
+    main(parser.parse_args())
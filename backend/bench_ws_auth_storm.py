@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Benchmark de tempestade de reconexão - lag do event loop na autenticação
+
+Simula N clientes reconectando ao mesmo tempo (vários com o mesmo ID token)
+através do FirebaseWebSocketAuthMiddleware e mede o atraso do event loop
+com uma tarefa que acorda a cada 1 ms. Compara:
+
+  - antes:  verificação bloqueante no event loop (como o middleware fazia),
+            com a busca dos certificados acontecendo inline
+  - depois: averify_id_token (pool limitado + single-flight) com as chaves
+            públicas já buscadas em background
+
+Tokens e certificados são locais (veja bench_firebase_auth.py); a busca dos
+certificados leva --cert-latency-ms para simular a rede.
+
+Uso:
+    python bench_ws_auth_storm.py --clients 1000 --users 200 --spread-ms 500
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'channels',
+            'user',
+            'chat',
+        ],
+        AUTH_USER_MODEL='user.CustomUser',
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'),
+            },
+        },
+        USE_TZ=True,
+        LOGGING_CONFIG=None,
+    )
+    django.setup()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+from bench_firebase_auth import LocalCertRequest, make_token, setup_firebase  # noqa: E402
+from firebase_admin import _token_gen, auth  # noqa: E402
+
+
+class SlowCertRequest(LocalCertRequest):
+    """Certificados locais, com latência de rede a cada busca"""
+
+    def __init__(self, certs, latency):
+        super().__init__(certs)
+        self.latency = latency
+        self.fetched = False
+
+    def __call__(self, url, method='GET', headers=None, **kwargs):
+        # Como o CacheControl: só vai à rede no primeiro uso ou com no-cache
+        if not self.fetched or (headers or {}).get('cache-control') == 'no-cache':
+            time.sleep(self.latency)
+            self.fetched = True
+        return super().__call__(url, method=method, **kwargs)
+
+
+async def measure_lag(stop, samples, interval=0.001):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def storm(tokens, clients, spread):
+    from chat.authentication import FirebaseWebSocketAuthMiddleware
+
+    authenticated = []
+
+    async def inner(scope, receive, send):
+        authenticated.append(scope['user'].is_authenticated)
+
+    middleware = FirebaseWebSocketAuthMiddleware(inner)
+
+    async def connect(i):
+        # Reconexões chegam espalhadas numa janela curta, não todas no mesmo tick
+        await asyncio.sleep(random.uniform(0, spread))
+        scope = {
+            'type': 'websocket',
+            'query_string': f'token={tokens[i % len(tokens)]}'.encode(),
+            'headers': [],
+        }
+        await middleware(scope, None, None)
+
+    stop = asyncio.Event()
+    samples = []
+    ticker = asyncio.create_task(measure_lag(stop, samples))
+    await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connect(i) for i in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    return elapsed, samples, sum(authenticated)
+
+
+def run(mode, certs, tokens, args):
+    import chat.authentication
+    from user import tokens as token_module
+
+    token_module.get_token_cache().clear()
+    token_module.counters.update(dict.fromkeys(token_module.counters, 0))
+    verifier = auth._get_client(None)._token_verifier
+    transport = SlowCertRequest(certs, args.cert_latency_ms / 1000)
+
+    if mode == 'antes':
+        async def verify_inline(token):
+            return token_module.verify_id_token(token)
+
+        verifier.request = transport
+        chat.authentication.averify_id_token = verify_inline
+    else:
+        verifier.request = token_module.PrefetchedCertRequest(transport)
+        verifier.request.start([_token_gen.ID_TOKEN_CERT_URI])
+        while not token_module.counters['cert_fetches']:
+            time.sleep(0.01)
+        chat.authentication.averify_id_token = token_module.averify_id_token
+
+    elapsed, samples, authenticated = asyncio.run(storm(tokens, args.clients, args.spread_ms / 1000))
+    samples.sort()
+    return {
+        'elapsed': elapsed,
+        'authenticated': authenticated,
+        'lag_p50': statistics.median(samples) if samples else 0,
+        'lag_p99': samples[int(len(samples) * 0.99) - 1] if samples else 0,
+        'lag_max': samples[-1] if samples else 0,
+        'blocked': sum(lag for lag in samples if lag > 0.005),
+        'counters': dict(token_module.counters),
+    }
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)
+    signer = setup_firebase()
+    tokens = [make_token(signer, f'storm_user_{i}') for i in range(args.users)]
+    # Os mesmos certificados que o setup_firebase instalou, agora com latência
+    certs = json.loads(auth._get_client(None)._token_verifier.request.body)
+
+    print("🧪 Benchmark de tempestade de reconexão (autenticação WebSocket)")
+    print("=" * 50)
+    print(f"🔌 Clientes: {args.clients} ({args.users} tokens distintos)")
+    print(f"🌐 Latência da busca de certificados: {args.cert_latency_ms} ms")
+
+    for mode in ('antes', 'depois'):
+        result = run(mode, certs, tokens, args)
+        print(f"\n📊 {mode}")
+        print(f"   tempo total: {result['elapsed'] * 1000:.0f} ms ({result['authenticated']} autenticados)")
+        print(f"   lag do event loop p50 / p99 / máx: "
+              f"{result['lag_p50'] * 1000:.2f} / {result['lag_p99'] * 1000:.2f} / {result['lag_max'] * 1000:.2f} ms")
+        print(f"   tempo com o loop travado (> 5 ms): {result['blocked'] * 1000:.0f} ms")
+        if mode == 'depois':
+            counters = result['counters']
+            print(f"   verificações: {counters['token_verify_started']} "
+                  f"(coalescidas: {counters['token_verify_coalesced']})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--cert-latency-ms', type=float, default=200)
+    parser.add_argument('--spread-ms', type=float, default=500)
+    main(parser.parse_args())
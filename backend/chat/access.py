@@ -0,0 +1,57 @@
+from django.conf import settings
+
+from user.models import Session
+
+# Quem pode entrar numa sala e ler o histórico dela. As salas 1:1 do
+# frontend se chamam "<uid>_<uid>" (uids do Firebase, que são o username do
+# CustomUser, em ordem alfabética), então os participantes saem do próprio
+# nome. Salas em CHAT_PUBLIC_ROOMS (testes, demonstração) aceitam qualquer
+# conexão, mas o histórico continua exigindo login.
+
+# Código de fechamento (antes do aceite, vira HTTP 403 no handshake) para
+# quem tenta entrar numa sala da qual não participa
+ROOM_FORBIDDEN_CLOSE_CODE = 4003
+
+
+def room_participants(room):
+    """Usernames of the participants of a "<uid>_<uid>" room"""
+    return set(room.split('_'))
+
+
+def is_public_room(room):
+    return room in getattr(settings, 'CHAT_PUBLIC_ROOMS', ())
+
+
+def is_room_member(user, room):
+    """A participant of the room, or a psychologist with sessions with all the others.
+
+    The same rule as check-ins (user.views.can_view_checkins), applied to
+    every participant: reading a conversation needs access to all of them.
+    """
+    if not user.is_authenticated:
+        return False
+    participants = room_participants(room)
+    if user.username in participants:
+        return True
+    if not user.is_psychologist():
+        return False
+    patients = (
+        Session.objects.filter(psychologist=user, user__username__in=participants)
+        .values('user_id').distinct().count()
+    )
+    return patients == len(participants)
+
+
+def room_access(user, room):
+    """(may join, may read history) for user in room.
+
+    Joining means connecting and receiving live messages; reading history
+    covers HTTP history, history/resume frames and ?history=K, and always
+    needs an authenticated user.
+    """
+    allowed = is_public_room(room) or is_room_member(user, room)
+    return allowed, allowed and user.is_authenticated
+
+
+def can_read_history(user, room):
+    return room_access(user, room)[1]
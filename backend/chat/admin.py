@@ -0,0 +1,13 @@
+from django.contrib import admin
+from .models import ChatMessage
+
+
+class ChatMessageAdmin(admin.ModelAdmin):
+    list_display = ('room', 'sender_name', 'message', 'created_at')
+    list_filter = ('created_at',)
+    search_fields = ('room', 'sender_name', 'message')
+    date_hierarchy = 'created_at'
+    readonly_fields = ('created_at',)
+
+
+admin.site.register(ChatMessage, ChatMessageAdmin)
@@ -11,6 +11,8 @@ logger = logging.getLogger(__name__)
 try:
     import firebase_admin
     from firebase_admin import auth
+    from user.accounts import cached_firebase_user, get_or_create_firebase_user
+    from user.tokens import averify_id_token
     FIREBASE_AVAILABLE = True
 except ImportError:
     logger.warning("Firebase não disponível - usando autenticação anônima")
@@ -36,17 +38,20 @@ class FirebaseWebSocketAuthMiddleware(BaseMiddleware):
         
         if token and FIREBASE_AVAILABLE:
             try:
-                # Verify Firebase token
-                decoded_token = auth.verify_id_token(token)
+                # Verify Firebase token fora do event loop (cache
+                # compartilhado com a API REST)
+                decoded_token = await averify_id_token(token)
                 uid = decoded_token['uid']
                 
-                # Get or create user
-                user = await self.get_or_create_user(uid, decoded_token)
+                # Get or create user (usuário em cache: sem ir à thread do banco)
+                user = cached_firebase_user(decoded_token)
+                if user is None:
+                    user = await self.get_or_create_user(uid, decoded_token)
                 scope['user'] = user
-                logger.info(f"WebSocket authenticated user: {user.name} ({uid})")
+                logger.info("WebSocket authenticated user: %s (%s)", user.name, uid)
                 
             except Exception as e:
-                logger.error(f"WebSocket authentication failed: {e}")
+                logger.error("WebSocket authentication failed: %s", e)
                 scope['user'] = AnonymousUser()
         elif token and not FIREBASE_AVAILABLE:
             logger.warning("Firebase não disponível - usando token como UID")
@@ -54,9 +59,9 @@ class FirebaseWebSocketAuthMiddleware(BaseMiddleware):
             try:
                 user = await self.get_or_create_user_fallback(token)
                 scope['user'] = user
-                logger.info(f"WebSocket authenticated user (fallback): {user.name} ({token})")
+                logger.info("WebSocket authenticated user (fallback): %s (%s)", user.name, token)
             except Exception as e:
-                logger.error(f"Fallback authentication failed: {e}")
+                logger.error("Fallback authentication failed: %s", e)
                 scope['user'] = AnonymousUser()
         else:
             logger.warning("No authentication token provided for WebSocket - usando usuário anônimo para testes")
@@ -69,28 +74,10 @@ class FirebaseWebSocketAuthMiddleware(BaseMiddleware):
     def get_or_create_user(self, uid, decoded_token):
         """Get or create user from database"""
         try:
-            user, created = CustomUser.objects.get_or_create(
-                username=uid,
-                defaults={
-                    'email': decoded_token.get('email', ''),
-                    'name': decoded_token.get('name', 'Usuário'),
-                    'type': 'user',  # Default type
-                    'phone': '',  # Default empty phone
-                }
-            )
-            
-            # Update user info if not created
-            if not created:
-                if decoded_token.get('email') and user.email != decoded_token.get('email'):
-                    user.email = decoded_token.get('email')
-                if decoded_token.get('name') and user.name != decoded_token.get('name'):
-                    user.name = decoded_token.get('name')
-                user.save()
-            
-            return user
-            
+            return get_or_create_firebase_user(decoded_token)
+
         except Exception as e:
-            logger.error(f"Error getting/creating user: {e}")
+            logger.error("Error getting/creating user: %s", e)
             # Return anonymous user if there's an error
             return AnonymousUser()
     
@@ -112,5 +99,5 @@ class FirebaseWebSocketAuthMiddleware(BaseMiddleware):
             return user
             
         except Exception as e:
-            logger.error(f"Error in fallback user creation: {e}")
+            logger.error("Error in fallback user creation: %s", e)
             return AnonymousUser()
@@ -0,0 +1,157 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Banco fora do ar ou conexão perdida: o lote volta para a fila. Qualquer
+# outro erro é de alguma linha do lote, que é descartada.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+
+class MessageWriteBuffer:
+    """Write-behind buffer for ChatMessage rows.
+
+    Consumers call add() on the hot path, which only appends to a list.
+    A background thread persists the pending rows with a single bulk_create
+    once flush_size messages are waiting or every flush_interval seconds,
+    whichever comes first. close() (registered with atexit) drains whatever
+    is left, so a normal shutdown does not lose buffered messages. A batch
+    that fails because of a bad row is retried row by row, dropping only
+    the rows that still fail.
+
+    Reads never flush: pending() lets resume and sequence lookups see this
+    process's unwritten messages without waiting for the database. Messages
+    buffered by another worker only become visible after that worker's next
+    flush (at most flush_interval later).
+    """
+
+    def __init__(self, flush_size=50, flush_interval=0.5, max_pending=10000):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._writing = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, message):
+        """Queue an unsaved ChatMessage for the next flush"""
+        with self._lock:
+            self._pending.append(message)
+            pending = len(self._pending)
+            if pending > self.max_pending:
+                # Banco indisponível por muito tempo: descartar as mais antigas
+                # em vez de crescer sem limite
+                del self._pending[:pending - self.max_pending]
+                logger.error("❌ Buffer do chat cheio - %s mensagens descartadas", pending - self.max_pending)
+            if self._thread is None:
+                self._start()
+
+        if pending >= self.flush_size:
+            self._wakeup.set()
+
+    def pending(self, room):
+        """This process's messages for room not yet visible in the database"""
+        with self._lock:
+            return [
+                message for message in (*self._writing, *self._pending) if message.room == room
+            ]
+
+    def flush(self):
+        """Persist every pending message now. Returns how many were written."""
+        from .models import ChatMessage
+
+        with self._flush_lock:
+            with self._lock:
+                # Continua visível em pending() enquanto o INSERT não termina
+                batch, self._pending, self._writing = self._pending, [], self._pending
+            if not batch:
+                return 0
+
+            try:
+                with transaction.atomic():
+                    ChatMessage.objects.bulk_create(batch, batch_size=self.flush_size)
+                written, retry = len(batch), []
+            except TRANSIENT_ERRORS as e:
+                logger.error("❌ Erro ao gravar %s mensagens do chat: %s", len(batch), e)
+                written, retry = 0, batch
+            except Exception as e:
+                # Uma linha inválida derruba o lote inteiro: gravar uma a uma
+                # para não travar as demais para sempre
+                logger.error("❌ Erro ao gravar %s mensagens do chat: %s", len(batch), e)
+                written, retry = self._write_each(batch)
+
+            with self._lock:
+                # Devolver o que falhou por indisponibilidade, mantendo a ordem
+                self._pending[:0] = retry
+                self._writing = []
+            return written
+
+    def _write_each(self, batch):
+        """Insert batch row by row. Returns (written, rows to retry later).
+
+        Rows that fail on their own are dropped and logged; a connection
+        error stops here and keeps the rest for the next flush.
+        """
+        from .models import ChatMessage
+
+        written = 0
+        for index, message in enumerate(batch):
+            try:
+                with transaction.atomic():
+                    ChatMessage.objects.bulk_create([message])
+            except TRANSIENT_ERRORS:
+                return written, batch[index:]
+            except Exception as e:
+                logger.error(
+                    "❌ Mensagem do chat descartada (sala %s, seq %s): %s", message.room, message.seq, e
+                )
+            else:
+                written += 1
+        return written, []
+
+    def close(self):
+        """Stop the background thread and flush what is left"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval * 4)
+        self.flush()
+
+    def _start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='chat-message-buffer', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_message_buffer():
+    """Return the process-wide message buffer, creating it on first use"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = MessageWriteBuffer(
+                    flush_size=getattr(settings, 'CHAT_HISTORY_FLUSH_SIZE', 50),
+                    flush_interval=getattr(settings, 'CHAT_HISTORY_FLUSH_INTERVAL_MS', 500) / 1000,
+                )
+                atexit.register(_buffer.close)
+    return _buffer
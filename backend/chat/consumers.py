@@ -1,19 +1,118 @@
+import asyncio
 import json
 import logging
-from datetime import datetime
+import re
+from urllib.parse import parse_qs
 from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer, WebsocketConsumer
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.utils import timezone
+from user.photos import avatar_url
+
+from .access import ROOM_FORBIDDEN_CLOSE_CODE, room_access
+from .buffer import get_message_buffer
+from .history import fetch_after, fetch_history, format_timestamp, max_page_size
+from .models import ChatMessage
+from .outbox import DROPPABLE_FRAME_TYPES, SLOW_CONSUMER_CLOSE_CODE, build_outbox, counters, transport_of
+from .presence import get_presence, presence_ttl
+from .stores import get_sequence_store
+from .throttling import TokenBucket, rate_limit, throttle
 
 logger = logging.getLogger(__name__)
 
+
+def encode_frame(data):
+    """Serialize an outgoing WebSocket frame"""
+    return json.dumps(data, ensure_ascii=False)
+
+
+def build_broadcast_event(frame, sender_channel, droppable=False, room=None, seq=None):
+    """Wrap a pre-encoded frame (chat_message, presence_*) for group_send.
+
+    The frame is serialized once by the sender; every member of the group
+    forwards the same text and only compares sender_channel to skip itself.
+    droppable frames may be discarded by a recipient's full outbox. room and
+    seq (chat messages) let recipients notice messages the channel layer
+    dropped without parsing the frame.
+    """
+    event = {
+        'type': 'broadcast_message',  # Nome diferente para evitar loop
+        'text': frame,
+        'sender_channel': sender_channel,
+        'droppable': droppable,
+    }
+    if seq is not None:
+        event['room'] = room
+        event['seq'] = seq
+    return event
+
+
+def build_chat_message(consumer, room, message, seq, client_id, created_at):
+    """Unsaved ChatMessage for the write-behind buffer"""
+    return ChatMessage(
+        room=room,
+        user=consumer.user if consumer.user.is_authenticated else None,
+        sender_id=consumer.user_id,
+        sender_name=consumer.user_name,
+        sender_avatar=consumer.user_avatar,
+        message=message,
+        seq=seq,
+        client_id=client_id,
+        created_at=created_at,
+    )
+
+
+def presence_frame(frame_type, room, user_id, online_count, info=None):
+    """Encoded presence_join / presence_leave frame"""
+    return encode_frame({
+        'type': frame_type,
+        'room': room,
+        'user_id': user_id,
+        'user_name': (info or {}).get('user_name'),
+        'user_avatar': (info or {}).get('user_avatar'),
+        'online_count': online_count,
+        'timestamp': format_timestamp()
+    })
+
+
+HISTORY_DENIED_MESSAGE = 'Histórico disponível apenas para participantes autenticados da sala'
+
+
+# Nomes de grupo do channel layer: ASCII e menos de 100 caracteres
+ROOM_NAME_RE = re.compile(r'[A-Za-z0-9_]{1,90}')
+
+
+def group_name(room):
+    return f"chat_{room}"
+
+
+def clean_client_id(value):
+    """Client-generated message id used for idempotent sends"""
+    if not value:
+        return None
+    return str(value)[:64]
+
+
+def requested_history_size(scope):
+    """How many past messages to replay on connect (?history=K)"""
+    params = parse_qs(scope.get('query_string', b'').decode())
+    default = getattr(settings, 'CHAT_CONNECT_HISTORY', 0)
+    try:
+        size = int(params.get('history', [default])[0])
+    except ValueError:
+        size = 0
+    return max(0, min(size, max_page_size()))
+
+
 class ChatConsumer(WebsocketConsumer):
     def connect(self):
         """Handle WebSocket connection"""
         try:
             # Configurar dados básicos
             self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
-            self.room_group_name = f"chat_{self.room_name}"
+            self.room_group_name = group_name(self.room_name)
             
             # Obter usuário do scope
             self.user = self.scope.get('user', AnonymousUser())
@@ -22,17 +121,28 @@ class ChatConsumer(WebsocketConsumer):
             if self.user.is_authenticated:
                 self.user_id = str(self.user.id)
                 self.user_name = getattr(self.user, 'name', self.user.username)
-                self.user_avatar = self.user.photo.url if hasattr(self.user, 'photo') and self.user.photo else None
+                self.user_avatar = avatar_url(self.user)
             else:
                 # ID único para usuários anônimos
                 self.user_id = f"anonymous_{abs(hash(self.channel_name)) % 100000}"
                 self.user_name = "Usuário Anônimo"
                 self.user_avatar = None
             
-            logger.info(f"🔌 Conectando: {self.user_name} ({self.user_id}) -> Sala: {self.room_name}")
+            self.frame_bucket = TokenBucket(*rate_limit('frame_connection'))
+            
+            # Só participantes da sala (ou quem tem acesso a eles) entram
+            self.joined = False
+            may_join, self.may_read_history = room_access(self.user, self.room_name)
+            if not may_join:
+                logger.warning("🚫 Acesso negado: %s (%s) -> Sala: %s", self.user_name, self.user_id, self.room_name)
+                self.close(code=ROOM_FORBIDDEN_CLOSE_CODE)
+                return
+            
+            logger.info("🔌 Conectando: %s (%s) -> Sala: %s", self.user_name, self.user_id, self.room_name)
             
             # ACEITAR CONEXÃO PRIMEIRO
             self.accept()
+            self.joined = True
             
             # Entrar no grupo da sala
             async_to_sync(self.channel_layer.group_add)(
@@ -40,33 +150,51 @@ class ChatConsumer(WebsocketConsumer):
                 self.channel_name
             )
             
-            # Verificar se entrou no grupo
-            try:
-                group_info = async_to_sync(self.channel_layer.group_channels)(self.room_group_name)
-                logger.info(f"✅ Grupo {self.room_group_name}: {len(group_info)} usuários conectados")
-            except Exception as e:
-                logger.warning(f"Não foi possível verificar grupo: {e}")
+            # Presença: contagem O(1), sem enumerar o grupo
+            presence = get_presence()
+            joined = async_to_sync(presence.join)(self.room_name, self.user_id, self.presence_info())
+            online_count = async_to_sync(presence.count)(self.room_name)
             
             # Confirmar conexão
-            self.send_json({
+            payload = {
                 'type': 'connection_established',
                 'room': self.room_name,
                 'user_id': self.user_id,
                 'user_name': self.user_name,
                 'user_avatar': self.user_avatar,
                 'message': 'Conectado com sucesso!',
-                'timestamp': datetime.now().isoformat()
-            })
+                'timestamp': format_timestamp(),
+                'last_seq': async_to_sync(get_sequence_store().current_seq)(self.room_name),
+                'online_count': online_count
+            }
+            
+            # Últimas K mensagens da sala, se pedidas
+            history_size = requested_history_size(self.scope)
+            if history_size and self.may_read_history:
+                page = fetch_history(self.room_name, limit=history_size, viewer_id=self.user_id)
+                payload['history'] = page['messages']
+                payload['next_cursor'] = page['next_cursor']
+            
+            self.send_json(payload)
+            if history_size and not self.may_read_history:
+                self.send_json({'type': 'error', 'message': HISTORY_DENIED_MESSAGE})
+            
+            if joined:
+                self.broadcast_presence('presence_join', online_count)
             
-            logger.info(f"✅ {self.user_name} conectado à sala {self.room_name}")
+            logger.info("✅ %s conectado à sala %s", self.user_name, self.room_name)
             
         except Exception as e:
-            logger.error(f"❌ Erro na conexão: {e}")
+            logger.error("❌ Erro na conexão: %s", e)
             self.close()
 
     def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
-        logger.info(f"🔌 Desconectando: {self.user_name} da sala: {self.room_name}")
+        # Conexão recusada (ou que falhou) antes de entrar na sala
+        if not getattr(self, 'joined', False):
+            return
+        
+        logger.info("🔌 Desconectando: %s da sala: %s", self.user_name, self.room_name)
         
         try:
             # Sair do grupo
@@ -74,9 +202,15 @@ class ChatConsumer(WebsocketConsumer):
                 self.room_group_name, 
                 self.channel_name
             )
-            logger.info(f"✅ {self.user_name} desconectado da sala {self.room_name}")
+            
+            presence = get_presence()
+            if async_to_sync(presence.leave)(self.room_name, self.user_id):
+                self.broadcast_presence(
+                    'presence_leave', async_to_sync(presence.count)(self.room_name)
+                )
+            logger.info("✅ %s desconectado da sala %s", self.user_name, self.room_name)
         except Exception as e:
-            logger.error(f"❌ Erro na desconexão: {e}")
+            logger.error("❌ Erro na desconexão: %s", e)
 
     def receive(self, text_data):
         """Handle incoming WebSocket message"""
@@ -84,16 +218,32 @@ class ChatConsumer(WebsocketConsumer):
             data = json.loads(text_data)
             message_type = data.get('type', 'chat_message')
             
-            logger.info(f"📨 Mensagem recebida - Tipo: {message_type}, De: {self.user_name}")
+            logger.debug("📨 Mensagem recebida - Tipo: %s, De: %s", message_type, self.user_name)
+            
+            if self.throttle_frame():
+                return
+            
+            # Sem tarefa de fundo no consumer sync: cada frame renova a presença
+            async_to_sync(get_presence().heartbeat)(self.room_name, self.user_id)
             
             # Responder a ping
             if message_type == 'ping':
                 self.send_json({
                     'type': 'pong', 
-                    'timestamp': datetime.now().isoformat()
+                    'timestamp': format_timestamp()
                 })
                 return
             
+            # Página do histórico (keyset)
+            if message_type == 'history':
+                self.send_history(data)
+                return
+            
+            # Reenviar apenas o que foi perdido desde after_seq
+            if message_type == 'resume':
+                self.send_resume(data)
+                return
+            
             # Processar mensagem de chat
             if message_type == 'chat_message':
                 message = data.get('message', '').strip()
@@ -105,49 +255,73 @@ class ChatConsumer(WebsocketConsumer):
                     })
                     return
                 
-                logger.info(f"💬 Processando mensagem de {self.user_name}: '{message[:50]}...'")
+                logger.debug("💬 Processando mensagem de %s: '%s...'", self.user_name, message[:50])
                 
                 # TRANSMITIR MENSAGEM
-                self.transmit_message(message)
+                self.transmit_message(message, clean_client_id(data.get('client_id')))
             
         except json.JSONDecodeError as e:
-            logger.error(f"❌ Erro JSON: {e}")
+            logger.error("❌ Erro JSON: %s", e)
             self.send_json({
                 'type': 'error',
                 'message': 'Formato inválido'
             })
         except Exception as e:
-            logger.error(f"❌ Erro ao processar mensagem: {e}")
+            logger.error("❌ Erro ao processar mensagem: %s", e)
             self.send_json({
                 'type': 'error', 
                 'message': 'Erro interno'
             })
 
-    def transmit_message(self, message):
+    def transmit_message(self, message, client_id=None):
         """Transmit message to all users in room"""
-        timestamp = datetime.now().isoformat()
-        
-        # Dados da mensagem
-        message_data = {
-            'type': 'broadcast_message',  # Nome diferente para evitar loop
-            'message': message,
-            'user_id': self.user_id,
-            'user_name': self.user_name,
-            'user_avatar': self.user_avatar,
-            'room': self.room_name,
-            'timestamp': timestamp,
-            'sender_channel': self.channel_name
-        }
+        # Mesmo instante no frame ao vivo e na mensagem gravada
+        created_at = timezone.now()
+        timestamp = format_timestamp(created_at)
+        store = get_sequence_store()
         
-        logger.info(f"📡 Transmitindo mensagem de {self.user_name} para grupo {self.room_group_name}")
+        # Reenvio do mesmo client_id: confirmar de novo sem retransmitir
+        if client_id:
+            existing_seq = async_to_sync(store.claim_client_id)(self.room_name, client_id)
+            if existing_seq is not None:
+                self.send_json({
+                    'type': 'message_sent',
+                    'message': message,
+                    'client_id': client_id,
+                    'seq': existing_seq or None,
+                    'duplicate': True,
+                    'is_own': True
+                })
+                return
         
-        # Verificar quantos usuários estão no grupo
         try:
-            group_channels = async_to_sync(self.channel_layer.group_channels)(self.room_group_name)
-            logger.info(f"👥 Usuários no grupo {self.room_group_name}: {len(group_channels)}")
-            logger.info(f"🔍 Canais no grupo: {group_channels}")
-        except Exception as e:
-            logger.warning(f"⚠️ Não foi possível verificar usuários no grupo: {e}")
+            seq = async_to_sync(store.next_seq)(self.room_name)
+            if client_id:
+                async_to_sync(store.remember_client_id)(self.room_name, client_id, seq)
+            
+            # Frame final serializado uma única vez, para todos os destinatários
+            frame = encode_frame({
+                'type': 'chat_message',
+                'message': message,
+                'user_id': self.user_id,
+                'user_name': self.user_name,
+                'user_avatar': self.user_avatar,
+                'room': self.room_name,
+                'timestamp': timestamp,
+                'seq': seq,
+                'client_id': client_id,
+                'is_own': False
+            })
+            
+            # Persistir sem bloquear: o INSERT sai em lote pelo buffer
+            get_message_buffer().add(build_chat_message(self, self.room_name, message, seq, client_id, created_at))
+        except Exception:
+            # Nada foi gravado: liberar o client_id para o reenvio do cliente
+            if client_id:
+                async_to_sync(store.release_client_id)(self.room_name, client_id)
+            raise
+        
+        logger.debug("📡 Transmitindo mensagem de %s para grupo %s", self.user_name, self.room_group_name)
         
         # 1. PRIMEIRO: Confirmar para o remetente (opcional - mostra que foi enviada)
         self.send_json({
@@ -157,81 +331,130 @@ class ChatConsumer(WebsocketConsumer):
             'user_name': self.user_name,
             'user_avatar': self.user_avatar,
             'timestamp': timestamp,
+            'seq': seq,
+            'client_id': client_id,
             'is_own': True
         })
         
         # 2. SEGUNDO: Enviar para todos no grupo
         try:
-            logger.info(f"📤 Enviando mensagem para grupo via channel_layer.group_send")
+            logger.debug("📤 Enviando mensagem para grupo via channel_layer.group_send")
             async_to_sync(self.channel_layer.group_send)(
                 self.room_group_name,
-                message_data
+                build_broadcast_event(frame, self.channel_name, room=self.room_name, seq=seq)
             )
-            logger.info(f"✅ Mensagem transmitida com sucesso para grupo {self.room_group_name}")
-            
-            # Verificar se a mensagem foi enviada
-            logger.info(f"🔍 Verificando se mensagem foi enviada para {len(group_channels)} usuários")
+            logger.debug("✅ Mensagem transmitida com sucesso para grupo %s", self.room_group_name)
             
         except Exception as e:
-            logger.error(f"❌ Erro ao transmitir mensagem: {e}")
-            logger.error(f"🔍 Detalhes do erro: {type(e).__name__}: {str(e)}")
+            logger.error("❌ Erro ao transmitir mensagem: %s", e)
+            logger.error("🔍 Detalhes do erro: %s: %s", type(e).__name__, str(e))
             self.send_json({
                 'type': 'error',
                 'message': 'Erro ao enviar mensagem'
             })
 
+    def throttle_frame(self):
+        """Same frame limits as AsyncChatConsumer.throttle_frame"""
+        retry_after = self.frame_bucket.take()
+        if not retry_after and self.user.is_authenticated:
+            retry_after = async_to_sync(throttle)('frame_user', self.user_id)
+        if not retry_after:
+            return False
+        
+        self.send_json({
+            'type': 'error',
+            'message': 'Muitas mensagens - aguarde antes de enviar novamente',
+            'retry_after': round(retry_after, 2)
+        })
+        return True
+    
+    def presence_info(self):
+        return {
+            'user_id': self.user_id,
+            'user_name': self.user_name,
+            'user_avatar': self.user_avatar,
+        }
+
+    def broadcast_presence(self, frame_type, online_count):
+        """Announce that this user came online / went offline"""
+        try:
+            async_to_sync(self.channel_layer.group_send)(
+                self.room_group_name,
+                build_broadcast_event(
+                    presence_frame(frame_type, self.room_name, self.user_id, online_count, self.presence_info()),
+                    self.channel_name
+                )
+            )
+        except Exception as e:
+            logger.warning("⚠️ Não foi possível anunciar presença: %s", e)
+
+    def send_history(self, data):
+        """Send one page of room history older than data['cursor']"""
+        if not self.may_read_history:
+            self.send_json({'type': 'error', 'message': HISTORY_DENIED_MESSAGE})
+            return
+        
+        try:
+            page = fetch_history(
+                self.room_name,
+                cursor=data.get('cursor'),
+                limit=data.get('limit', 50),
+                viewer_id=self.user_id,
+            )
+        except (TypeError, ValueError):
+            self.send_json({
+                'type': 'error',
+                'message': 'Parâmetros de paginação inválidos'
+            })
+            return
+
+        self.send_json({'type': 'history', **page})
+
+    def send_resume(self, data):
+        """Replay the messages a reconnecting client missed"""
+        if not self.may_read_history:
+            self.send_json({'type': 'error', 'message': HISTORY_DENIED_MESSAGE})
+            return
+        
+        try:
+            page = fetch_after(
+                self.room_name,
+                data.get('after_seq', 0),
+                limit=data.get('limit'),
+                viewer_id=self.user_id,
+            )
+        except (TypeError, ValueError):
+            self.send_json({
+                'type': 'error',
+                'message': 'after_seq inválido'
+            })
+            return
+
+        self.send_json({'type': 'resume', **page})
+
     def broadcast_message(self, event):
         """Handle message broadcast from room group"""
+        # NÃO ENVIAR DE VOLTA PARA O REMETENTE
+        if event.get('sender_channel') == self.channel_name:
+            return
+
         try:
-            sender_channel = event.get('sender_channel')
-            
-            logger.info(f"📨 Recebendo broadcast - De: {event.get('user_name')}, Para: {self.user_name}")
-            logger.info(f"🔍 Canal remetente: {sender_channel}, Canal atual: {self.channel_name}")
-            logger.info(f"📋 Dados do evento: {event}")
-            
-            # NÃO ENVIAR DE VOLTA PARA O REMETENTE
-            if sender_channel == self.channel_name:
-                logger.info(f"⏭️ Pulando - é o próprio remetente")
-                return
-            
-            # Preparar dados para envio
-            response_data = {
-                'type': 'chat_message',
-                'message': event['message'],
-                'user_id': event['user_id'],
-                'user_name': event['user_name'],
-                'user_avatar': event.get('user_avatar'),
-                'room': event.get('room'),
-                'timestamp': event['timestamp'],
-                'is_own': False
-            }
-            
-            logger.info(f"📤 Enviando mensagem para {self.user_name}: '{event['message'][:30]}...'")
-            logger.info(f"📋 Dados de resposta: {response_data}")
-            
-            # Enviar via WebSocket
-            self.send_json(response_data)
-            
-            logger.info(f"✅ Mensagem entregue para {self.user_name}")
-            
+            # Frame já serializado pelo remetente - apenas repassar
+            self.send(text_data=event['text'])
         except Exception as e:
-            logger.error(f"❌ Erro no broadcast_message: {e}")
-            logger.error(f"🔍 Detalhes do erro: {type(e).__name__}: {str(e)}")
-            logger.error(f"Event data: {event}")
-            logger.error(f"User info: {self.user_name} ({self.user_id})")
+            logger.error("❌ Erro no broadcast_message: %s: %s", type(e).__name__, e)
 
     def send_json(self, data):
         """Send JSON data via WebSocket"""
         try:
-            json_data = json.dumps(data, ensure_ascii=False)
-            self.send(text_data=json_data)
+            self.send(text_data=encode_frame(data))
             
             # Log apenas para mensagens importantes
             if data.get('type') in ['chat_message', 'message_sent']:
-                logger.info(f"📡 JSON enviado para {self.user_name}: {data.get('type')}")
+                logger.debug("📡 JSON enviado para %s: %s", self.user_name, data.get('type'))
                 
         except Exception as e:
-            logger.error(f"❌ Erro ao enviar JSON: {e}")
+            logger.error("❌ Erro ao enviar JSON: %s", e)
 
     # Método adicional para debug
     def connection_test(self, event):
@@ -239,5 +462,619 @@ class ChatConsumer(WebsocketConsumer):
         self.send_json({
             'type': 'connection_test_response',
             'message': 'Teste de conexão OK',
-            'timestamp': datetime.now().isoformat()
-        })
\ No newline at end of file
+            'timestamp': format_timestamp()
+        })
+
+
+class AsyncChatConsumer(AsyncWebsocketConsumer):
+    """Native asyncio version of ChatConsumer.
+
+    Speaks the same wire protocol (connection_established, pong,
+    message_sent, chat_message, error) but awaits the channel layer directly
+    on the event loop instead of hopping through the default executor with
+    async_to_sync on every group operation.
+
+    Room handling is parameterized by room name so MultiplexChatConsumer can
+    reuse it for many rooms over one socket; this class joins exactly the
+    room in its URL.
+
+    A room is joined only by its participants (chat/access.py), and history,
+    resume and ?history=K also need an authenticated user.
+
+    Outgoing frames go through a bounded Outbox; a client that cannot keep
+    up is closed with SLOW_CONSUMER_CLOSE_CODE and is expected to resume.
+    Chat messages the channel layer dropped show up as a gap in seq and
+    get a resync frame (room, after_seq) asking the client to resume.
+    """
+
+    outbox = None
+    close_task = None
+
+    async def connect(self):
+        """Handle WebSocket connection"""
+        try:
+            # Configurar dados básicos
+            self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
+            self.setup_user()
+            self.rooms = {}
+
+            # Só participantes da sala (ou quem tem acesso a eles) entram
+            if not await self.authorize(self.room_name):
+                await self.close(code=ROOM_FORBIDDEN_CLOSE_CODE)
+                return
+
+            logger.info("🔌 Conectando: %s (%s) -> Sala: %s", self.user_name, self.user_id, self.room_name)
+
+            # ACEITAR CONEXÃO PRIMEIRO
+            await self.accept()
+
+            # Entrar no grupo da sala
+            joined, online_count = await self.join_room(self.room_name)
+
+            # Confirmar conexão
+            payload = {
+                'type': 'connection_established',
+                'room': self.room_name,
+                'user_id': self.user_id,
+                'user_name': self.user_name,
+                'user_avatar': self.user_avatar,
+                'message': 'Conectado com sucesso!',
+                'timestamp': format_timestamp(),
+                'last_seq': await get_sequence_store().current_seq(self.room_name),
+                'online_count': online_count
+            }
+
+            # Últimas K mensagens da sala, se pedidas
+            history_size = requested_history_size(self.scope)
+            readable = self.room_name in self.history_rooms
+            if history_size and readable:
+                page = await database_sync_to_async(fetch_history)(
+                    self.room_name, limit=history_size, viewer_id=self.user_id
+                )
+                payload['history'] = page['messages']
+                payload['next_cursor'] = page['next_cursor']
+
+            await self.send_json(payload)
+            if history_size and not readable:
+                await self.history_denied(self.room_name)
+
+            if joined:
+                await self.broadcast_presence(self.room_name, 'presence_join', online_count)
+
+            logger.info("✅ %s conectado à sala %s", self.user_name, self.room_name)
+
+        except Exception as e:
+            logger.error("❌ Erro na conexão: %s", e)
+            await self.close()
+
+    def setup_user(self):
+        """Resolve the user identity sent along with every frame"""
+        # Obter usuário do scope
+        self.user = self.scope.get('user', AnonymousUser())
+
+        # Configurar informações do usuário
+        if self.user.is_authenticated:
+            self.user_id = str(self.user.id)
+            self.user_name = getattr(self.user, 'name', self.user.username)
+            self.user_avatar = avatar_url(self.user)
+        else:
+            # ID único para usuários anônimos
+            self.user_id = f"anonymous_{abs(hash(self.channel_name)) % 100000}"
+            self.user_name = "Usuário Anônimo"
+            self.user_avatar = None
+
+        self.frame_bucket = TokenBucket(*rate_limit('frame_connection'))
+        self.history_rooms = set()
+        self.seen_seq = {}
+
+    async def authorize(self, room):
+        """Check access to room once per join. Returns whether it may be joined."""
+        may_join, may_read = await database_sync_to_async(room_access)(self.user, room)
+        if may_read:
+            self.history_rooms.add(room)
+        if not may_join:
+            logger.warning("🚫 Acesso negado: %s (%s) -> Sala: %s", self.user_name, self.user_id, room)
+        return may_join
+
+    async def history_denied(self, room):
+        await self.send_json({
+            'type': 'error',
+            'room': room,
+            'message': HISTORY_DENIED_MESSAGE
+        })
+
+    async def throttle_frame(self, room=None):
+        """Apply the per-connection and per-user frame limits.
+
+        Returns True (after telling the client when to retry) if the frame
+        must be dropped.
+        """
+        retry_after = self.frame_bucket.take()
+        if not retry_after and self.user.is_authenticated:
+            retry_after = await throttle('frame_user', self.user_id)
+        if not retry_after:
+            return False
+
+        await self.send_json({
+            'type': 'error',
+            'room': room,
+            'message': 'Muitas mensagens - aguarde antes de enviar novamente',
+            'retry_after': round(retry_after, 2)
+        })
+        return True
+
+    async def disconnect(self, close_code):
+        """Handle WebSocket disconnection"""
+        if self.outbox is not None:
+            self.outbox.close()
+
+        # connect() pode ter falhado antes de configurar as salas
+        for room in list(getattr(self, 'rooms', {})):
+            await self.leave_room(room)
+
+    async def join_room(self, room):
+        """Add this socket to a room's group and presence.
+
+        Returns (joined, online_count); joined is True when this is the
+        user's first connection to the room.
+        """
+        await self.channel_layer.group_add(group_name(room), self.channel_name)
+
+        # Presença: contagem O(1), sem enumerar o grupo
+        presence = get_presence()
+        joined = await presence.join(room, self.user_id, self.presence_info())
+        self.rooms[room] = asyncio.create_task(self.presence_heartbeat(room))
+        return joined, await presence.count(room)
+
+    async def leave_room(self, room):
+        """Remove this socket from a room's group and presence"""
+        heartbeat_task = self.rooms.pop(room, None)
+        self.history_rooms.discard(room)
+        self.seen_seq.pop(room, None)
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
+
+        logger.info("🔌 Desconectando: %s da sala: %s", self.user_name, room)
+
+        try:
+            # Sair do grupo
+            await self.channel_layer.group_discard(group_name(room), self.channel_name)
+
+            presence = get_presence()
+            if await presence.leave(room, self.user_id):
+                await self.broadcast_presence(room, 'presence_leave', await presence.count(room))
+            logger.info("✅ %s desconectado da sala %s", self.user_name, room)
+        except Exception as e:
+            logger.error("❌ Erro na desconexão: %s", e)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """Handle incoming WebSocket message"""
+        try:
+            data = json.loads(text_data)
+            message_type = data.get('type', 'chat_message')
+
+            logger.debug("📨 Mensagem recebida - Tipo: %s, De: %s", message_type, self.user_name)
+
+            if await self.throttle_frame(self.room_name):
+                return
+
+            await self.handle_frame(self.room_name, message_type, data)
+
+        except json.JSONDecodeError as e:
+            logger.error("❌ Erro JSON: %s", e)
+            await self.send_json({
+                'type': 'error',
+                'message': 'Formato inválido'
+            })
+        except Exception as e:
+            logger.error("❌ Erro ao processar mensagem: %s", e)
+            await self.send_json({
+                'type': 'error',
+                'message': 'Erro interno'
+            })
+
+    async def handle_frame(self, room, message_type, data):
+        """Dispatch a client frame addressed to room"""
+        # Responder a ping
+        if message_type == 'ping':
+            await self.send_json({
+                'type': 'pong',
+                'timestamp': format_timestamp()
+            })
+            return
+
+        # Página do histórico (keyset)
+        if message_type == 'history':
+            await self.send_history(room, data)
+            return
+
+        # Reenviar apenas o que foi perdido desde after_seq
+        if message_type == 'resume':
+            await self.send_resume(room, data)
+            return
+
+        # Processar mensagem de chat
+        if message_type == 'chat_message':
+            message = data.get('message', '').strip()
+
+            if not message:
+                await self.send_json({
+                    'type': 'error',
+                    'room': room,
+                    'message': 'Mensagem não pode estar vazia'
+                })
+                return
+
+            logger.debug("💬 Processando mensagem de %s: '%s...'", self.user_name, message[:50])
+
+            # TRANSMITIR MENSAGEM
+            await self.transmit_message(room, message, clean_client_id(data.get('client_id')))
+
+    async def transmit_message(self, room, message, client_id=None):
+        """Transmit message to all users in room"""
+        # Mesmo instante no frame ao vivo e na mensagem gravada
+        created_at = timezone.now()
+        timestamp = format_timestamp(created_at)
+        store = get_sequence_store()
+
+        # Reenvio do mesmo client_id: confirmar de novo sem retransmitir
+        if client_id:
+            existing_seq = await store.claim_client_id(room, client_id)
+            if existing_seq is not None:
+                await self.send_json({
+                    'type': 'message_sent',
+                    'room': room,
+                    'message': message,
+                    'client_id': client_id,
+                    'seq': existing_seq or None,
+                    'duplicate': True,
+                    'is_own': True
+                })
+                return
+
+        try:
+            seq = await store.next_seq(room)
+            if client_id:
+                await store.remember_client_id(room, client_id, seq)
+
+            # Frame final serializado uma única vez, para todos os destinatários
+            frame = encode_frame({
+                'type': 'chat_message',
+                'message': message,
+                'user_id': self.user_id,
+                'user_name': self.user_name,
+                'user_avatar': self.user_avatar,
+                'room': room,
+                'timestamp': timestamp,
+                'seq': seq,
+                'client_id': client_id,
+                'is_own': False
+            })
+
+            # Persistir sem bloquear: o INSERT sai em lote pelo buffer
+            get_message_buffer().add(build_chat_message(self, room, message, seq, client_id, created_at))
+        except Exception:
+            # Nada foi gravado: liberar o client_id para o reenvio do cliente
+            if client_id:
+                await store.release_client_id(room, client_id)
+            raise
+
+        logger.debug("📡 Transmitindo mensagem de %s para grupo %s", self.user_name, group_name(room))
+
+        # 1. PRIMEIRO: Confirmar para o remetente (opcional - mostra que foi enviada)
+        await self.send_json({
+            'type': 'message_sent',
+            'room': room,
+            'message': message,
+            'user_id': self.user_id,
+            'user_name': self.user_name,
+            'user_avatar': self.user_avatar,
+            'timestamp': timestamp,
+            'seq': seq,
+            'client_id': client_id,
+            'is_own': True
+        })
+
+        self.seen_seq[room] = max(self.seen_seq.get(room, seq), seq)
+
+        # 2. SEGUNDO: Enviar para todos no grupo
+        try:
+            await self.channel_layer.group_send(
+                group_name(room),
+                build_broadcast_event(frame, self.channel_name, room=room, seq=seq)
+            )
+            logger.debug("✅ Mensagem transmitida com sucesso para grupo %s", group_name(room))
+
+        except Exception as e:
+            logger.error("❌ Erro ao transmitir mensagem: %s: %s", type(e).__name__, e)
+            await self.send_json({
+                'type': 'error',
+                'room': room,
+                'message': 'Erro ao enviar mensagem'
+            })
+
+    def presence_info(self):
+        return {
+            'user_id': self.user_id,
+            'user_name': self.user_name,
+            'user_avatar': self.user_avatar,
+        }
+
+    async def broadcast_presence(self, room, frame_type, online_count):
+        """Announce that this user came online / went offline in room"""
+        try:
+            await self.channel_layer.group_send(
+                group_name(room),
+                build_broadcast_event(
+                    presence_frame(frame_type, room, self.user_id, online_count, self.presence_info()),
+                    self.channel_name,
+                    droppable=True
+                )
+            )
+        except Exception as e:
+            logger.warning("⚠️ Não foi possível anunciar presença: %s", e)
+
+    async def presence_heartbeat(self, room):
+        """Keep this user's presence alive and expire peers that vanished"""
+        presence = get_presence()
+        while True:
+            await asyncio.sleep(presence_ttl() / 3)
+            try:
+                await presence.heartbeat(room, self.user_id)
+                # Usuários de workers que caíram sem passar pelo disconnect
+                for user_id in await presence.sweep(room):
+                    frame = presence_frame(
+                        'presence_leave', room, user_id, await presence.count(room)
+                    )
+                    await self.channel_layer.group_send(
+                        group_name(room), build_broadcast_event(frame, None, droppable=True)
+                    )
+            except Exception as e:
+                logger.warning("⚠️ Erro no heartbeat de presença: %s", e)
+
+    async def send_history(self, room, data):
+        """Send one page of room history older than data['cursor']"""
+        if room not in self.history_rooms:
+            await self.history_denied(room)
+            return
+
+        try:
+            page = await database_sync_to_async(fetch_history)(
+                room,
+                cursor=data.get('cursor'),
+                limit=data.get('limit', 50),
+                viewer_id=self.user_id,
+            )
+        except (TypeError, ValueError):
+            await self.send_json({
+                'type': 'error',
+                'room': room,
+                'message': 'Parâmetros de paginação inválidos'
+            })
+            return
+
+        await self.send_json({'type': 'history', **page})
+
+    async def send_resume(self, room, data):
+        """Replay the messages a reconnecting client missed"""
+        if room not in self.history_rooms:
+            await self.history_denied(room)
+            return
+
+        try:
+            page = await database_sync_to_async(fetch_after)(
+                room,
+                data.get('after_seq', 0),
+                limit=data.get('limit'),
+                viewer_id=self.user_id,
+            )
+        except (TypeError, ValueError):
+            await self.send_json({
+                'type': 'error',
+                'room': room,
+                'message': 'after_seq inválido'
+            })
+            return
+
+        await self.send_json({'type': 'resume', **page})
+
+    async def broadcast_message(self, event):
+        """Handle message broadcast from room group"""
+        # NÃO ENVIAR DE VOLTA PARA O REMETENTE
+        if event.get('sender_channel') == self.channel_name:
+            return
+
+        if event.get('seq') is not None:
+            self.check_gap(event['room'], event['seq'])
+
+        # Frame já serializado pelo remetente - apenas repassar
+        self.enqueue(event['text'], event.get('droppable', False))
+
+    def check_gap(self, room, seq):
+        """Ask the client to resume when chat messages skipped a seq.
+
+        The channel layer drops events for a channel that is over its
+        capacity without telling anyone; the gap in seq is how it shows.
+        Two senders can also deliver out of order, in which case the extra
+        resume only returns messages the client already has.
+        """
+        last = self.seen_seq.get(room)
+        if last is not None and seq > last + 1:
+            counters['channel_layer_gaps'] += 1
+            logger.warning("⚠️ Mensagens perdidas no channel layer: sala %s, após seq %s", room, last)
+            self.enqueue(encode_frame({'type': 'resync', 'room': room, 'after_seq': last}))
+        if last is None or seq > last:
+            self.seen_seq[room] = seq
+
+    async def send_json(self, data):
+        """Send JSON data via WebSocket"""
+        try:
+            self.enqueue(encode_frame(data), data.get('type') in DROPPABLE_FRAME_TYPES)
+        except Exception as e:
+            logger.error("❌ Erro ao enviar JSON: %s", e)
+
+    def enqueue(self, text, droppable=False):
+        """Queue an encoded frame on this connection's bounded outbox"""
+        if self.outbox is None:
+            self.outbox = build_outbox(self.write_frame, self.evict, transport_of(self.base_send))
+        self.outbox.put(text, droppable)
+
+    async def write_frame(self, text):
+        await self.send(text_data=text)
+
+    def evict(self):
+        """Close a client whose outbox stayed over its limit"""
+        logger.warning("⚠️ Cliente lento desconectado: %s (%s)", self.user_name, self.user_id)
+        # Guardar a task: o loop só mantém referências fracas
+        self.close_task = asyncio.create_task(self.close(code=SLOW_CONSUMER_CLOSE_CODE))
+
+    # Método adicional para debug
+    async def connection_test(self, event):
+        """Test connection method"""
+        await self.send_json({
+            'type': 'connection_test_response',
+            'message': 'Teste de conexão OK',
+            'timestamp': format_timestamp()
+        })
+
+
+class MultiplexChatConsumer(AsyncChatConsumer):
+    """Many rooms over a single WebSocket (ws/chat/).
+
+    The client manages its rooms with subscribe/unsubscribe frames and every
+    other frame names the room it is about. One socket, one handshake and one
+    token verification replace a socket per open conversation; group
+    membership is kept per subscription.
+    """
+
+    async def connect(self):
+        """Handle WebSocket connection"""
+        try:
+            self.setup_user()
+            self.rooms = {}
+
+            logger.info("🔌 Conectando (multiplex): %s (%s)", self.user_name, self.user_id)
+
+            await self.accept()
+            await self.send_json({
+                'type': 'connection_established',
+                'rooms': [],
+                'user_id': self.user_id,
+                'user_name': self.user_name,
+                'user_avatar': self.user_avatar,
+                'message': 'Conectado com sucesso!',
+                'timestamp': format_timestamp()
+            })
+
+        except Exception as e:
+            logger.error("❌ Erro na conexão: %s", e)
+            await self.close()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """Handle incoming WebSocket message"""
+        try:
+            data = json.loads(text_data)
+            message_type = data.get('type', 'chat_message')
+            room = data.get('room')
+
+            if await self.throttle_frame(room):
+                return
+
+            if message_type == 'ping':
+                await self.handle_frame(None, message_type, data)
+                return
+
+            if not isinstance(room, str) or not ROOM_NAME_RE.fullmatch(room):
+                await self.send_json({
+                    'type': 'error',
+                    'message': 'Sala inválida'
+                })
+                return
+
+            if message_type == 'subscribe':
+                await self.subscribe(room, data)
+                return
+
+            if message_type == 'unsubscribe':
+                if room in self.rooms:
+                    await self.leave_room(room)
+                await self.send_json({'type': 'unsubscribed', 'room': room})
+                return
+
+            if room not in self.rooms:
+                await self.send_json({
+                    'type': 'error',
+                    'room': room,
+                    'message': 'Inscreva-se na sala antes de usá-la'
+                })
+                return
+
+            await self.handle_frame(room, message_type, data)
+
+        except json.JSONDecodeError as e:
+            logger.error("❌ Erro JSON: %s", e)
+            await self.send_json({
+                'type': 'error',
+                'message': 'Formato inválido'
+            })
+        except Exception as e:
+            logger.error("❌ Erro ao processar mensagem: %s", e)
+            await self.send_json({
+                'type': 'error',
+                'message': 'Erro interno'
+            })
+
+    async def subscribe(self, room, data):
+        """Join room and confirm with its last_seq, online count and history"""
+        history_size = data.get('history', 0)
+        if isinstance(history_size, bool) or not isinstance(history_size, int) or history_size < 0:
+            await self.send_json({
+                'type': 'error',
+                'room': room,
+                'message': 'history deve ser um número inteiro não negativo'
+            })
+            return
+        history_size = min(history_size, max_page_size())
+
+        if room not in self.rooms:
+            if len(self.rooms) >= getattr(settings, 'CHAT_MAX_SUBSCRIPTIONS', 100):
+                await self.send_json({
+                    'type': 'error',
+                    'room': room,
+                    'message': 'Limite de salas por conexão atingido'
+                })
+                return
+
+            # Mesma regra de acesso do ws/chat/<sala>/
+            if not await self.authorize(room):
+                await self.send_json({
+                    'type': 'error',
+                    'room': room,
+                    'message': 'Acesso negado a esta sala'
+                })
+                return
+
+            joined, online_count = await self.join_room(room)
+            if joined:
+                await self.broadcast_presence(room, 'presence_join', online_count)
+        else:
+            online_count = await get_presence().count(room)
+
+        payload = {
+            'type': 'subscribed',
+            'room': room,
+            'last_seq': await get_sequence_store().current_seq(room),
+            'online_count': online_count
+        }
+
+        readable = room in self.history_rooms
+        if history_size and readable:
+            page = await database_sync_to_async(fetch_history)(
+                room, limit=history_size, viewer_id=self.user_id
+            )
+            payload['history'] = page['messages']
+            payload['next_cursor'] = page['next_cursor']
+
+        await self.send_json(payload)
+        if history_size and not readable:
+            await self.history_denied(room)
@@ -0,0 +1,124 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .buffer import get_message_buffer
+from .models import ChatMessage
+
+
+def max_page_size():
+    return getattr(settings, 'CHAT_HISTORY_MAX_PAGE', 100)
+
+
+def encode_cursor(message):
+    """Opaque keyset cursor pointing at a message"""
+    raw = f'{message.created_at.isoformat()}|{message.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id) from a cursor. Raises ValueError if invalid."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, message_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (AttributeError, binascii.Error, UnicodeError, ValueError) as e:
+        raise ValueError(f'Cursor inválido: {cursor}') from e
+
+
+def format_timestamp(value=None):
+    """ISO timestamp in the local timezone (now if value is None).
+
+    Live frames and stored history use the same format, so a message
+    carries the same timestamp however the client received it.
+    """
+    return timezone.localtime(value).isoformat()
+
+
+def serialize_message(message, viewer_id=None):
+    """Stored message in the same shape as a live chat_message frame"""
+    return {
+        'type': 'chat_message',
+        'id': message.id,
+        'seq': message.seq,
+        'client_id': message.client_id,
+        'message': message.message,
+        'user_id': message.sender_id,
+        'user_name': message.sender_name,
+        'user_avatar': message.sender_avatar,
+        'room': message.room,
+        'timestamp': format_timestamp(message.created_at),
+        'is_own': message.sender_id == viewer_id,
+    }
+
+
+def fetch_history(room, cursor=None, limit=50, viewer_id=None):
+    """Page of a room's messages older than cursor, oldest first.
+
+    Uses a (room, created_at, id) keyset instead of OFFSET, so every page is
+    an index range scan no matter how long the room's history is. The
+    returned next_cursor points at the oldest message of the page and is
+    None when there is nothing older.
+
+    Reads only what is already stored: messages still in a write-behind
+    buffer show up after its next flush.
+    """
+    limit = max(1, min(int(limit), max_page_size()))
+
+    queryset = ChatMessage.objects.filter(room=room)
+    if cursor:
+        created_at, message_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at)
+            | Q(created_at=created_at, id__lt=message_id)
+        )
+
+    page = list(queryset.order_by('-created_at', '-id')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+
+    return {
+        'room': room,
+        'messages': [serialize_message(message, viewer_id) for message in page],
+        'next_cursor': encode_cursor(page[0]) if has_more else None,
+    }
+
+
+def fetch_after(room, after_seq, limit=None, viewer_id=None):
+    """Messages of a room with seq > after_seq, in sequence order.
+
+    Used to resume a connection: the client sends the last seq it saw and
+    gets only what it missed. has_more tells it to ask again from last_seq.
+
+    Messages this process has not written yet are taken from its buffer
+    instead of flushing it. Those buffered by another worker are not seen
+    until that worker flushes; the client can compare last_seq with the
+    room's current seq and resume again.
+    """
+    limit = max(1, min(int(limit or max_page_size()), max_page_size()))
+    after_seq = int(after_seq)
+
+    page = list(
+        ChatMessage.objects.filter(room=room, seq__gt=after_seq).order_by('seq')[:limit + 1]
+    )
+    stored = {message.seq for message in page}
+    page.extend(
+        message for message in get_message_buffer().pending(room)
+        if message.seq > after_seq and message.seq not in stored
+    )
+    page.sort(key=lambda message: message.seq)
+    page = page[:limit + 1]
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    return {
+        'room': room,
+        'messages': [serialize_message(message, viewer_id) for message in page],
+        'has_more': has_more,
+        'last_seq': page[-1].seq if page else after_seq,
+    }
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+
+class ChatMessage(models.Model):
+    room = models.CharField(verbose_name='Sala', max_length=255)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        related_name='chat_messages',
+        null=True,
+        blank=True,
+    )
+    # Identificação como enviada pelo WebSocket (inclui usuários anônimos)
+    sender_id = models.CharField(verbose_name='ID do Remetente', max_length=64)
+    sender_name = models.CharField(verbose_name='Nome do Remetente', max_length=120)
+    sender_avatar = models.CharField(
+        verbose_name='Avatar do Remetente', max_length=255, blank=True, null=True
+    )
+    message = models.TextField(verbose_name='Mensagem')
+    # Número de sequência monotônico por sala e id gerado pelo cliente
+    # (envio idempotente)
+    seq = models.PositiveBigIntegerField(verbose_name='Sequência', default=0)
+    client_id = models.CharField(
+        verbose_name='ID do Cliente', max_length=64, blank=True, null=True
+    )
+    created_at = models.DateTimeField(verbose_name='Data de Envio', default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Mensagem do Chat'
+        verbose_name_plural = 'Mensagens do Chat'
+        ordering = ['created_at', 'id']
+        indexes = [
+            # Cursor (room, created_at, id) da paginação do histórico
+            models.Index(fields=['room', 'created_at', 'id'], name='chat_msg_room_cursor_idx'),
+            # Reenvio das mensagens perdidas (resume after_seq)
+            models.Index(fields=['room', 'seq'], name='chat_msg_room_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.sender_name} em {self.room}: {self.message[:30]}'
@@ -0,0 +1,194 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+
+from django.conf import settings
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+
+logger = logging.getLogger(__name__)
+
+# Código de fechamento para clientes lentos demais: devem reconectar e
+# pedir resume a partir do último seq recebido
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+# Frames que podem ser descartados sob pressão (estado efêmero, o cliente se
+# recupera no próximo evento); mensagens de chat nunca são descartadas
+DROPPABLE_FRAME_TYPES = frozenset({'presence_join', 'presence_leave', 'typing', 'pong'})
+
+# Contadores do processo, expostos em chat/api/metrics/
+counters = {
+    'frames_sent': 0,
+    'frames_dropped': 0,
+    'connections_evicted': 0,
+    'channel_layer_gaps': 0,
+}
+
+
+def transport_of(send):
+    """The Twisted transport behind Daphne's ASGI send callable, or None.
+
+    Daphne hands each connection partial(server.handle_reply, protocol).
+    Under another server (or the test communicator) there is no transport
+    to watch and only the queue limits apply.
+    """
+    if not isinstance(send, functools.partial) or not send.args:
+        return None
+    transport = getattr(send.args[0], 'transport', None)
+    return transport if hasattr(transport, 'registerProducer') else None
+
+
+@implementer(IPushProducer)
+class TransportWatch:
+    """Streaming producer that tracks whether a transport takes more data.
+
+    The send of a WebSocket frame never waits: Daphne writes it straight
+    into the transport's buffer. Twisted pauses a registered producer once
+    that buffer passes bufferSize (64 KiB) and resumes it when the socket
+    has drained, so writable is clear exactly while the client is behind.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.writable = asyncio.Event()
+        self.writable.set()
+        transport.registerProducer(self, True)
+
+    def pauseProducing(self):
+        self.writable.clear()
+
+    def resumeProducing(self):
+        self.writable.set()
+
+    def stopProducing(self):
+        # Conexão perdida: liberar o escritor, os envios viram no-op
+        self.writable.set()
+
+    def close(self):
+        try:
+            self.transport.unregisterProducer()
+        except Exception:
+            pass
+
+
+class Outbox:
+    """Bounded outbound queue for one WebSocket connection.
+
+    Frames are queued and written by a single writer task, so a client on a
+    slow link builds up a queue here instead of stalling whoever produced
+    the frame. With a transport (see transport_of) the writer holds frames
+    while its write buffer is full, so they count against the limits;
+    without one, only a writer slower than the producers can fill it. Past max_messages / max_bytes the oldest droppable frames are
+    discarded first. If only undroppable frames remain and the queue stays
+    over the limit for longer than grace seconds (or reaches twice the
+    limit), on_evict is called so the consumer can close the socket.
+    Sizes are measured in characters of the encoded JSON text.
+    """
+
+    def __init__(self, send, on_evict, max_messages=500, max_bytes=1024 * 1024, grace=10,
+                 transport=None):
+        self.send = send
+        self.on_evict = on_evict
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self._queue = deque()
+        self._bytes = 0
+        self._droppable = 0
+        self._over_since = None
+        self._evicted = False
+        self._ready = asyncio.Event()
+        self._watch = TransportWatch(transport) if transport is not None else None
+        self._task = asyncio.create_task(self._writer())
+
+    def put(self, text, droppable=False):
+        """Queue a frame. Returns False if the connection is being evicted."""
+        if self._evicted:
+            return False
+
+        self._queue.append((text, droppable))
+        self._bytes += len(text)
+        self._droppable += droppable
+        if self._over_limit():
+            self._shed()
+        self._ready.set()
+        return not self._evicted
+
+    def close(self):
+        self._task.cancel()
+        if self._watch is not None:
+            self._watch.close()
+
+    def _over_limit(self, factor=1, kept=0):
+        return (
+            len(self._queue) + kept > self.max_messages * factor
+            or self._bytes > self.max_bytes * factor
+        )
+
+    def _shed(self):
+        # Descartar primeiro os frames efêmeros mais antigos
+        if self._droppable:
+            kept = deque()
+            while self._queue and self._over_limit(kept=len(kept)):
+                text, droppable = self._queue.popleft()
+                if droppable:
+                    self._bytes -= len(text)
+                    self._droppable -= 1
+                    counters['frames_dropped'] += 1
+                else:
+                    kept.append((text, droppable))
+            kept.extend(self._queue)
+            self._queue = kept
+
+        if not self._over_limit():
+            self._over_since = None
+            return
+
+        now = time.monotonic()
+        if self._over_since is None:
+            self._over_since = now
+        if self._over_limit(factor=2) or now - self._over_since > self.grace:
+            self._evict()
+
+    def _evict(self):
+        self._evicted = True
+        counters['connections_evicted'] += 1
+        counters['frames_dropped'] += len(self._queue)
+        self._queue.clear()
+        self._bytes = 0
+        self._droppable = 0
+        self.on_evict()
+
+    async def _writer(self):
+        while True:
+            await self._ready.wait()
+            while self._queue:
+                # Buffer do transporte cheio: segurar os frames aqui, onde
+                # contam para o limite (e podem ser descartados)
+                if self._watch is not None and not self._watch.writable.is_set():
+                    await self._watch.writable.wait()
+                    continue
+                text, droppable = self._queue.popleft()
+                self._bytes -= len(text)
+                self._droppable -= droppable
+                try:
+                    await self.send(text)
+                    counters['frames_sent'] += 1
+                except Exception as e:
+                    logger.error("❌ Erro ao enviar frame: %s", e)
+            if not self._over_limit():
+                self._over_since = None
+            self._ready.clear()
+
+
+def build_outbox(send, on_evict, transport=None):
+    return Outbox(
+        send,
+        on_evict,
+        max_messages=getattr(settings, 'CHAT_OUTBOX_MAX_MESSAGES', 500),
+        max_bytes=getattr(settings, 'CHAT_OUTBOX_MAX_BYTES', 1024 * 1024),
+        grace=getattr(settings, 'CHAT_OUTBOX_GRACE_SECONDS', 10),
+        transport=transport,
+    )
@@ -0,0 +1,155 @@
+import json
+import time
+
+from django.conf import settings
+
+from .stores import get_redis
+
+
+def presence_ttl():
+    return getattr(settings, 'CHAT_PRESENCE_TTL', 60)
+
+
+class MemoryPresence:
+    """Who is online in each room, for a single process.
+
+    A user is online while at least one of their connections is in the room
+    and their entry keeps being refreshed by heartbeat(). Connections are
+    reference-counted per user, so join()/leave() only report a change for
+    the first connection in and the last one out. Counts are len() of a
+    dict, so they never depend on how many members a room has.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._expires = {}      # room -> {user_id: expires_at}
+        self._connections = {}  # room -> {user_id: count}
+        self._info = {}         # room -> {user_id: info}
+
+    async def join(self, room, user_id, info):
+        """Register a connection. Returns True if the user just came online."""
+        connections = self._connections.setdefault(room, {})
+        connections[user_id] = connections.get(user_id, 0) + 1
+        self._expires.setdefault(room, {})[user_id] = time.time() + self.ttl
+        self._info.setdefault(room, {})[user_id] = info
+        return connections[user_id] == 1
+
+    async def leave(self, room, user_id):
+        """Drop a connection. Returns True if the user just went offline."""
+        connections = self._connections.get(room, {})
+        remaining = connections.get(user_id, 0) - 1
+        if remaining > 0:
+            connections[user_id] = remaining
+            return False
+        return self._forget(room, user_id)
+
+    async def heartbeat(self, room, user_id):
+        if user_id in self._expires.get(room, {}):
+            self._expires[room][user_id] = time.time() + self.ttl
+
+    async def sweep(self, room):
+        """Remove users whose heartbeat expired. Returns their ids."""
+        now = time.time()
+        expired = [
+            user_id for user_id, expires_at in self._expires.get(room, {}).items()
+            if expires_at < now
+        ]
+        for user_id in expired:
+            self._forget(room, user_id)
+        return expired
+
+    async def count(self, room):
+        return len(self._expires.get(room, {}))
+
+    async def members(self, room):
+        return list(self._info.get(room, {}).values())
+
+    def _forget(self, room, user_id):
+        self._connections.get(room, {}).pop(user_id, None)
+        self._info.get(room, {}).pop(user_id, None)
+        was_online = self._expires.get(room, {}).pop(user_id, None) is not None
+        for table in (self._expires, self._connections, self._info):
+            if not table.get(room):
+                table.pop(room, None)
+        return was_online
+
+
+class RedisPresence:
+    """Presence shared by every worker through the channel layer's Redis.
+
+    Per room: a sorted set of user ids scored by heartbeat expiry, a hash of
+    connection counts and a hash of user info. Expired users (e.g. from a
+    worker that died without running disconnect) are removed by sweep(),
+    which keeps ZCARD an exact, O(1) online count.
+    """
+
+    def __init__(self, redis, ttl=60):
+        self.redis = redis
+        self.ttl = ttl
+
+    def _keys(self, room):
+        prefix = f'chat:presence:{room}'
+        return f'{prefix}:online', f'{prefix}:connections', f'{prefix}:info'
+
+    async def join(self, room, user_id, info):
+        online, connections, info_key = self._keys(room)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(connections, user_id, 1)
+            pipe.zadd(online, {user_id: time.time() + self.ttl})
+            pipe.hset(info_key, user_id, json.dumps(info, ensure_ascii=False))
+            count, _, _ = await pipe.execute()
+        return count == 1
+
+    async def leave(self, room, user_id):
+        online, connections, info_key = self._keys(room)
+        remaining = await self.redis.hincrby(connections, user_id, -1)
+        if remaining > 0:
+            return False
+        return await self._forget(room, [user_id]) > 0
+
+    async def heartbeat(self, room, user_id):
+        online, _, _ = self._keys(room)
+        await self.redis.zadd(online, {user_id: time.time() + self.ttl}, xx=True)
+
+    async def sweep(self, room):
+        online, _, _ = self._keys(room)
+        expired = await self.redis.zrangebyscore(online, '-inf', time.time())
+        expired = [user_id.decode() for user_id in expired]
+        if expired:
+            await self._forget(room, expired)
+        return expired
+
+    async def count(self, room):
+        online, _, _ = self._keys(room)
+        return await self.redis.zcard(online)
+
+    async def members(self, room):
+        online, _, info_key = self._keys(room)
+        user_ids = await self.redis.zrangebyscore(online, time.time(), '+inf')
+        if not user_ids:
+            return []
+        infos = await self.redis.hmget(info_key, user_ids)
+        return [json.loads(info) for info in infos if info]
+
+    async def _forget(self, room, user_ids):
+        online, connections, info_key = self._keys(room)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(online, *user_ids)
+            pipe.hdel(connections, *user_ids)
+            pipe.hdel(info_key, *user_ids)
+            removed, _, _ = await pipe.execute()
+        return removed
+
+
+_presence = None
+
+
+def get_presence():
+    global _presence
+    if _presence is None:
+        redis = get_redis()
+        if redis is not None:
+            _presence = RedisPresence(redis, ttl=presence_ttl())
+        else:
+            _presence = MemoryPresence(ttl=presence_ttl())
+    return _presence
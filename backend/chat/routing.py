@@ -1,7 +1,19 @@
+from django.conf import settings
 from django.urls import re_path
 
 from . import consumers
 
+# "async" usa o AsyncChatConsumer (sem saltos de thread por operação);
+# "sync" mantém o ChatConsumer original baseado em async_to_sync.
+CHAT_CONSUMERS = {
+    "async": consumers.AsyncChatConsumer,
+    "sync": consumers.ChatConsumer,
+}
+
+chat_consumer = CHAT_CONSUMERS[getattr(settings, "CHAT_CONSUMER_MODE", "async")]
+
 websocket_urlpatterns = [
-    re_path(r"ws/chat/(?P<room_name>\w+)/$", consumers.ChatConsumer.as_asgi()),
-]
\ No newline at end of file
+    # Várias salas na mesma conexão (subscribe/unsubscribe)
+    re_path(r"ws/chat/$", consumers.MultiplexChatConsumer.as_asgi()),
+    re_path(r"ws/chat/(?P<room_name>\w+)/$", chat_consumer.as_asgi()),
+]
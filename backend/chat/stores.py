@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import weakref
+from collections import OrderedDict
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Max
+
+logger = logging.getLogger(__name__)
+
+class LoopLocalRedis:
+    """redis.asyncio client with one real connection pool per event loop.
+
+    redis.asyncio connections belong to the loop that opened them, and a
+    process runs coroutines on more than one loop: Daphne's, and the ones
+    async_to_sync creates for sync views, commands and tests. Attribute
+    access goes to the client of the running loop, created on first use.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._clients = weakref.WeakKeyDictionary()  # loop -> client
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = self.factory()
+        return client
+
+    def __getattr__(self, name):
+        return getattr(self.client(), name)
+
+
+_redis = None
+
+
+def get_redis():
+    """Async Redis client for the channel layer's Redis, or None.
+
+    Chat state shared between Daphne workers (sequence numbers, presence,
+    rate limits) lives in the same Redis as RedisChannelLayer. With
+    InMemoryChannelLayer there is a single process, so the in-memory stores
+    are used instead. Only usable inside a coroutine (see LoopLocalRedis).
+    """
+    global _redis
+    layer = settings.CHANNEL_LAYERS.get('default', {})
+    if 'redis' not in layer.get('BACKEND', '').lower():
+        return None
+
+    if _redis is None:
+        import redis.asyncio
+
+        host = layer.get('CONFIG', {}).get('hosts', [('127.0.0.1', 6379)])[0]
+        if isinstance(host, str):
+            _redis = LoopLocalRedis(lambda: redis.asyncio.from_url(host))
+        else:
+            _redis = LoopLocalRedis(lambda: redis.asyncio.Redis(host=host[0], port=host[1]))
+    return _redis
+
+
+def load_last_seq(room):
+    """Highest sequence number stored or buffered by this process for a room.
+
+    Only needed when a room's counter is not in memory/Redis yet. Messages
+    buffered by another worker are not seen, which only matters if Redis
+    loses the counter while they are pending.
+    """
+    from .buffer import get_message_buffer
+    from .models import ChatMessage
+
+    stored = ChatMessage.objects.filter(room=room).aggregate(last=Max('seq'))['last'] or 0
+    return max([stored, *(message.seq for message in get_message_buffer().pending(room))])
+
+
+class MemorySequenceStore:
+    """Per-room sequence numbers and recent client ids for one process"""
+
+    def __init__(self, max_client_ids=50000):
+        self.max_client_ids = max_client_ids
+        self._last_seq = {}
+        self._client_ids = OrderedDict()
+
+    async def current_seq(self, room):
+        if room not in self._last_seq:
+            last = await database_sync_to_async(load_last_seq)(room)
+            self._last_seq.setdefault(room, last)
+        return self._last_seq[room]
+
+    async def next_seq(self, room):
+        await self.current_seq(room)
+        self._last_seq[room] += 1
+        return self._last_seq[room]
+
+    async def claim_client_id(self, room, client_id):
+        """Reserve client_id. Returns None if new, else the seq it got (0 = in flight)."""
+        key = (room, client_id)
+        if key in self._client_ids:
+            self._client_ids.move_to_end(key)
+            return self._client_ids[key]
+
+        self._client_ids[key] = 0
+        if len(self._client_ids) > self.max_client_ids:
+            self._client_ids.popitem(last=False)
+        return None
+
+    async def remember_client_id(self, room, client_id, seq):
+        self._client_ids[(room, client_id)] = seq
+
+    async def release_client_id(self, room, client_id):
+        """Forget a claim whose message was never stored, so a retry goes through"""
+        self._client_ids.pop((room, client_id), None)
+
+
+class RedisSequenceStore:
+    """Sequence numbers shared by every worker through Redis INCR"""
+
+    def __init__(self, redis, client_id_ttl=86400):
+        self.redis = redis
+        self.client_id_ttl = client_id_ttl
+
+    async def current_seq(self, room):
+        key = f'chat:seq:{room}'
+        value = await self.redis.get(key)
+        if value is None:
+            # Primeiro uso da sala (ou Redis reiniciado): partir do banco
+            last = await database_sync_to_async(load_last_seq)(room)
+            await self.redis.set(key, last, nx=True)
+            value = await self.redis.get(key)
+        return int(value)
+
+    async def next_seq(self, room):
+        await self.current_seq(room)
+        return await self.redis.incr(f'chat:seq:{room}')
+
+    async def claim_client_id(self, room, client_id):
+        key = f'chat:cid:{room}:{client_id}'
+        if await self.redis.set(key, 0, nx=True, ex=self.client_id_ttl):
+            return None
+        return int(await self.redis.get(key) or 0)
+
+    async def remember_client_id(self, room, client_id, seq):
+        await self.redis.set(f'chat:cid:{room}:{client_id}', seq, ex=self.client_id_ttl)
+
+    async def release_client_id(self, room, client_id):
+        await self.redis.delete(f'chat:cid:{room}:{client_id}')
+
+
+_sequence_store = None
+
+
+def get_sequence_store():
+    global _sequence_store
+    if _sequence_store is None:
+        redis = get_redis()
+        if redis is not None:
+            _sequence_store = RedisSequenceStore(
+                redis, client_id_ttl=getattr(settings, 'CHAT_CLIENT_ID_TTL', 86400)
+            )
+        else:
+            _sequence_store = MemorySequenceStore()
+    return _sequence_store
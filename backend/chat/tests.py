@@ -0,0 +1,705 @@
+import asyncio
+import functools
+import json
+import logging
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock, skipIf
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import re_path
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from app.log import JsonFormatter, QueueListenerHandler, SamplingFilter, counters as log_counters
+from user.models import CustomUser, Session
+
+from . import consumers
+from .buffer import MessageWriteBuffer, get_message_buffer
+from .history import fetch_after, fetch_history
+from .models import ChatMessage
+from .outbox import SLOW_CONSUMER_CLOSE_CODE, Outbox, counters, transport_of
+from .presence import RedisPresence, get_presence
+from .stores import LoopLocalRedis, load_last_seq
+from .throttling import ConnectionRateLimitMiddleware, MemoryBuckets, TokenBucket
+from .views import room_history_view, room_presence_view
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class ScopeUser:
+    """Sets scope['user'], as FirebaseWebSocketAuthMiddleware does"""
+
+    def __init__(self, inner, user):
+        self.inner = inner
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        return await self.inner({**scope, 'user': self.user}, receive, send)
+
+
+def chat_application(consumer=consumers.AsyncChatConsumer):
+    return URLRouter([
+        re_path(r"ws/chat/$", consumers.MultiplexChatConsumer.as_asgi()),
+        re_path(r"ws/chat/(?P<room_name>\w+)/$", consumer.as_asgi()),
+    ])
+
+
+class ChatTestCase(TestCase):
+    """Fresh chat state per test.
+
+    The write-behind buffer has no background thread (tests call flush()),
+    and sequences, presence and rate limits start empty and in memory.
+    """
+
+    consumer = consumers.AsyncChatConsumer
+
+    @classmethod
+    def setUpTestData(cls):
+        # Usernames são os uids do Firebase; a sala 1:1 é "<uid>_<uid>"
+        cls.ana = CustomUser.objects.create(username='ana', email='ana@example.com', name='Ana', type='user')
+        cls.bia = CustomUser.objects.create(username='bia', email='bia@example.com', name='Bia', type='user')
+        cls.room = 'ana_bia'
+
+    def setUp(self):
+        patches = [
+            mock.patch('chat.buffer._buffer', MessageWriteBuffer()),
+            mock.patch.object(MessageWriteBuffer, '_start'),
+            mock.patch('chat.stores._sequence_store', None),
+            mock.patch('chat.presence._presence', None),
+            mock.patch('chat.throttling._buckets', None),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def communicator(self, path, user=None):
+        return WebsocketCommunicator(
+            ScopeUser(chat_application(self.consumer), user or AnonymousUser()), path
+        )
+
+    async def connect(self, path, user=None):
+        """Connected communicator and its connection_established frame"""
+        communicator = self.communicator(path, user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, await self.receive(communicator)
+
+    async def receive(self, communicator, skip=('presence_join', 'presence_leave')):
+        return json.loads(await self.receive_text(communicator, skip))
+
+    async def receive_text(self, communicator, skip=('presence_join', 'presence_leave')):
+        while True:
+            text = await communicator.receive_from(timeout=5)
+            if json.loads(text)['type'] not in skip:
+                return text
+
+    async def flush(self):
+        await database_sync_to_async(get_message_buffer().flush)()
+
+    async def send(self, communicator, **frame):
+        await communicator.send_to(text_data=json.dumps(frame))
+        return await self.receive(communicator)
+
+
+class ChatTimestampTests(ChatTestCase):
+    async def test_live_and_stored_timestamps_match(self):
+        sender, established = await self.connect('/ws/chat/ana_bia/', self.ana)
+        receiver, _ = await self.connect('/ws/chat/ana_bia/', self.bia)
+
+        sent = await self.send(sender, type='chat_message', message='oi')
+        live = await self.receive(receiver)
+        await self.flush()
+        stored = await self.send(sender, type='history')
+
+        self.assertEqual(live['timestamp'], sent['timestamp'])
+        self.assertEqual(stored['messages'][0]['timestamp'], live['timestamp'])
+        for timestamp in (established['timestamp'], live['timestamp']):
+            self.assertIsNotNone(datetime.fromisoformat(timestamp).tzinfo)
+
+        await sender.disconnect()
+        await receiver.disconnect()
+
+
+class SyncChatTimestampTests(ChatTimestampTests):
+    consumer = consumers.ChatConsumer
+
+
+class BroadcastTests(ChatTestCase):
+    async def test_frame_is_encoded_once_for_every_recipient(self):
+        receivers = [(await self.connect('/ws/chat/ana_bia/', self.bia))[0] for _ in range(3)]
+        sender, _ = await self.connect('/ws/chat/ana_bia/', self.ana)
+
+        with mock.patch('chat.consumers.encode_frame', wraps=consumers.encode_frame) as encode:
+            sent = await self.send(sender, type='chat_message', message='oi')
+            frames = [await self.receive_text(communicator) for communicator in receivers]
+
+        chat_encodes = [call for call in encode.call_args_list if call.args[0]['type'] == 'chat_message']
+        self.assertEqual(len(chat_encodes), 1)
+        self.assertEqual(len(set(frames)), 1)
+        self.assertEqual(json.loads(frames[0])['seq'], sent['seq'])
+        # O remetente recebe só a confirmação, não o próprio broadcast
+        self.assertTrue(await sender.receive_nothing())
+
+        for communicator in [sender, *receivers]:
+            await communicator.disconnect()
+
+
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        self.buffer = MessageWriteBuffer()
+        patches = [
+            mock.patch('chat.buffer._buffer', self.buffer),
+            mock.patch.object(MessageWriteBuffer, '_start'),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add(self, seq, room='sala'):
+        self.buffer.add(ChatMessage(
+            room=room, sender_id='1', sender_name='Ana', message=f'm{seq}', seq=seq
+        ))
+
+    def test_reads_do_not_flush(self):
+        for seq in (1, 2, 3):
+            self.add(seq)
+
+        with self.assertNumQueries(1):
+            page = fetch_history('sala')
+
+        self.assertEqual(page['messages'], [])
+        self.assertEqual(len(self.buffer.pending('sala')), 3)
+        self.assertFalse(ChatMessage.objects.exists())
+
+    def test_resume_merges_own_buffer_without_duplicates(self):
+        for seq in (1, 2):
+            self.add(seq)
+        self.buffer.flush()
+        for seq in (3, 4):
+            self.add(seq)
+        self.add(5, room='outra')
+
+        page = fetch_after('sala', 1)
+
+        self.assertEqual([message['seq'] for message in page['messages']], [2, 3, 4])
+        self.assertEqual(page['last_seq'], 4)
+        self.assertFalse(page['has_more'])
+        self.assertEqual(fetch_after('sala', 0, limit=2)['has_more'], True)
+
+    def test_last_seq_counts_buffered_messages(self):
+        self.add(1)
+        self.buffer.flush()
+        self.add(2)
+
+        self.assertEqual(load_last_seq('sala'), 2)
+        self.assertEqual(load_last_seq('outra'), 0)
+
+    def test_failed_flush_keeps_the_batch(self):
+        self.add(1)
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', side_effect=OperationalError):
+            self.assertEqual(self.buffer.flush(), 0)
+
+        self.assertEqual([message.seq for message in self.buffer.pending('sala')], [1])
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.buffer.pending('sala'), [])
+        self.assertEqual(ChatMessage.objects.get().seq, 1)
+
+    def test_bad_row_does_not_block_the_batch(self):
+        self.add(1)
+        self.buffer.add(ChatMessage(room='sala', sender_id='1', sender_name='Ana', message=None, seq=2))
+        self.add(3)
+
+        with self.assertLogs('chat.buffer', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 2)
+
+        self.assertEqual(self.buffer.pending('sala'), [])
+        self.assertEqual(list(ChatMessage.objects.values_list('seq', flat=True)), [1, 3])
+        self.add(4)
+        self.assertEqual(self.buffer.flush(), 1)
+
+
+class RoomAccessTests(ChatTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.eva = CustomUser.objects.create(username='eva', email='eva@example.com', type='user')
+        cls.dra = CustomUser.objects.create(username='dra', email='dra@example.com', type='psychologist')
+
+    async def refused(self, path, user=None):
+        connected, _ = await self.communicator(path, user).connect()
+        return not connected
+
+    async def test_only_participants_join(self):
+        self.assertTrue(await self.refused('/ws/chat/ana_bia/', self.eva))
+        self.assertTrue(await self.refused('/ws/chat/ana_bia/'))
+        self.assertTrue(await self.refused('/ws/chat/ana_bia/?history=10'))
+        # Psicólogo precisa ter sessões com todos os participantes
+        await database_sync_to_async(Session.objects.create)(psychologist=self.dra, user=self.ana)
+        self.assertTrue(await self.refused('/ws/chat/ana_bia/', self.dra))
+        await database_sync_to_async(Session.objects.create)(psychologist=self.dra, user=self.bia)
+
+        communicator, established = await self.connect('/ws/chat/ana_bia/?history=5', self.dra)
+        self.assertEqual(established['history'], [])
+        await communicator.disconnect()
+
+    async def test_participant_reads_history(self):
+        communicator, _ = await self.connect('/ws/chat/ana_bia/', self.ana)
+        await self.send(communicator, type='chat_message', message='oi')
+        await self.flush()
+
+        history = await self.send(communicator, type='history')
+        resume = await self.send(communicator, type='resume', after_seq=0)
+
+        self.assertEqual([m['message'] for m in history['messages']], ['oi'])
+        self.assertEqual([m['message'] for m in resume['messages']], ['oi'])
+        await communicator.disconnect()
+
+    async def test_bad_pagination_is_a_validation_error(self):
+        communicator, _ = await self.connect('/ws/chat/ana_bia/', self.ana)
+
+        for frame in (
+            {'type': 'history', 'limit': None},
+            {'type': 'history', 'limit': [1]},
+            {'type': 'history', 'limit': 'dez'},
+            {'type': 'history', 'cursor': 5},
+            {'type': 'history', 'cursor': 'não-é-cursor'},
+        ):
+            reply = await self.send(communicator, **frame)
+            self.assertEqual(reply['type'], 'error')
+            self.assertEqual(reply['message'], 'Parâmetros de paginação inválidos')
+
+        for after_seq in (None, [1], 'x'):
+            reply = await self.send(communicator, type='resume', after_seq=after_seq)
+            self.assertEqual(reply['message'], 'after_seq inválido')
+        await communicator.disconnect()
+
+    @override_settings(CHAT_PUBLIC_ROOMS=['lobby'])
+    async def test_public_room_hides_history_from_anonymous(self):
+        member, _ = await self.connect('/ws/chat/lobby/', self.eva)
+        await self.send(member, type='chat_message', message='oi')
+        await self.flush()
+
+        anonymous, established = await self.connect('/ws/chat/lobby/?history=5')
+        self.assertNotIn('history', established)
+        self.assertEqual((await self.receive(anonymous))['type'], 'error')
+        for frame in ({'type': 'history'}, {'type': 'resume', 'after_seq': 0}):
+            reply = await self.send(anonymous, **frame)
+            self.assertEqual(reply['type'], 'error')
+            self.assertNotIn('messages', reply)
+
+        self.assertEqual(len((await self.send(member, type='history'))['messages']), 1)
+        await member.disconnect()
+        await anonymous.disconnect()
+
+    def test_http_history_needs_membership(self):
+        factory = APIRequestFactory()
+        for user, expected in ((self.ana, 200), (self.eva, 403), (None, 403)):
+            request = factory.get(f'/chat/api/history/{self.room}/')
+            if user:
+                force_authenticate(request, user=user)
+            response = room_history_view(request, room_name=self.room)
+            self.assertEqual(response.status_code, expected)
+
+
+class SyncRoomAccessTests(RoomAccessTests):
+    consumer = consumers.ChatConsumer
+
+
+class SequenceTests(ChatTestCase):
+    async def test_seq_resume_and_duplicate_sends(self):
+        communicator, established = await self.connect('/ws/chat/ana_bia/', self.ana)
+        self.assertEqual(established['last_seq'], 0)
+
+        sent = [await self.send(communicator, type='chat_message', message=f'm{i}', client_id=f'c{i}') for i in range(4)]
+        self.assertEqual([frame['seq'] for frame in sent], [1, 2, 3, 4])
+
+        duplicate = await self.send(communicator, type='chat_message', message='m1', client_id='c1')
+        self.assertTrue(duplicate['duplicate'])
+        self.assertEqual(duplicate['seq'], 2)
+
+        await self.flush()
+        resume = await self.send(communicator, type='resume', after_seq=2)
+        self.assertEqual([m['message'] for m in resume['messages']], ['m2', 'm3'])
+        self.assertEqual(resume['last_seq'], 4)
+        self.assertEqual(await database_sync_to_async(ChatMessage.objects.count)(), 4)
+        await communicator.disconnect()
+
+    async def test_failed_send_can_be_retried(self):
+        communicator, _ = await self.connect('/ws/chat/ana_bia/', self.ana)
+
+        with mock.patch.object(get_message_buffer(), 'add', side_effect=RuntimeError):
+            failed = await self.send(communicator, type='chat_message', message='oi', client_id='c1')
+        retried = await self.send(communicator, type='chat_message', message='oi', client_id='c1')
+
+        self.assertEqual(failed['type'], 'error')
+        self.assertEqual(retried['type'], 'message_sent')
+        self.assertNotIn('duplicate', retried)
+        self.assertIsNotNone(retried['seq'])
+        self.assertEqual([m.message for m in get_message_buffer().pending(self.room)], ['oi'])
+        await communicator.disconnect()
+
+
+class SyncSequenceTests(SequenceTests):
+    consumer = consumers.ChatConsumer
+
+
+class PresenceTests(ChatTestCase):
+    async def test_join_and_leave_once_per_user(self):
+        ana, established = await self.connect('/ws/chat/ana_bia/', self.ana)
+        self.assertEqual(established['online_count'], 1)
+
+        bia, established = await self.connect('/ws/chat/ana_bia/', self.bia)
+        self.assertEqual(established['online_count'], 2)
+        joined = await self.receive(ana, skip=())
+        self.assertEqual((joined['type'], joined['user_id'], joined['online_count']), ('presence_join', str(self.bia.pk), 2))
+
+        # Segunda conexão da mesma pessoa não muda a presença
+        second, _ = await self.connect('/ws/chat/ana_bia/', self.bia)
+        await second.disconnect()
+        self.assertTrue(await ana.receive_nothing())
+
+        await bia.disconnect()
+        left = await self.receive(ana, skip=())
+        self.assertEqual((left['type'], left['online_count']), ('presence_leave', 1))
+        await ana.disconnect()
+
+    def test_view_needs_membership(self):
+        factory = APIRequestFactory()
+        eva = CustomUser.objects.create(username='eva', email='eva@example.com', type='user')
+        for user, expected in ((self.ana, 200), (eva, 403)):
+            request = factory.get(f'/chat/api/presence/{self.room}/')
+            force_authenticate(request, user=user)
+            response = room_presence_view(request, room_name=self.room)
+            self.assertEqual(response.status_code, expected)
+        self.assertEqual(response.data, {'error': 'Acesso negado a esta sala.'})
+
+    @skipIf(fakeredis is None, 'fakeredis não instalado')
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels_redis.core.RedisChannelLayer'}})
+    def test_redis_presence_from_sync_and_async_code(self):
+        server = fakeredis.FakeServer()
+        redis = LoopLocalRedis(lambda: fakeredis.FakeAsyncRedis(server=server))
+
+        async def join():
+            await get_presence().join(self.room, str(self.ana.pk), {'user_name': 'Ana'})
+            return redis.client()
+
+        with mock.patch('chat.stores._redis', redis):
+            first_loop = asyncio.run(join())
+            request = APIRequestFactory().get(f'/chat/api/presence/{self.room}/')
+            force_authenticate(request, user=self.bia)
+            response = room_presence_view(request, room_name=self.room)
+            second_loop = asyncio.run(join())
+
+        self.assertIsInstance(get_presence(), RedisPresence)
+        self.assertIsNot(first_loop, second_loop)
+        self.assertEqual(response.data['online_count'], 1)
+        self.assertEqual(response.data['members'], [{'user_name': 'Ana'}])
+
+
+class MultiplexTests(ChatTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.eva = CustomUser.objects.create(username='eva', email='eva@example.com', name='Eva', type='user')
+
+    async def test_subscribe_only_to_own_rooms(self):
+        bia, _ = await self.connect('/ws/chat/', self.bia)
+        eva, _ = await self.connect('/ws/chat/', self.eva)
+
+        subscribed = await self.send(bia, type='subscribe', room='ana_bia')
+        self.assertEqual(subscribed['type'], 'subscribed')
+        denied = await self.send(eva, type='subscribe', room='ana_bia', history=10)
+        self.assertEqual((denied['type'], denied['message']), ('error', 'Acesso negado a esta sala'))
+        refused = await self.send(eva, type='history', room='ana_bia')
+        self.assertEqual(refused['message'], 'Inscreva-se na sala antes de usá-la')
+
+        # Mensagens da sala chegam só a quem se inscreveu
+        ana, _ = await self.connect('/ws/chat/ana_bia/', self.ana)
+        await self.send(ana, type='chat_message', message='oi')
+        self.assertEqual((await self.receive(bia))['message'], 'oi')
+        self.assertTrue(await eva.receive_nothing())
+
+        await self.flush()
+        resubscribed = await self.send(bia, type='subscribe', room='ana_bia', history=5)
+        self.assertEqual([m['message'] for m in resubscribed['history']], ['oi'])
+        self.assertEqual((await self.send(bia, type='unsubscribe', room='ana_bia'))['type'], 'unsubscribed')
+
+        for communicator in (ana, bia, eva):
+            await communicator.disconnect()
+
+    async def test_invalid_history_is_an_error(self):
+        bia, _ = await self.connect('/ws/chat/', self.bia)
+
+        for history in (None, [3], -1, 'dez', True):
+            reply = await self.send(bia, type='subscribe', room='ana_bia', history=history)
+            self.assertEqual(reply['type'], 'error')
+            self.assertEqual(reply['message'], 'history deve ser um número inteiro não negativo')
+        self.assertEqual((await self.send(bia, type='subscribe', room='ana_bia', history=500))['type'], 'subscribed')
+        invalid = await self.send(bia, type='subscribe', room='ana bia')
+        self.assertEqual(invalid['message'], 'Sala inválida')
+        await bia.disconnect()
+
+
+class FakeTransport:
+    """Twisted transport stand-in: only the producer registration"""
+
+    producer = None
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+async def settle():
+    """Let the outbox writer task run"""
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+class OutboxTests(SimpleTestCase):
+    def setUp(self):
+        self.sent = []
+        self.evicted = []
+        self.transport = FakeTransport()
+
+    async def write(self, text):
+        self.sent.append(text)
+
+    def outbox(self, **limits):
+        return Outbox(self.write, lambda: self.evicted.append(True), transport=self.transport, **limits)
+
+    def test_transport_of_daphne_send(self):
+        protocol = SimpleNamespace(transport=self.transport)
+        self.assertIs(transport_of(functools.partial(self.write, protocol)), self.transport)
+        self.assertIsNone(transport_of(self.write))
+
+    async def test_frames_wait_for_a_full_transport(self):
+        outbox = self.outbox(max_messages=3)
+        outbox.put('a')
+        await settle()
+        self.assertEqual(self.sent, ['a'])
+
+        # Buffer do transporte acima de bufferSize: o Twisted pausa o produtor
+        self.transport.producer.pauseProducing()
+        for text in 'bcd':
+            self.assertTrue(outbox.put(text))
+        await settle()
+        self.assertEqual(self.sent, ['a'])
+
+        self.transport.producer.resumeProducing()
+        await settle()
+        self.assertEqual(self.sent, list('abcd'))
+        self.assertEqual(self.evicted, [])
+        outbox.close()
+        self.assertIsNone(self.transport.producer)
+
+    async def test_droppable_frames_are_shed_first(self):
+        dropped = counters['frames_dropped']
+        outbox = self.outbox(max_messages=3)
+        self.transport.producer.pauseProducing()
+        outbox.put('c1')
+        for text in ('p1', 'p2', 'p3'):
+            outbox.put(text, droppable=True)
+        outbox.put('c2')
+
+        self.transport.producer.resumeProducing()
+        await settle()
+        self.assertEqual(self.sent, ['c1', 'p3', 'c2'])
+        self.assertEqual(counters['frames_dropped'] - dropped, 2)
+        outbox.close()
+
+    async def test_slow_consumer_is_evicted(self):
+        evictions = counters['connections_evicted']
+        outbox = self.outbox(max_messages=3)
+        self.transport.producer.pauseProducing()
+        accepted = [outbox.put(f'm{n}') for n in range(7)]
+
+        self.assertEqual(accepted, [True] * 6 + [False])
+        self.assertEqual(self.evicted, [True])
+        self.assertEqual(counters['connections_evicted'] - evictions, 1)
+        self.assertFalse(outbox.put('depois'))
+        self.transport.producer.resumeProducing()
+        await settle()
+        self.assertEqual(self.sent, [])
+        outbox.close()
+
+    async def test_fast_consumer_is_never_evicted(self):
+        outbox = self.outbox(max_messages=3)
+        for n in range(20):
+            outbox.put(f'm{n}')
+            await settle()
+        self.assertEqual(len(self.sent), 20)
+        self.assertEqual(self.evicted, [])
+        outbox.close()
+
+
+@override_settings(CHAT_OUTBOX_MAX_MESSAGES=2)
+class SlowConsumerTests(ChatTestCase):
+    async def test_client_behind_a_full_transport_is_closed(self):
+        transports = []
+
+        def fake_transport_of(send):
+            transports.append(FakeTransport())
+            return transports[-1]
+
+        with mock.patch('chat.consumers.transport_of', fake_transport_of):
+            bia, _ = await self.connect('/ws/chat/ana_bia/', self.bia)
+            transports[0].producer.pauseProducing()
+            ana, _ = await self.connect('/ws/chat/ana_bia/', self.ana)
+            for n in range(5):
+                await self.send(ana, type='chat_message', message=f'oi {n}')
+
+        closed = await bia.receive_output(timeout=5)
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': SLOW_CONSUMER_CLOSE_CODE})
+        await ana.disconnect()
+
+    async def test_dropped_broadcasts_ask_for_resync(self):
+        bia, _ = await self.connect('/ws/chat/ana_bia/', self.bia)
+        layer = get_channel_layer()
+        gaps = counters['channel_layer_gaps']
+
+        # seq 2 perdido pelo channel layer (canal acima da capacidade)
+        for seq in (1, 3):
+            frame = consumers.encode_frame({'type': 'chat_message', 'room': 'ana_bia', 'seq': seq})
+            event = consumers.build_broadcast_event(frame, 'outro', room='ana_bia', seq=seq)
+            await layer.group_send(consumers.group_name('ana_bia'), event)
+
+        received = [await self.receive(bia) for _ in range(3)]
+        self.assertEqual([frame['type'] for frame in received], ['chat_message', 'resync', 'chat_message'])
+        self.assertEqual(received[1], {'type': 'resync', 'room': 'ana_bia', 'after_seq': 1})
+        self.assertEqual(counters['channel_layer_gaps'] - gaps, 1)
+        await bia.disconnect()
+
+
+class ScopeClient:
+    """Sets scope['client'], as Daphne does"""
+
+    def __init__(self, inner, address):
+        self.inner = inner
+        self.address = address
+
+    async def __call__(self, scope, receive, send):
+        return await self.inner({**scope, 'client': (self.address, 40000)}, receive, send)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_wait(self):
+        with mock.patch('chat.throttling.time.monotonic', return_value=100.0) as now:
+            bucket = TokenBucket(rate=2, burst=3)
+            self.assertEqual([bucket.take() for _ in range(3)], [0, 0, 0])
+            self.assertAlmostEqual(bucket.take(), 0.5)
+            now.return_value = 100.5
+            self.assertEqual(bucket.take(), 0)
+
+    async def test_memory_buckets_are_per_key_and_bounded(self):
+        buckets = MemoryBuckets(max_keys=2)
+        self.assertEqual(await buckets.take('a', 1, 1), 0)
+        self.assertGreater(await buckets.take('a', 1, 1), 0)
+        self.assertEqual(await buckets.take('b', 1, 1), 0)
+        await buckets.take('c', 1, 1)
+        self.assertEqual(list(buckets._buckets), ['b', 'c'])
+        # 'a' saiu do LRU: começa cheio de novo
+        self.assertEqual(await buckets.take('a', 1, 1), 0)
+
+
+@override_settings(CHAT_RATE_LIMITS={
+    'frame_connection': (0.001, 2), 'frame_user': (0.001, 3), 'connect_ip': (0.001, 1), 'connect_user': (0.001, 1),
+})
+class ThrottlingTests(ChatTestCase):
+    async def test_frames_over_the_connection_limit_are_dropped(self):
+        bia, _ = await self.connect('/ws/chat/ana_bia/', self.bia)
+        replies = [await self.send(bia, type='ping') for _ in range(3)]
+
+        self.assertEqual([reply['type'] for reply in replies], ['pong', 'pong', 'error'])
+        self.assertGreater(replies[2]['retry_after'], 0)
+        await bia.disconnect()
+
+    async def test_user_limit_spans_connections(self):
+        first, _ = await self.connect('/ws/chat/ana_bia/', self.bia)
+        second, _ = await self.connect('/ws/chat/ana_bia/', self.bia)
+        replies = [await self.send(communicator, type='ping') for communicator in (first, second, first, second)]
+
+        self.assertEqual([reply['type'] for reply in replies], ['pong', 'pong', 'pong', 'error'])
+        for communicator in (first, second):
+            await communicator.disconnect()
+
+    async def test_admission_by_ip_and_by_user(self):
+        by_ip = ScopeClient(ConnectionRateLimitMiddleware(ScopeUser(chat_application(self.consumer), self.bia)), '10.0.0.1')
+        by_user = ScopeUser(ConnectionRateLimitMiddleware(chat_application(self.consumer), by='user'), self.ana)
+
+        for application in (by_ip, by_user):
+            accepted = WebsocketCommunicator(application, '/ws/chat/ana_bia/')
+            self.assertTrue((await accepted.connect())[0])
+            refused = WebsocketCommunicator(application, '/ws/chat/ana_bia/')
+            self.assertFalse((await refused.connect())[0])
+            await accepted.disconnect()
+
+
+class SyncThrottlingTests(ThrottlingTests):
+    consumer = consumers.ChatConsumer
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self, name):
+        super().__init__()
+        self.set_name(name)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LoggingTests(SimpleTestCase):
+    def record(self, name='chat.consumers', level=logging.INFO, msg='oi %s', args=('Ana',)):
+        return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+    def test_json_formatter(self):
+        entry = json.loads(JsonFormatter().format(self.record()))
+        self.assertEqual(
+            {key: entry[key] for key in ('level', 'logger', 'msg')},
+            {'level': 'INFO', 'logger': 'chat.consumers', 'msg': 'oi Ana'},
+        )
+        self.assertIsNotNone(datetime.fromisoformat(entry['ts']).tzinfo)
+
+    def test_sampling_by_logger_prefix(self):
+        sampled_out = log_counters['records_sampled_out']
+        sampler = SamplingFilter({'chat': 0, 'chat.buffer': 1})
+
+        self.assertFalse(sampler.filter(self.record('chat.consumers')))
+        self.assertTrue(sampler.filter(self.record('chat.buffer')))
+        self.assertTrue(sampler.filter(self.record('chatbot')))
+        self.assertTrue(sampler.filter(self.record('chat.consumers', level=logging.WARNING)))
+        self.assertEqual(log_counters['records_sampled_out'] - sampled_out, 1)
+
+    def test_queue_handler_writes_on_the_listener_thread(self):
+        sink = CollectingHandler('test-log-sink')
+        handler = QueueListenerHandler(['test-log-sink'])
+        self.addCleanup(handler.stop)
+
+        class Lazy:
+            def __str__(self):
+                return 'Ana'
+
+        # A mensagem é interpolada antes de entrar na fila
+        handler.handle(self.record(args=(Lazy(),)))
+        handler.stop()
+        self.assertEqual([record.msg for record in sink.records], ['oi Ana'])
+        self.assertIsNone(sink.records[0].args)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        dropped = log_counters['records_dropped']
+        handler = QueueListenerHandler([], maxsize=1)
+        handler.enqueue(self.record())
+        handler.enqueue(self.record())
+        self.assertEqual(log_counters['records_dropped'] - dropped, 1)
@@ -0,0 +1,155 @@
+import logging
+import time
+from collections import OrderedDict
+
+from channels.middleware import BaseMiddleware
+from channels.security.websocket import WebsocketDenier
+from django.conf import settings
+
+from .stores import get_redis
+
+logger = logging.getLogger(__name__)
+
+# (taxa de reposição em tokens/s, capacidade do balde)
+DEFAULT_RATE_LIMITS = {
+    'frame_connection': (5, 20),
+    'frame_user': (10, 40),
+    'connect_ip': (1, 20),
+    'connect_user': (0.5, 10),
+}
+
+
+def rate_limit(name):
+    limits = getattr(settings, 'CHAT_RATE_LIMITS', {})
+    return limits.get(name, DEFAULT_RATE_LIMITS[name])
+
+
+class TokenBucket:
+    """Token bucket owned by a single connection (no shared state)"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Consume one token. Returns 0 if allowed, else seconds to wait."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class MemoryBuckets:
+    """Keyed token buckets for one process, LRU-bounded"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key, rate, burst):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take()
+
+
+# Refill + consumo atômicos no Redis; retorna o tempo de espera em segundos
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class RedisBuckets:
+    """Keyed token buckets shared by every worker through Redis"""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def take(self, key, rate, burst):
+        # Registrado no cliente do event loop atual (EVALSHA, com EVAL se faltar)
+        script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        retry_after = await script(
+            keys=[f'chat:ratelimit:{key}'], args=[rate, burst, time.time()]
+        )
+        return float(retry_after)
+
+
+_buckets = None
+
+
+def get_buckets():
+    global _buckets
+    if _buckets is None:
+        redis = get_redis()
+        _buckets = RedisBuckets(redis) if redis is not None else MemoryBuckets()
+    return _buckets
+
+
+async def throttle(name, key):
+    """Take a token from the named limit for key. Returns seconds to wait (0 = allowed)."""
+    rate, burst = rate_limit(name)
+    try:
+        return await get_buckets().take(f'{name}:{key}', rate, burst)
+    except Exception as e:
+        # Falha no Redis não deve derrubar o chat: liberar
+        logger.warning("⚠️ Rate limit indisponível (%s): %s", name, e)
+        return 0
+
+
+class ConnectionRateLimitMiddleware(BaseMiddleware):
+    """Admission control for WebSocket connections.
+
+    by='ip' keys on the client address and should sit outside the auth
+    middleware, so reconnect storms are rejected before any token is
+    verified. by='user' keys on the authenticated user and must sit inside
+    it. Rejected connections are closed before being accepted.
+    """
+
+    def __init__(self, inner, by='ip'):
+        super().__init__(inner)
+        self.by = by
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket':
+            key = self.get_key(scope)
+            if key is not None:
+                retry_after = await throttle(f'connect_{self.by}', key)
+                if retry_after:
+                    logger.warning("⚠️ Conexão recusada por rate limit (%s=%s)", self.by, key)
+                    return await WebsocketDenier()(scope, receive, send)
+
+        return await super().__call__(scope, receive, send)
+
+    def get_key(self, scope):
+        if self.by == 'ip':
+            client = scope.get('client')
+            return client[0] if client else None
+
+        user = scope.get('user')
+        if user is not None and user.is_authenticated:
+            return user.id
+        return None
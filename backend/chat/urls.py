@@ -5,6 +5,9 @@ from . import views
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path("api/history/<str:room_name>/", views.room_history_view, name="room_history"),
+    path("api/metrics/", views.chat_metrics_view, name="chat_metrics"),
+    path("api/presence/<str:room_name>/", views.room_presence_view, name="room_presence"),
     path("<str:room_name>/", views.room, name="room"),
     path("test/", views.test_websocket, name="test_websocket"),
-]
\ No newline at end of file
+]
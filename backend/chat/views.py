@@ -1,4 +1,20 @@
+from asgiref.sync import async_to_sync
 from django.shortcuts import render
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework import status
+
+from app.log import counters as log_counters
+from user.accounts import counters as user_counters
+from user.hashing import counters as hashing_counters
+from user.photos import counters as photo_counters
+from user.tokens import token_cache_stats
+
+from .access import can_read_history, room_access
+from .history import fetch_history
+from .outbox import counters
+from .presence import get_presence
 
 
 def index(request):
@@ -10,4 +26,67 @@ def room(request, room_name):
 
 
 def test_websocket(request):
-    return render(request, "chat/test_websocket.html")
\ No newline at end of file
+    return render(request, "chat/test_websocket.html")
+
+
+@api_view(['GET'])
+def room_history_view(request, room_name):
+    if not can_read_history(request.user, room_name):
+        return Response(
+            {'error': 'Acesso negado a esta sala.'},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+
+    try:
+        page = fetch_history(
+            room_name,
+            cursor=request.query_params.get('cursor'),
+            limit=request.query_params.get('limit', 50),
+            viewer_id=str(request.user.id),
+        )
+    except ValueError:
+        return Response(
+            {'error': 'Parâmetros de paginação inválidos.'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    return Response(page, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def room_presence_view(request, room_name):
+    # Quem está online numa sala privada também é informação da sala
+    if not room_access(request.user, room_name)[0]:
+        return Response(
+            {'error': 'Acesso negado a esta sala.'},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+
+    presence = get_presence()
+
+    async def snapshot():
+        return await presence.count(room_name), await presence.members(room_name)
+
+    online_count, members = async_to_sync(snapshot)()
+    return Response(
+        {
+            'room': room_name,
+            'online_count': online_count,
+            'members': members,
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def chat_metrics_view(request):
+    # Contadores deste processo (cada worker do Daphne tem os seus)
+    return Response({
+        **counters,
+        **log_counters,
+        **token_cache_stats(),
+        **user_counters,
+        **hashing_counters,
+        **photo_counters,
+    }, status=status.HTTP_200_OK)
@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import CustomUser
+
+# Contadores do processo, expostos em chat/api/metrics/
+counters = {
+    'user_cache_hits': 0,
+    'user_cache_shared_hits': 0,
+    'user_cache_misses': 0,
+    'user_writes': 0,
+}
+
+
+def user_key(uid):
+    return f'user:uid:{uid}'
+
+
+class UserCache:
+    """Firebase UID -> CustomUser, so authenticated requests skip the database.
+
+    Entries are kept in an in-process LRU for local_ttl seconds and, if
+    shared_alias names a Django cache, in that cache for shared_ttl seconds.
+    invalidate() clears both; other workers drop their local copy when
+    local_ttl runs out, so keep it short. Cached users are shared between
+    requests and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=10000, local_ttl=30, shared_alias=None, shared_ttl=300):
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        self.shared_alias = shared_alias
+        self.shared_ttl = shared_ttl
+        self._entries = OrderedDict()  # uid -> (user, expires_at)
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def get(self, uid, local_only=False):
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is not None:
+                user, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(uid)
+                    counters['user_cache_hits'] += 1
+                    return user
+                del self._entries[uid]
+
+        if local_only:
+            return None
+
+        if self.shared is not None:
+            user = self.shared.get(user_key(uid))
+            if user is not None:
+                self._store_local(uid, user)
+                counters['user_cache_shared_hits'] += 1
+                return user
+
+        counters['user_cache_misses'] += 1
+        return None
+
+    def set(self, uid, user):
+        self._store_local(uid, user)
+        if self.shared is not None:
+            self.shared.set(user_key(uid), user, timeout=self.shared_ttl)
+
+    def invalidate(self, uid):
+        with self._lock:
+            self._entries.pop(uid, None)
+        if self.shared is not None:
+            self.shared.delete(user_key(uid))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store_local(self, uid, user):
+        with self._lock:
+            self._entries[uid] = (user, time.monotonic() + self.local_ttl)
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    global _user_cache
+    if _user_cache is None:
+        with _user_cache_lock:
+            if _user_cache is None:
+                _user_cache = UserCache(
+                    max_entries=getattr(settings, 'USER_CACHE_SIZE', 10000),
+                    local_ttl=getattr(settings, 'USER_CACHE_LOCAL_TTL', 30),
+                    shared_alias=getattr(settings, 'USER_CACHE', None),
+                    shared_ttl=getattr(settings, 'USER_CACHE_TTL', 300),
+                )
+    return _user_cache
+
+
+def profile_key(user_id):
+    return f'user:profile:{user_id}'
+
+
+def get_profile_cache():
+    """Django cache holding serialized profiles (see async_views.aget_profile)"""
+    return caches[getattr(settings, 'PROFILE_CACHE', 'default')]
+
+
+def invalidate_user(user, user_id=None):
+    """Drop a user from the UID and profile caches after it was changed or deleted.
+
+    After delete() the instance has no pk any more; pass the old one as user_id.
+    """
+    get_user_cache().invalidate(user.username)
+    get_profile_cache().delete(profile_key(user_id or user.pk))
+
+
+def token_changes(user, decoded_token):
+    """Fields whose value in the token differs from the stored user"""
+    changes = {}
+    if decoded_token.get('email') and user.email != decoded_token['email']:
+        changes['email'] = decoded_token['email']
+    if decoded_token.get('name') and user.name != decoded_token['name']:
+        changes['name'] = decoded_token['name']
+    return changes
+
+
+def cached_firebase_user(decoded_token):
+    """The user for a token if it is in the local cache and up to date, else None.
+
+    Needs no database access, so async code can call it on the event loop
+    and only fall back to get_or_create_firebase_user() on a miss.
+    """
+    user = get_user_cache().get(decoded_token['uid'], local_only=True)
+    if user is None or token_changes(user, decoded_token):
+        return None
+    return user
+
+
+def get_or_create_firebase_user(decoded_token):
+    """Find or create the user for a verified Firebase token.
+
+    Served from the UID cache when possible. The row is only written when
+    it is created or when the email / name in the token changed, and then
+    only those columns.
+    """
+    uid = decoded_token['uid']
+    cache = get_user_cache()
+
+    user = cache.get(uid)
+    cached = user is not None
+    if not cached:
+        name = decoded_token.get('name') or 'Usuário'
+        user, created = CustomUser.objects.get_or_create(
+            username=uid,
+            defaults={
+                'email': decoded_token.get('email', ''),
+                'name': name,
+                'first_name': name.split(' ')[0],
+                'type': 'user',
+                'phone': '',
+            },
+        )
+        if created:
+            counters['user_writes'] += 1
+
+    changes = token_changes(user, decoded_token)
+    if changes:
+        for field, value in changes.items():
+            setattr(user, field, value)
+        # auto_now só é gravado se estiver em update_fields
+        user.save(update_fields=[*changes, 'updated_at'])
+        get_profile_cache().delete(profile_key(user.pk))
+        counters['user_writes'] += 1
+
+    if changes or not cached:
+        cache.set(uid, user)
+    return user
+
+
+async def aget_or_create_firebase_user(decoded_token):
+    """Async get_or_create_firebase_user: cache hits stay on the event loop"""
+    user = cached_firebase_user(decoded_token)
+    if user is not None:
+        return user
+    return await sync_to_async(get_or_create_firebase_user)(decoded_token)
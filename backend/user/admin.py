@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, Session, DailyCheckin
+from .models import CheckinTag, CustomUser, Session, DailyCheckin, MoodStats
+from .mood import rebuild_user_stats
+from .tags import sync_checkin_tags
 
 
 class CustomUserAdmin(UserAdmin):
@@ -38,7 +40,39 @@ class DailyCheckinAdmin(admin.ModelAdmin):
         ('Timestamps', {'fields': ('created_at', 'updated_at'), 'classes': ('collapse',)}),
     )
 
+    # Edições pelo admin são raras e podem trocar a data ou apagar o check-in:
+    # as estatísticas do usuário são recalculadas por inteiro e as linhas do
+    # índice de tags do dia antigo saem
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change:
+            CheckinTag.objects.filter(user_id=form.initial['user'], date=form.initial['date']).delete()
+        sync_checkin_tags([obj])
+        rebuild_user_stats(obj.user_id)
+        if 'user' in form.changed_data and form.initial.get('user'):
+            rebuild_user_stats(form.initial['user'])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        CheckinTag.objects.filter(user_id=obj.user_id, date=obj.date).delete()
+        rebuild_user_stats(obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        days = list(queryset.values_list('user_id', 'date'))
+        super().delete_queryset(request, queryset)
+        for user_id, day in days:
+            CheckinTag.objects.filter(user_id=user_id, date=day).delete()
+        for user_id in {user_id for user_id, _ in days}:
+            rebuild_user_stats(user_id)
+
+
+class MoodStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'total_entries', 'last_date', 'updated_at')
+    search_fields = ('user__username',)
+    readonly_fields = ('updated_at',)
+
 
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Session, SessionAdmin)
 admin.site.register(DailyCheckin, DailyCheckinAdmin)
+admin.site.register(MoodStats, MoodStatsAdmin)
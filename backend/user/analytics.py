@@ -0,0 +1,228 @@
+from datetime import date, timedelta
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Max
+
+from .models import DailyCheckin, Session
+from .mood import SCALES
+
+# Painel do psicólogo: agregados por semana ou mês, variância e correlações
+# entre as escalas de todos os pacientes, e quem está em queda. Os check-ins
+# do período vêm em um único values_list, viram arrays do NumPy e tudo é
+# agrupado por (paciente, período) com np.bincount, sem laço por paciente.
+# O resultado fica em cache com a chave amarrada aos check-ins do período
+# (último updated_at e quantidade), então gravar, editar no admin ou apagar
+# um check-in invalida. Só um UPDATE em massa que não toca updated_at passa
+# despercebido até o ANALYTICS_CACHE_TTL.
+
+PERIODS = ('week', 'month')
+PAIRS = ((0, 1), (0, 2), (1, 2))
+PAIR_NAMES = tuple(f'{SCALES[a]}_{SCALES[b]}' for a, b in PAIRS)
+
+EPOCH = date(1970, 1, 1)
+
+
+def get_analytics_cache():
+    return caches[getattr(settings, 'ANALYTICS_CACHE', 'default')]
+
+
+def cohort(psychologist_id):
+    """Queryset of the ids of a psychologist's patients (anyone with a session)"""
+    return Session.objects.filter(psychologist_id=psychologist_id).values('user_id')
+
+
+def cache_key(psychologist_id, period, start, series):
+    """Cache key for a cohort's analytics, changing with every check-in write.
+
+    One aggregate over the cohort's check-ins since start (the ones the
+    analytics read): the latest update, which moves on every save, and the
+    count, which moves on every delete.
+    """
+    version = DailyCheckin.objects.filter(user__in=cohort(psychologist_id), date__gte=start).aggregate(
+        latest=Max('updated_at'), entries=Count('pk'),
+    )
+    latest = version['latest'].timestamp() if version['latest'] else 0
+    return (
+        f'analytics:{psychologist_id}:{period}:{start.isoformat()}:{int(series)}:'
+        f'{latest}:{version["entries"]}'
+    )
+
+
+def load_checkins(psychologist_id, start, chunk_size=10000):
+    """(user ids, days since 1970-01-01, scores n x 3) of the cohort since start.
+
+    The rows are streamed straight into one int64 array: no list of tuples,
+    and dates become day numbers with toordinal(), much cheaper than letting
+    NumPy convert date objects.
+    """
+    rows = (
+        DailyCheckin.objects.filter(user__in=cohort(psychologist_id), date__gte=start)
+        .values_list('user_id', 'date', *SCALES)
+        .iterator(chunk_size=chunk_size)
+    )
+    epoch = EPOCH.toordinal()
+    columns = 2 + len(SCALES)
+    data = np.fromiter(
+        chain.from_iterable((user_id, day.toordinal() - epoch, *scores) for user_id, day, *scores in rows),
+        np.int64,
+    ).reshape(-1, columns)
+    return data[:, 0], data[:, 1], data[:, 2:].astype(np.float64)
+
+
+def period_buckets(days, period):
+    """Index of each day's week (starting on Monday) or month, and its start date"""
+    if period == 'week':
+        # 1970-01-01 foi uma quinta-feira
+        buckets = (days + 3) // 7
+        return buckets, lambda bucket: EPOCH + timedelta(days=int(bucket) * 7 - 3)
+    buckets = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    return buckets, lambda bucket: date(1970 + int(bucket) // 12, int(bucket) % 12 + 1, 1)
+
+
+def grouped_sums(groups, size, scores):
+    """Per group: count, sums (scales x groups) and sums of squares"""
+    count = np.bincount(groups, minlength=size).astype(np.float64)
+    sums = np.stack([np.bincount(groups, scores[:, k], size) for k in range(scores.shape[1])])
+    squares = np.stack([np.bincount(groups, scores[:, k] ** 2, size) for k in range(scores.shape[1])])
+    return count, sums, squares
+
+
+def mean_and_variance(count, sums, squares):
+    """Population mean and variance; NaN where count is 0"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / count
+        variance = np.maximum(squares / count - mean ** 2, 0)
+    return mean, variance
+
+
+def correlations(groups, size, scores, count, sums, squares):
+    """Pearson correlation of each pair of scales per group, (pairs x groups).
+
+    count, sums and squares are the grouped_sums() of the same groups.
+    """
+    result = []
+    for a, b in PAIRS:
+        products = np.bincount(groups, scores[:, a] * scores[:, b], size)
+        covariance = count * products - sums[a] * sums[b]
+        spread = (count * squares[a] - sums[a] ** 2) * (count * squares[b] - sums[b] ** 2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result.append(np.where(spread > 0, covariance / np.sqrt(spread), np.nan))
+    return np.stack(result)
+
+
+def slopes(groups, size, x, y):
+    """Least-squares slope of y over x per group; NaN with fewer than 2 distinct x"""
+    n = np.bincount(groups, minlength=size).astype(np.float64)
+    sx = np.bincount(groups, x, size)
+    sy = np.bincount(groups, y, size)
+    sxy = np.bincount(groups, x * y, size)
+    sxx = np.bincount(groups, x * x, size)
+    denominator = n * sxx - sx ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(denominator > 0, (n * sxy - sx * sy) / denominator, np.nan), n
+
+
+def to_json(array, digits=2):
+    """Rounded nested lists with NaN as None"""
+    array = np.round(array, digits)
+    return np.where(np.isnan(array), None, array).tolist()
+
+
+def by_scale(array, digits=2):
+    return {scale: to_json(array[k], digits) for k, scale in enumerate(SCALES)}
+
+
+def compute(user_ids, days, scores, period, today, series=False):
+    """Cohort analytics from the check-in arrays (see load_checkins)"""
+    patients, patient_index = np.unique(user_ids, return_inverse=True)
+    buckets, bucket_start = period_buckets(days, period)
+    periods, period_index = np.unique(buckets, return_inverse=True)
+    n_patients, n_periods = len(patients), len(periods)
+
+    # Coorte por período
+    count, sums, squares = grouped_sums(period_index, n_periods, scores)
+    mean, variance = mean_and_variance(count, sums, squares)
+    everyone = np.zeros(len(scores), np.int64)
+    cohort_correlation = correlations(everyone, 1, scores, *grouped_sums(everyone, 1, scores))[:, 0]
+
+    # Por paciente, no período inteiro
+    p_count, p_sums, p_squares = grouped_sums(patient_index, n_patients, scores)
+    p_mean, p_variance = mean_and_variance(p_count, p_sums, p_squares)
+    p_correlation = correlations(patient_index, n_patients, scores, p_count, p_sums, p_squares)
+
+    # Tendência: inclinação da média das escalas nos últimos dias, em pontos por dia
+    trend_days = getattr(settings, 'ANALYTICS_TREND_DAYS', 28)
+    recent = days > (today - EPOCH).days - trend_days
+    slope, points = slopes(
+        patient_index[recent], n_patients,
+        days[recent].astype(np.float64), scores[recent].mean(axis=1),
+    )
+    declining = np.flatnonzero(
+        (points >= getattr(settings, 'ANALYTICS_TREND_MIN_POINTS', 7))
+        & (slope <= -getattr(settings, 'ANALYTICS_DECLINE_SLOPE', 0.05))
+    )
+    declining = declining[np.argsort(slope[declining])]
+
+    result = {
+        'periods': [bucket_start(bucket).isoformat() for bucket in periods],
+        'cohort': {
+            'patients': n_patients,
+            'checkins': len(scores),
+            'count': count.astype(np.int64).tolist(),
+            'mean': by_scale(mean),
+            'variance': by_scale(variance),
+            'correlation': dict(zip(PAIR_NAMES, to_json(cohort_correlation))),
+        },
+        'patients': [
+            {
+                'user_id': int(user_id),
+                'checkins': int(checkins),
+                'mean': dict(zip(SCALES, means)),
+                'variance': dict(zip(SCALES, variances)),
+                'correlation': dict(zip(PAIR_NAMES, pairs)),
+                'trend': trend,
+            }
+            for user_id, checkins, means, variances, pairs, trend in zip(
+                patients, p_count, to_json(p_mean.T), to_json(p_variance.T),
+                to_json(p_correlation.T), to_json(slope, 3),
+            )
+        ],
+        'declining': [
+            {'user_id': int(patients[i]), 'trend': round(float(slope[i]), 3)} for i in declining
+        ],
+    }
+
+    if series:
+        # Matrizes paciente x período, na ordem de "patients" e "periods"
+        size = n_patients * n_periods
+        groups = patient_index * n_periods + period_index
+        s_count, s_sums, s_squares = grouped_sums(groups, size, scores)
+        s_mean, s_variance = mean_and_variance(s_count, s_sums, s_squares)
+        shape = (len(SCALES), n_patients, n_periods)
+        result['series'] = {
+            'count': s_count.reshape(n_patients, n_periods).astype(np.int64).tolist(),
+            'mean': by_scale(s_mean.reshape(shape)),
+            'variance': by_scale(s_variance.reshape(shape)),
+        }
+    return result
+
+
+def cohort_analytics(psychologist_id, period='week', days=180, series=False, today=None):
+    """Analytics of a psychologist's cohort over the last days, cached"""
+    today = today or date.today()
+    start = today - timedelta(days=days - 1)
+    cache = get_analytics_cache()
+    key = cache_key(psychologist_id, period, start, series)
+    result = cache.get(key)
+    if result is None:
+        result = {
+            'as_of': today.isoformat(),
+            'period': period,
+            'from': start.isoformat(),
+            **compute(*load_checkins(psychologist_id, start), period, today, series),
+        }
+        cache.set(key, result, getattr(settings, 'ANALYTICS_CACHE_TTL', 3600))
+    return result
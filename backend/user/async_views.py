@@ -0,0 +1,373 @@
+import hashlib
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import IntegrityError
+from django.http import JsonResponse, QueryDict
+from django.utils.http import quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .accounts import get_profile_cache, get_user_cache, invalidate_user, profile_key
+from .hashing import HashingBusy, ahash_password
+from .models import CustomUser
+from .photos import InvalidPhoto, schedule_variants, set_user_photo
+from .tokens import averify_id_token
+from .views import (
+    USER_FIELDS,
+    conditional_response,
+    parse_birth_date,
+    profile_entry,
+    profile_payload,
+    serialize_user,
+    unique_errors,
+)
+
+
+# Versões async das views de usuário. Rodam direto no event loop do Daphne
+# (sem passar por sync_to_async) usando o ORM async; o que ainda é bloqueante
+# vai para fora do loop: hash de senha no pool de processos (hashing.py),
+# gravação da foto numa thread e as variantes dela no pool de photos.py.
+
+
+def respond(data, status_code):
+    return JsonResponse(data, status=status_code, json_dumps_params={'ensure_ascii': False})
+
+
+async def authenticate(request):
+    """Run DEFAULT_AUTHENTICATION_CLASSES in order, as DRF does for request.user.
+
+    Authenticators with aauthenticate (FirebaseAuthentication) run on the
+    event loop; the others (JWTAuthentication loads its user from the
+    database) run in a thread. Returns (user, auth) or None.
+    """
+    drf_request = Request(request)
+    for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        authenticator = authenticator()
+        if hasattr(authenticator, 'aauthenticate'):
+            result = await authenticator.aauthenticate(drf_request)
+        else:
+            result = await sync_to_async(authenticator.authenticate)(drf_request)
+        if result is not None:
+            return result
+    return None
+
+
+def async_api_view(methods, allow_any=False):
+    """Async counterpart of @api_view + @permission_classes, with DRF's authenticators"""
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return respond(
+                    {'detail': f'Método "{request.method}" não é permitido.'},
+                    status.HTTP_405_METHOD_NOT_ALLOWED,
+                )
+
+            try:
+                result = await authenticate(request)
+            except exceptions.AuthenticationFailed as e:
+                return respond({'detail': str(e.detail)}, status.HTTP_401_UNAUTHORIZED)
+
+            request.user = result[0] if result else AnonymousUser()
+            if not allow_any and not request.user.is_authenticated:
+                return respond(
+                    {'detail': 'As credenciais de autenticação não foram fornecidas.'},
+                    status.HTTP_401_UNAUTHORIZED,
+                )
+
+            return await view(request, *args, **kwargs)
+
+        return csrf_exempt(wrapper)
+
+    return decorator
+
+
+def busy_response():
+    response = respond(
+        {'error': 'Muitos cadastros ao mesmo tempo. Tente novamente em instantes.'},
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+    response['Retry-After'] = '1'
+    return response
+
+
+async def parse_body(request):
+    """Request body as (data, files), for JSON, form and multipart (also on PUT)"""
+    content_type = request.content_type or ''
+    if content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}'), {}
+        except ValueError:
+            return None, {}
+    if content_type.startswith('multipart/'):
+        # Uploads grandes vão para arquivos temporários: fora do event loop
+        return await sync_to_async(request.parse_file_upload)(request.META, request)
+    return QueryDict(request.body, encoding=request.encoding), {}
+
+
+@async_api_view(['POST'], allow_any=True)
+async def create_user_view(request):
+    data, _ = await parse_body(request)
+    if data is None:
+        return respond({'errors': ['JSON inválido.']}, status.HTTP_400_BAD_REQUEST)
+
+    name = data.get('name')
+    email = data.get('email')
+    username = data.get('username')
+    password = data.get('password')
+    type_ = data.get('type')
+    birth = data.get('birth')
+    phone = data.get('phone')
+    crp = data.get('crp') if type_ == 'psychologist' else None
+
+    errors = []
+
+    if not all([name, email, username, password, type_, birth, phone]):
+        errors.append('Todos os campos obrigatórios devem ser preenchidos.')
+
+    birth_date, birth_errors = parse_birth_date(birth, min_age=10)
+    errors.extend(birth_errors)
+
+    if type_ == 'psychologist' and not crp:
+        errors.append('O campo CRP é obrigatório para psicólogos.')
+
+    if errors:
+        return respond({'errors': errors}, status.HTTP_400_BAD_REQUEST)
+
+    try:
+        password_hash = await ahash_password(password)
+    except HashingBusy:
+        return busy_response()
+
+    # Unicidade de e-mail/username fica a cargo das constraints do banco:
+    # um único INSERT em vez de dois SELECTs antes dele
+    try:
+        await CustomUser.objects.acreate(
+            name=name,
+            email=CustomUser.objects.normalize_email(email),
+            username=CustomUser.normalize_username(username),
+            password=password_hash,
+            type=type_,
+            birth=birth_date,
+            phone=phone,
+            crp=crp,
+        )
+    except IntegrityError as e:
+        return respond({'errors': unique_errors(e)}, status.HTTP_400_BAD_REQUEST)
+
+    return respond({'message': 'Usuário criado com sucesso!'}, status.HTTP_201_CREATED)
+
+
+def parse_batch_query(params):
+    """Ids (in request order, without repeats) and fields of a batch lookup"""
+    max_ids = getattr(settings, 'USER_BATCH_MAX_IDS', 100)
+    errors = []
+    ids = {}  # dict como conjunto ordenado
+    for value in params.get('ids', '').split(','):
+        value = value.strip()
+        if not value:
+            continue
+        if not value.isdecimal():
+            errors.append(f'Id inválido: {value}.')
+            continue
+        ids[int(value)] = None
+        if len(ids) > max_ids:
+            # Parar aqui: o resto da lista não é lido
+            errors.append(f'No máximo {max_ids} usuários por requisição.')
+            break
+    ids = list(ids)
+
+    if not ids and not errors:
+        errors.append('Informe os ids dos usuários (ids=1,2,3).')
+
+    fields = USER_FIELDS
+    if params.get('fields'):
+        requested = {field.strip() for field in params['fields'].split(',')}
+        unknown = requested - set(USER_FIELDS)
+        if unknown:
+            errors.append(f'Campos inválidos: {", ".join(sorted(unknown))}.')
+        # Mantém a ordem de USER_FIELDS; id sempre vem para o cliente casar
+        fields = tuple(f for f in USER_FIELDS if f in requested or f == 'id')
+
+    return ids, fields, errors
+
+
+@async_api_view(['GET'])
+async def user_batch_view(request):
+    ids, fields, errors = parse_batch_query(request.GET)
+    if errors:
+        return respond({'errors': errors}, status.HTTP_400_BAD_REQUEST)
+
+    # Um único SELECT ... WHERE id IN (...) só com as colunas pedidas
+    columns = set(fields)
+    if columns & {'photo', 'photo_variants'}:
+        # A URL da foto depende das duas colunas
+        columns |= {'photo', 'photo_variants'}
+    users = {
+        user.id: user
+        async for user in CustomUser.objects.filter(id__in=ids).only(*columns)
+    }
+    base = request.build_absolute_uri('/')[:-1]
+    response = respond(
+        {
+            'users': [
+                serialize_user(users[user_id], request, fields, base)
+                for user_id in ids
+                if user_id in users
+            ],
+            'missing': [user_id for user_id in ids if user_id not in users],
+        },
+        status.HTTP_200_OK,
+    )
+    etag = quote_etag(hashlib.sha1(response.content).hexdigest())
+    return conditional_response(request, response, etag)
+
+
+@csrf_exempt
+async def users_view(request):
+    # GET busca em lote (exige login); POST é o cadastro (aberto)
+    if request.method == 'GET':
+        return await user_batch_view(request)
+    return await create_user_view(request)
+
+
+@async_api_view(['POST'], allow_any=True)
+async def login_view(request):
+    # Espera o token no header Authorization: Bearer <token>
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return respond({'error': 'Token do Firebase não fornecido.'}, status.HTTP_401_UNAUTHORIZED)
+    firebase_token = auth_header.split(' ')[1]
+
+    try:
+        decoded_token = await averify_id_token(firebase_token)
+        email = decoded_token.get('email')
+    except Exception:
+        return respond({'error': 'Token do Firebase inválido.'}, status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        user = await CustomUser.objects.aget(email=email)
+    except CustomUser.DoesNotExist:
+        return respond({'error': 'Usuário não encontrado.'}, status.HTTP_404_NOT_FOUND)
+
+    return respond(
+        {
+            'message': 'Login realizado com sucesso!',
+            'user': {
+                'id': user.id,
+                'name': user.name,
+                'email': user.email,
+                'username': user.username,
+                'type': user.type,
+            },
+            'firebase_token': firebase_token,
+        },
+        status.HTTP_200_OK,
+    )
+
+
+async def aget_profile(user_id):
+    """Cached profile entry for a user id, or None; a cache hit needs no database access"""
+    cache = get_profile_cache()
+    entry = await cache.aget(profile_key(user_id))
+    if entry is None:
+        user = await CustomUser.objects.filter(id=user_id).afirst()
+        if user is None:
+            return None
+        entry = profile_entry(user)
+        await cache.aset(
+            profile_key(user_id), entry, timeout=getattr(settings, 'PROFILE_CACHE_TTL', 300)
+        )
+    return entry
+
+
+@async_api_view(['GET', 'PUT', 'DELETE'])
+async def user_detail_view(request, user_id):
+    if request.method == 'GET':
+        entry = await aget_profile(user_id)
+        if entry is None:
+            return respond({'error': 'Usuário não encontrado.'}, status.HTTP_404_NOT_FOUND)
+        response = respond(profile_payload(request, entry), status.HTTP_200_OK)
+        return conditional_response(request, response, entry['etag'], entry['last_modified'])
+
+    try:
+        user = await CustomUser.objects.aget(id=user_id)
+    except CustomUser.DoesNotExist:
+        return respond({'error': 'Usuário não encontrado.'}, status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'PUT':
+        return await update_user(request, user)
+    return await delete_user(user)
+
+
+async def update_user(request, user):
+    data, files = await parse_body(request)
+    if data is None:
+        return respond({'errors': ['JSON inválido.']}, status.HTTP_400_BAD_REQUEST)
+
+    previous_username = user.username
+    errors = []
+
+    name = data.get('name', user.name)
+    email = data.get('email', user.email)
+    username = data.get('username', user.username)
+    phone = data.get('phone', user.phone)
+    type_ = data.get('type', user.type)
+
+    # Validação de data de nascimento se for fornecida
+    birth = data.get('birth')
+    if birth:
+        birth_date, birth_errors = parse_birth_date(birth, min_age=18)
+        errors.extend(birth_errors)
+
+    if errors:
+        return respond({'errors': errors}, status.HTTP_400_BAD_REQUEST)
+
+    # Atualizar os campos do usuário
+    user.name = name
+    user.email = email
+    user.username = username
+    user.phone = phone
+    user.type = type_
+
+    if birth:
+        user.birth = birth_date
+
+    password = data.get('password')
+    if password:
+        try:
+            user.password = await ahash_password(password)
+        except HashingBusy:
+            return busy_response()
+
+    # Upload de foto se enviada como multipart "photo"
+    if 'photo' in files:
+        try:
+            await sync_to_async(set_user_photo)(user, files['photo'])
+        except InvalidPhoto as e:
+            return respond({'errors': [str(e)]}, status.HTTP_400_BAD_REQUEST)
+
+    try:
+        await user.asave()
+    except IntegrityError as e:
+        return respond({'errors': unique_errors(e)}, status.HTTP_400_BAD_REQUEST)
+    schedule_variants(user)
+    await sync_to_async(invalidate_user)(user)
+    if user.username != previous_username:
+        await sync_to_async(get_user_cache().invalidate)(previous_username)
+
+    return respond({'message': 'Usuário atualizado com sucesso!'}, status.HTTP_200_OK)
+
+
+async def delete_user(user):
+    user_id = user.pk
+    await user.adelete()
+    await sync_to_async(invalidate_user)(user, user_id)
+    return respond({'message': 'Usuário deletado com sucesso!'}, status.HTTP_200_OK)
@@ -0,0 +1,35 @@
+from django.db.models import Q
+
+# Leitura de tabelas grandes em lotes por keyset. iterator(chunk_size) só
+# faz streaming de verdade com cursor no servidor (PostgreSQL, SQLite); o
+# mysqlclient (o banco de produção) traz o resultado inteiro para a memória
+# do cliente antes da primeira linha. Aqui cada lote é uma consulta própria,
+# que continua depois da última chave lida usando o índice (sem OFFSET).
+
+
+def after(keys, values):
+    """Q matching rows whose (keys) tuple sorts after values"""
+    condition = Q()
+    for i, key in enumerate(keys):
+        equal = {prefix: value for prefix, value in zip(keys[:i], values[:i])}
+        condition |= Q(**equal, **{f'{key}__gt': values[i]})
+    return condition
+
+
+def keyset_rows(queryset, fields, keys, chunk_size=1000):
+    """values_list(*fields) rows of queryset in keys order, chunk_size per query.
+
+    keys must be unique together and never NULL (e.g. ('user_id', 'date')
+    for check-ins, or ('id',)), and be among fields. Rows written while
+    iterating may or may not be seen, as with separate pages of an API.
+    """
+    rows = queryset.order_by(*keys).values_list(*fields)
+    positions = [fields.index(key) for key in keys]
+    last = None
+    while True:
+        page = rows if last is None else rows.filter(after(keys, last))
+        chunk = list(page[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last = [chunk[-1][position] for position in positions]
@@ -0,0 +1,135 @@
+import csv
+import json
+import zlib
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .batches import keyset_rows
+from .models import DailyCheckin, Session
+from .photos import photo_url
+
+# Exportação dos dados de um usuário (portabilidade da LGPD e exportação do
+# psicólogo) em NDJSON ou CSV, opcionalmente em gzip. Tudo é gerado em
+# streaming: as linhas saem do banco em lotes de EXPORT_CHUNK_SIZE, uma
+# consulta por lote (keyset_rows; iterator() não faz streaming no MySQL), e
+# são agrupadas em blocos de EXPORT_BUFFER_SIZE, então a memória não cresce
+# com o tamanho do histórico. No ASGI o gerador roda em blocos via sync_to_async
+# (aexport_chunks), porque o Django carregaria um iterador síncrono inteiro.
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+}
+
+PROFILE_FIELDS = ('id', 'username', 'name', 'email', 'type', 'phone', 'birth', 'crp', 'date_joined', 'photo')
+CHECKIN_FIELDS = ('date', 'intensity', 'energy', 'stability', 'notes', 'tags', 'created_at', 'updated_at')
+SESSION_FIELDS = ('id', 'date', 'start_time', 'end_time', 'psychologist_id', 'user_id')
+
+
+def export_sections(user, psychologist=None, chunk_size=500):
+    """(record type, fields, rows) of everything exported for user.
+
+    With psychologist (a psychologist exporting a patient), only the
+    sessions between the two of them are included.
+    """
+    profile = [
+        photo_url(user) if field == 'photo' else getattr(user, field) for field in PROFILE_FIELDS
+    ]
+    yield 'profile', PROFILE_FIELDS, [profile]
+
+    checkins = DailyCheckin.objects.filter(user=user)
+    yield 'checkin', CHECKIN_FIELDS, keyset_rows(checkins, CHECKIN_FIELDS, ('date',), chunk_size)
+
+    if psychologist is not None:
+        sessions = Session.objects.filter(user=user, psychologist=psychologist)
+    else:
+        sessions = Session.objects.filter(user=user) | Session.objects.filter(psychologist=user)
+    # Em ordem de id: a data da sessão pode ser nula e não serve de chave
+    yield 'session', SESSION_FIELDS, keyset_rows(sessions, SESSION_FIELDS, ('id',), chunk_size)
+
+
+def ndjson_pieces(sections):
+    for record_type, fields, rows in sections:
+        for row in rows:
+            record = {'record': record_type, **dict(zip(fields, row))}
+            yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+class Echo:
+    """File-like object for csv.writer: writerow() returns the line instead of buffering"""
+
+    def write(self, value):
+        return value
+
+
+def csv_pieces(sections):
+    """One block per record type: a header row, then its rows"""
+    writer = csv.writer(Echo())
+    for record_type, fields, rows in sections:
+        yield writer.writerow(['record', *fields])
+        for row in rows:
+            yield writer.writerow([record_type, *(csv_value(value) for value in row)])
+
+
+def export_chunks(user, output='ndjson', compress=False, psychologist=None):
+    """Sync iterator of the export as bytes blocks (gzip if compress)"""
+    chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 500)
+    buffer_size = getattr(settings, 'EXPORT_BUFFER_SIZE', 64 * 1024)
+    encode = ndjson_pieces if output == 'ndjson' else csv_pieces
+    # wbits 31: formato gzip (cabeçalho + CRC), não zlib puro
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    pending, size = [], 0
+    for piece in encode(export_sections(user, psychologist, chunk_size)):
+        pending.append(piece)
+        size += len(piece)
+        if size >= buffer_size:
+            data = ''.join(pending).encode()
+            pending, size = [], 0
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+
+    data = ''.join(pending).encode()
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+async def aexport_chunks(user, output='ndjson', compress=False, psychologist=None, blocks=4):
+    """Async iterator over export_chunks, blocks at a time in the sync thread.
+
+    The sync thread (thread_sensitive) keeps every chunk query on the
+    same database connection.
+    """
+    chunks = export_chunks(user, output, compress, psychologist)
+    take = sync_to_async(lambda: list(islice(chunks, blocks)))
+    try:
+        while True:
+            batch = await take()
+            if not batch:
+                break
+            for chunk in batch:
+                yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
+
+
+def export_filename(user, output, compress, today):
+    extension = FORMATS[output][1] + ('.gz' if compress else '')
+    return f'dados-{user.username}-{today.isoformat()}.{extension}'
@@ -0,0 +1,98 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+
+# Contadores do processo, expostos em chat/api/metrics/
+counters = {
+    'password_hashes': 0,
+    'password_hash_rejected': 0,
+}
+
+
+class HashingBusy(Exception):
+    """Too many passwords waiting to be hashed; the client should retry later"""
+
+
+def _encode(hasher, password, salt):
+    # Roda no processo filho: o hasher já vem configurado (iterações etc.),
+    # então não precisa do Django inicializado
+    return hasher.encode(password, salt)
+
+
+class PasswordHashingService:
+    """Runs Django's password hasher in a pool of worker processes.
+
+    A hash keeps a core busy for hundreds of milliseconds, so at signup
+    peaks hashing in the request threads takes over the worker's CPU (and,
+    for hashers that keep the GIL, the interpreter) and stalls every other
+    request. Here hashes run in separate processes and at most max_pending
+    are queued or running; a caller that cannot get a slot within wait
+    seconds gets HashingBusy instead of piling up.
+    """
+
+    def __init__(self, workers=2, max_pending=32, wait=2.0):
+        self.workers = workers
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # spawn: fork de um processo com threads (Daphne) não é seguro
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                    )
+        return self._pool
+
+    def make_password(self, password):
+        """Hash a password like django.contrib.auth.hashers.make_password"""
+        if not self._slots.acquire(timeout=self.wait):
+            counters['password_hash_rejected'] += 1
+            raise HashingBusy()
+        try:
+            hasher = get_hasher('default')
+            encoded = self.pool.submit(_encode, hasher, password, hasher.salt()).result()
+            counters['password_hashes'] += 1
+            return encoded
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_hashing_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = PasswordHashingService(
+                    workers=getattr(settings, 'PASSWORD_HASH_WORKERS', 2),
+                    max_pending=getattr(settings, 'PASSWORD_HASH_MAX_PENDING', 32),
+                    wait=getattr(settings, 'PASSWORD_HASH_WAIT_SECONDS', 2.0),
+                )
+    return _service
+
+
+def hash_password(password):
+    return get_hashing_service().make_password(password)
+
+
+async def ahash_password(password):
+    # A espera pela vaga e pelo resultado acontece numa thread, fora do loop
+    return await sync_to_async(hash_password, thread_sensitive=False)(password)
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from user.batches import keyset_rows
+from user.models import CheckinTag, DailyCheckin
+from user.tags import index_rows
+
+
+class Command(BaseCommand):
+    help = 'Preenche o índice de tags (CheckinTag) a partir de DailyCheckin.tags'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='Só este usuário (pode repetir)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Check-ins lidos e linhas gravadas por vez')
+        parser.add_argument('--clear', action='store_true',
+                            help='Apaga o índice (dos usuários escolhidos) antes')
+
+    def handle(self, *args, users=None, batch_size=1000, clear=False, **options):
+        checkins = DailyCheckin.objects.exclude(tags=[])
+        if users:
+            checkins = checkins.filter(user_id__in=users)
+        # Um lote de check-ins por consulta, em ordem de id
+        rows = (row[1:] for row in keyset_rows(checkins, ('id', 'user_id', 'date', 'tags'), ('id',), batch_size))
+
+        known = {}  # nome -> id, para não consultar as tags de novo a cada lote
+        total = 0
+        with transaction.atomic():
+            if clear:
+                index = CheckinTag.objects.filter(user_id__in=users) if users else CheckinTag.objects.all()
+                index.delete()
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    total += self.write(batch, known, batch_size)
+                    batch = []
+            total += self.write(batch, known, batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f'✅ Índice de tags preenchido: {total} tags de check-ins, {len(known)} tags distintas'))
+
+    def write(self, batch, known, batch_size):
+        created = CheckinTag.objects.bulk_create(
+            index_rows(batch, known), batch_size=batch_size, ignore_conflicts=True,
+        )
+        return len(created)
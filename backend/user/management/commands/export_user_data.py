@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user.export import FORMATS, export_chunks
+from user.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Exporta todos os dados de um usuário (perfil, check-ins e sessões) em NDJSON ou CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help='id ou username do usuário')
+        parser.add_argument('--format', dest='output_format', choices=list(FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='Compacta a saída em gzip')
+        parser.add_argument('--output', '-o', help='Arquivo de saída (padrão: saída padrão)')
+
+    def handle(self, *args, user, output_format, gzip, output=None, **options):
+        lookup = {'pk': int(user)} if user.isdigit() else {'username': user}
+        try:
+            user = CustomUser.objects.get(**lookup)
+        except CustomUser.DoesNotExist:
+            raise CommandError(f'Usuário {user} não encontrado.')
+
+        target = open(output, 'wb') if output else sys.stdout.buffer
+        written = 0
+        try:
+            for chunk in export_chunks(user, output_format, gzip):
+                target.write(chunk)
+                written += len(chunk)
+        finally:
+            if output:
+                target.close()
+            else:
+                target.flush()
+
+        if output:
+            self.stdout.write(self.style.SUCCESS(f'✅ {written} bytes exportados para {output}'))
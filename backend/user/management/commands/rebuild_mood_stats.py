@@ -0,0 +1,43 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from user.batches import keyset_rows
+from user.models import DailyCheckin, MoodStats
+from user.mood import SCALES, build_stats
+
+
+class Command(BaseCommand):
+    help = 'Recalcula as estatísticas de humor (MoodStats) a partir dos check-ins'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='Só este usuário (pode repetir)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Check-ins lidos e estatísticas gravadas por vez')
+
+    def handle(self, *args, users=None, batch_size=1000, **options):
+        checkins = DailyCheckin.objects.all()
+        stats = MoodStats.objects.all()
+        if users:
+            checkins = checkins.filter(user_id__in=users)
+            stats = stats.filter(user_id__in=users)
+
+        # Uma passada em ordem (usuário, data), um lote de check-ins por consulta
+        rows = keyset_rows(checkins, ('user_id', 'date', *SCALES), ('user_id', 'date'), batch_size)
+
+        total = 0
+        with transaction.atomic():
+            stats.delete()
+            batch = []
+            for user_id, user_rows in groupby(rows, key=lambda row: row[0]):
+                batch.append(build_stats(user_id, (row[1:] for row in user_rows)))
+                if len(batch) >= batch_size:
+                    MoodStats.objects.bulk_create(batch)
+                    total += len(batch)
+                    batch = []
+            MoodStats.objects.bulk_create(batch)
+            total += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'✅ Estatísticas recalculadas para {total} usuários'))
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 
@@ -11,10 +12,12 @@ class CustomUser(AbstractUser):
     type = models.CharField(max_length=15, choices=USER_TYPE_CHOICES)
     name = models.CharField(max_length=120)
     photo = models.ImageField(upload_to='profile/', blank=True, null=True)
+    photo_variants = models.JSONField(verbose_name='Variantes da Foto', default=dict, blank=True)
     email = models.EmailField(unique=True)
     birth = models.DateField(verbose_name='Data de Nascimento', null=True)
     phone = models.CharField(max_length=12)
     crp = models.CharField(max_length=12, blank=True, null=True)
+    updated_at = models.DateTimeField(verbose_name='Data de Atualização', auto_now=True)
 
     def __str__(self):
         return f'{self.first_name + " " + self.last_name} id = {self.id} ({self.get_type_display()})'
@@ -59,7 +62,8 @@ class DailyCheckin(models.Model):
     stability = models.IntegerField(verbose_name='Estabilidade', help_text='Valor de 0 a 10')
     notes = models.TextField(verbose_name='Notas', blank=True, null=True)
     tags = models.JSONField(verbose_name='Tags', default=list, blank=True)
-    date = models.DateField(verbose_name='Data do Check-in', auto_now_add=True)
+    # Padrão é hoje, mas a sincronização offline grava dias passados
+    date = models.DateField(verbose_name='Data do Check-in', default=timezone.localdate)
     created_at = models.DateTimeField(verbose_name='Data de Criação', auto_now_add=True)
     updated_at = models.DateTimeField(verbose_name='Data de Atualização', auto_now=True)
 
@@ -67,7 +71,72 @@ class DailyCheckin(models.Model):
         verbose_name = 'Check-in Diário'
         verbose_name_plural = 'Check-ins Diários'
         ordering = ['-date', '-created_at']
-        unique_together = ['user', 'date']  # Um check-in por usuário por dia
+        # Um check-in por usuário por dia. O índice único (user, date) também
+        # atende a listagem por keyset (user = ?, date < cursor, ORDER BY
+        # date DESC), lido de trás para frente; um índice (user, -date)
+        # separado só duplicaria o mesmo conteúdo.
+        unique_together = ['user', 'date']
 
     def __str__(self):
         return f'Check-in de {self.user.username} em {self.date} - I:{self.intensity} E:{self.energy} S:{self.stability}'
+
+
+class MoodStats(models.Model):
+    """Mood statistics of a user, kept up to date on every check-in write.
+
+    See user/mood.py for how the fields are maintained.
+    """
+    user = models.OneToOneField(
+        CustomUser,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='mood_stats',
+    )
+    total_entries = models.PositiveIntegerField(verbose_name='Total de Check-ins', default=0)
+    last_date = models.DateField(verbose_name='Último Check-in', null=True)
+    last_values = models.JSONField(verbose_name='Últimos Valores', default=list)
+    previous_date = models.DateField(verbose_name='Check-in Anterior', null=True)
+    previous_values = models.JSONField(verbose_name='Valores Anteriores', default=list)
+    ema = models.JSONField(verbose_name='Médias Móveis Exponenciais', default=list)
+    ema_before_last = models.JSONField(default=list)
+    ema_base = models.JSONField(default=list)
+    windows = models.JSONField(verbose_name='Janelas', default=dict)
+    recent = models.JSONField(default=list)
+    updated_at = models.DateTimeField(verbose_name='Data de Atualização', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Estatísticas de Humor'
+        verbose_name_plural = 'Estatísticas de Humor'
+
+    def __str__(self):
+        return f'Estatísticas de {self.user_id} até {self.last_date}'
+
+
+class Tag(models.Model):
+    """Normalized tag names used in DailyCheckin.tags (see user/tags.py)"""
+    name = models.CharField(verbose_name='Nome', max_length=50, unique=True)
+
+    class Meta:
+        verbose_name = 'Tag'
+        verbose_name_plural = 'Tags'
+
+    def __str__(self):
+        return self.name
+
+
+class CheckinTag(models.Model):
+    """Inverted index of DailyCheckin.tags: one row per tag of each check-in"""
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='checkins')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='checkin_tags')
+    date = models.DateField(verbose_name='Data do Check-in')
+
+    class Meta:
+        verbose_name = 'Tag do Check-in'
+        verbose_name_plural = 'Tags dos Check-ins'
+        # (tag, user, date): check-ins de uma tag num período;
+        # (user, date, tag): contagens e coocorrências de um usuário
+        unique_together = ['tag', 'user', 'date']
+        indexes = [models.Index(fields=['user', 'date', 'tag'], name='checkintag_user_date_tag')]
+
+    def __str__(self):
+        return f'{self.tag_id} em {self.date} ({self.user_id})'
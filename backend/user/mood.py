@@ -0,0 +1,209 @@
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import DailyCheckin, MoodStats
+
+# MoodStats é mantido a cada gravação de check-in, sem reler o histórico:
+#
+# - recent: anel com os últimos RING_DAYS dias, slot = ordinal % RING_DAYS,
+#   cada um [ordinal, intensidade, energia, estabilidade] ou None;
+# - windows: por janela (7/30/90 dias terminando em last_date),
+#   [quantidade, soma intensidade, soma energia, soma estabilidade]. Quando
+#   last_date avança, os dias que saem da janela são lidos do anel e
+#   subtraídos; uma edição troca o valor antigo (também do anel) pelo novo;
+# - ema: médias móveis exponenciais por check-in, com ema_before_last para
+#   poder refazer a do último dia quando ele é editado, e ema_base, a média
+#   de tudo que já saiu do anel. Um dia gravado fora de ordem (sincronização
+#   offline) refaz a média a partir de ema_base e do anel; se for mais antigo
+#   que o anel, a média não muda (rebuild_mood_stats corrige);
+# - last/previous: os dois check-ins mais recentes, para a tendência.
+#
+# Todo caso custa no máximo O(RING_DAYS) em memória, e uma leitura do painel
+# é um SELECT pela chave primária.
+
+WINDOWS = (7, 30, 90)
+RING_DAYS = max(WINDOWS)
+SCALES = ('intensity', 'energy', 'stability')
+
+
+def ema_alpha():
+    # Equivalente a uma média de MOOD_EMA_SPAN check-ins
+    return 2 / (getattr(settings, 'MOOD_EMA_SPAN', 7) + 1)
+
+
+def _entry(ring, ordinal):
+    slot = ring[ordinal % RING_DAYS]
+    return slot[1:] if slot and slot[0] == ordinal else None
+
+
+def _add(window, values, sign=1):
+    window[0] += sign
+    for i, value in enumerate(values, start=1):
+        window[i] += sign * value
+
+
+def advance_windows(windows, ring, anchor, target):
+    """Slide every window from ending at anchor to ending at target (> anchor)"""
+    for days in WINDOWS:
+        window = windows[str(days)]
+        # Saem os dias em (anchor - days, target - days]
+        for ordinal in range(anchor - days + 1, min(target - days, anchor) + 1):
+            values = _entry(ring, ordinal)
+            if values is not None:
+                _add(window, values, -1)
+
+
+def _ema_step(ema, values, alpha):
+    if not ema:
+        return list(values)
+    return [old + alpha * (value - old) for old, value in zip(ema, values)]
+
+
+def _ema_from_ring(base, ring, alpha):
+    ema, before_last = base, []
+    for slot in sorted(slot for slot in ring if slot):
+        before_last = ema
+        ema = _ema_step(ema, slot[1:], alpha)
+    return ema, before_last
+
+
+def apply_checkin(stats, day, values, created=None):
+    """Fold one saved check-in (new or edited) into stats, without saving.
+
+    values is [intensity, energy, stability]. created says whether the
+    day is new; None infers it from the ring, which is exact for the last
+    RING_DAYS days.
+    """
+    ordinal = day.toordinal()
+    values = list(values)
+    ring = stats.recent or [None] * RING_DAYS
+    windows = stats.windows or {str(days): [0, 0, 0, 0] for days in WINDOWS}
+    old = _entry(ring, ordinal)
+    if created is None:
+        created = old is None
+    if created:
+        stats.total_entries += 1
+
+    alpha = ema_alpha()
+    anchor = stats.last_date.toordinal() if stats.last_date else None
+
+    if anchor is None or ordinal > anchor:
+        if anchor is not None:
+            advance_windows(windows, ring, anchor, ordinal)
+            # Dias que saem do anel entram em ema_base
+            cutoff = ordinal - RING_DAYS
+            for slot in sorted(slot for slot in ring if slot and slot[0] <= cutoff):
+                stats.ema_base = _ema_step(stats.ema_base, slot[1:], alpha)
+            ring = [slot if slot and slot[0] > cutoff else None for slot in ring]
+        stats.previous_date, stats.previous_values = stats.last_date, stats.last_values
+        stats.last_date, stats.last_values = day, values
+        stats.ema_before_last = stats.ema
+        stats.ema = _ema_step(stats.ema, values, alpha)
+        anchor = ordinal
+    elif ordinal == anchor:
+        stats.last_values = values
+        stats.ema = _ema_step(stats.ema_before_last, values, alpha)
+    else:
+        previous = stats.previous_date.toordinal() if stats.previous_date else None
+        if previous is None or ordinal >= previous:
+            stats.previous_date, stats.previous_values = day, values
+
+    for days in WINDOWS:
+        if anchor - days < ordinal <= anchor:
+            window = windows[str(days)]
+            if old is not None:
+                _add(window, old, -1)
+            _add(window, values)
+
+    if ordinal > anchor - RING_DAYS:
+        ring[ordinal % RING_DAYS] = [ordinal, *values]
+        if ordinal < anchor:
+            stats.ema, stats.ema_before_last = _ema_from_ring(stats.ema_base, ring, alpha)
+
+    stats.recent = ring
+    stats.windows = windows
+
+
+def record_checkins(user_id, checkins, existing=None):
+    """Update the user's MoodStats after check-ins were written.
+
+    existing is the set of days that were already stored, when the caller
+    knows it; otherwise it is inferred (see apply_checkin). Call it in the
+    same transaction as the write: the row is locked while it is updated.
+    """
+    with transaction.atomic():
+        stats, _ = MoodStats.objects.select_for_update().get_or_create(user_id=user_id)
+        for checkin in sorted(checkins, key=lambda checkin: checkin.date):
+            created = None if existing is None else checkin.date not in existing
+            apply_checkin(
+                stats,
+                checkin.date,
+                [getattr(checkin, scale) for scale in SCALES],
+                created,
+            )
+        stats.save()
+    return stats
+
+
+def build_stats(user_id, rows):
+    """Unsaved MoodStats from (date, intensity, energy, stability) rows in date order"""
+    stats = MoodStats(user_id=user_id)
+    for day, *values in rows:
+        apply_checkin(stats, day, values, created=True)
+    return stats
+
+
+def rebuild_user_stats(user_id):
+    """Recompute one user's MoodStats from all of their check-ins"""
+    rows = (
+        DailyCheckin.objects.filter(user_id=user_id)
+        .order_by('date')
+        .values_list('date', *SCALES)
+    )
+    with transaction.atomic():
+        MoodStats.objects.filter(user_id=user_id).delete()
+        stats = build_stats(user_id, rows.iterator())
+        if stats.total_entries:
+            stats.save(force_insert=True)
+    return stats
+
+
+def trend(stats):
+    if not stats.last_values or not stats.previous_values:
+        return 'stable'
+    if stats.last_values[0] > stats.previous_values[0]:
+        return 'up'
+    if stats.last_values[0] < stats.previous_values[0]:
+        return 'down'
+    return 'stable'
+
+
+def summarize(stats, today=None):
+    """Dashboard payload; the windows end today, without touching the database"""
+    today = today or date.today()
+    windows = {key: list(window) for key, window in (stats.windows or {}).items()}
+    if stats.last_date and today > stats.last_date and windows:
+        advance_windows(windows, stats.recent, stats.last_date.toordinal(), today.toordinal())
+
+    def averages(values, count=1, digits=1):
+        return {
+            scale: round(value / count, digits) if count else None
+            for scale, value in zip(SCALES, values)
+        }
+
+    return {
+        'as_of': today.isoformat(),
+        'total_entries': stats.total_entries,
+        'last_checkin': {
+            'date': stats.last_date.isoformat(),
+            **averages(stats.last_values, digits=0),
+        } if stats.last_date else None,
+        'trend': trend(stats),
+        'windows': {
+            key: {'count': window[0], **averages(window[1:], window[0])}
+            for key, window in windows.items()
+        },
+        'ema': averages(stats.ema, digits=2) if stats.ema else None,
+    }
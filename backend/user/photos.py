@@ -0,0 +1,215 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .accounts import invalidate_user
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+# Contadores do processo, expostos em chat/api/metrics/
+counters = {
+    'photo_uploads': 0,
+    'photo_dedup_hits': 0,
+    'photo_variants_built': 0,
+    'photo_variant_errors': 0,
+}
+
+ACCEPTED_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+# Formatos de cada variante: WebP primeiro, JPEG para clientes sem WebP
+VARIANT_FORMATS = (('webp', 'WEBP'), ('jpeg', 'JPEG'))
+
+
+class InvalidPhoto(Exception):
+    """The upload is not an image we accept; the message is shown to the client"""
+
+
+def variant_sizes():
+    """Variant name -> longest side in pixels, smallest first"""
+    sizes = getattr(settings, 'PHOTO_VARIANTS', {'thumb': 96, 'medium': 512})
+    return dict(sorted(sizes.items(), key=lambda item: item[1]))
+
+
+def store_original(uploaded_file):
+    """Save an uploaded photo under the SHA-256 of its content.
+
+    Large uploads are already spooled to a temporary file by Django (see
+    FILE_UPLOAD_MAX_MEMORY_SIZE); here they are read chunk by chunk for
+    the hash and copied chunk by chunk into storage, never whole in
+    memory. An identical file that is already stored is reused. Returns
+    the storage name, e.g. profile/ab/ab12...ef.jpg.
+    """
+    max_size = getattr(settings, 'PHOTO_MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+    if uploaded_file.size > max_size:
+        raise InvalidPhoto(f'A foto deve ter no máximo {max_size // (1024 * 1024)} MB.')
+
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+
+    uploaded_file.seek(0)
+    try:
+        # Só lê o cabeçalho; a imagem é decodificada no pool
+        with Image.open(uploaded_file) as image:
+            extension = ACCEPTED_FORMATS.get(image.format)
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        extension = None
+    if extension is None:
+        raise InvalidPhoto('Envie uma imagem JPEG, PNG, WebP ou GIF.')
+
+    sha = digest.hexdigest()
+    name = f'profile/{sha[:2]}/{sha}.{extension}'
+    counters['photo_uploads'] += 1
+    if default_storage.exists(name):
+        counters['photo_dedup_hits'] += 1
+        return name
+
+    uploaded_file.seek(0)
+    return default_storage.save(name, uploaded_file)
+
+
+def variant_names(original_name):
+    """Storage names of every variant of an original, derived from its hash"""
+    base = os.path.splitext(original_name)[0]
+    return {
+        size: {key: f'{base}_{size}.{key if key != "jpeg" else "jpg"}' for key, _ in VARIANT_FORMATS}
+        for size in variant_sizes()
+    }
+
+
+def existing_variants(original_name):
+    """Variant names if all of them are already stored (same photo sent before)"""
+    names = variant_names(original_name)
+    if all(default_storage.exists(name) for formats in names.values() for name in formats.values()):
+        return names
+    return None
+
+
+def render_variant(image, size, pil_format):
+    if size == min(variant_sizes().values()):
+        # Miniatura quadrada para os avatares
+        resized = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+    else:
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+    if pil_format == 'JPEG' and resized.mode != 'RGB':
+        background = Image.new('RGB', resized.size, (255, 255, 255))
+        background.paste(resized, mask=resized.getchannel('A') if 'A' in resized.getbands() else None)
+        resized = background
+
+    buffer = BytesIO()
+    if pil_format == 'WEBP':
+        resized.save(buffer, 'WEBP', quality=80, method=4)
+    else:
+        resized.save(buffer, 'JPEG', quality=82, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def build_variants(original_name):
+    """Render and store every variant of an original; returns their names"""
+    names = variant_names(original_name)
+    with default_storage.open(original_name, 'rb') as original:
+        with Image.open(original) as image:
+            image = ImageOps.exif_transpose(image)
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+            for size_name, size in variant_sizes().items():
+                for key, pil_format in VARIANT_FORMATS:
+                    name = names[size_name][key]
+                    if not default_storage.exists(name):
+                        default_storage.save(name, ContentFile(render_variant(image, size, pil_format)))
+    return names
+
+
+def process_photo(user_id, original_name):
+    """Background job: build the variants and attach them to the user"""
+    try:
+        variants = build_variants(original_name)
+        counters['photo_variants_built'] += 1
+        # Só se a foto ainda for esta (o usuário pode ter trocado de novo)
+        updated = CustomUser.objects.filter(pk=user_id, photo=original_name).update(
+            photo_variants=variants, updated_at=timezone.now(),
+        )
+        if updated:
+            invalidate_user(CustomUser.objects.only('id', 'username').get(pk=user_id))
+    except Exception:
+        counters['photo_variant_errors'] += 1
+        logger.exception("❌ Erro ao gerar variantes da foto %s", original_name)
+    finally:
+        close_old_connections()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_photo_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'PHOTO_WORKERS', 2),
+                    thread_name_prefix='photos',
+                )
+    return _executor
+
+
+def set_user_photo(user, uploaded_file):
+    """Store an uploaded photo on user (not saved yet); raises InvalidPhoto.
+
+    photo_variants is filled right away when the same photo was processed
+    before; otherwise call schedule_variants() once the user is saved.
+    """
+    user.photo.name = store_original(uploaded_file)
+    user.photo_variants = existing_variants(user.photo.name) or {}
+
+
+def schedule_variants(user):
+    """Build the variants of a saved user's photo in the pool, if it has none yet.
+
+    Until the job is done, responses fall back to the original upload.
+    """
+    if user.photo and not user.photo_variants:
+        get_photo_executor().submit(process_photo, user.pk, user.photo.name)
+
+
+def photo_url(user, size=None):
+    """Relative URL of the smallest variant at least size px (largest if None).
+
+    WebP when variants exist, else the original upload, else None.
+    """
+    if not user.photo:
+        return None
+    variants = user.photo_variants or {}
+    sizes = variant_sizes()
+    fitting = [name for name, px in sizes.items() if name in variants and (size is None or px >= size)]
+    if size is None:
+        fitting = fitting[-1:]
+    if not fitting:
+        return user.photo.url
+    return default_storage.url(variants[fitting[0]]['webp'])
+
+
+def variant_urls(user):
+    """Relative URLs of every variant, by size and format"""
+    return {
+        size: {key: default_storage.url(name) for key, name in formats.items()}
+        for size, formats in (user.photo_variants or {}).items()
+    }
+
+
+def avatar_url(user):
+    """Relative URL of the smallest variant, for chat avatars"""
+    return photo_url(user, size=0)
@@ -0,0 +1,110 @@
+from collections import Counter
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import Count
+
+from .models import CheckinTag, Tag
+
+# DailyCheckin.tags continua sendo a lista mostrada ao usuário; CheckinTag é
+# o índice invertido dela, (tag, usuário, data), atualizado junto com cada
+# gravação de check-in. Filtros por tag, contagens e coocorrências leem só
+# o índice, com buscas por faixa em vez de decodificar o JSON de cada linha.
+# Para check-ins gravados por fora da API: manage.py backfill_checkin_tags
+
+TAG_MAX_LENGTH = Tag._meta.get_field('name').max_length
+
+
+def normalize_tag(tag):
+    return ' '.join(tag.split()).lower()[:TAG_MAX_LENGTH]
+
+
+def tag_ids(names, known=None):
+    """name -> id for every name, creating the missing tags.
+
+    known is an optional dict reused across calls (backfill), so names seen
+    before cost no query.
+    """
+    known = {} if known is None else known
+    missing = set(names) - known.keys()
+    if missing:
+        Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+        known.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+    return known
+
+
+def index_rows(checkins, known=None):
+    """CheckinTag rows for (user_id, date, tags) triples"""
+    names = {
+        (user_id, day): {normalize_tag(tag) for tag in tags or [] if isinstance(tag, str) and tag.strip()}
+        for user_id, day, tags in checkins
+    }
+    ids = tag_ids(set().union(*names.values()), known)
+    return [
+        CheckinTag(tag_id=ids[name], user_id=user_id, date=day)
+        for (user_id, day), day_names in names.items()
+        for name in day_names
+    ]
+
+
+def sync_checkin_tags(checkins):
+    """Rewrite the index rows of saved check-ins (call in the same transaction).
+
+    The same few statements whatever the batch size: create the new tags,
+    read their ids, delete the old rows of those days (one DELETE per user)
+    and insert the new ones.
+    """
+    if not checkins:
+        return
+    days = {}
+    for checkin in checkins:
+        days.setdefault(checkin.user_id, set()).add(checkin.date)
+
+    with transaction.atomic():
+        rows = index_rows((checkin.user_id, checkin.date, checkin.tags) for checkin in checkins)
+        for user_id, user_days in days.items():
+            CheckinTag.objects.filter(user_id=user_id, date__in=user_days).delete()
+        CheckinTag.objects.bulk_create(rows)
+
+
+def tagged_dates(user_id, tag):
+    """Queryset of the days a user used a tag, for date__in filters"""
+    return CheckinTag.objects.filter(tag__name=normalize_tag(tag), user_id=user_id).values('date')
+
+
+def user_tags(user_id, start=None, end=None):
+    """Queryset of a user's index rows in a date range"""
+    queryset = CheckinTag.objects.filter(user_id=user_id)
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    return queryset
+
+
+def tag_counts(user_id, start=None, end=None):
+    """[(tag name, days used)], most used first"""
+    return list(
+        user_tags(user_id, start, end)
+        .values_list('tag__name')
+        .annotate(count=Count('*'))
+        .order_by('-count', 'tag__name')
+    )
+
+
+def cooccurrences(user_id, start=None, end=None, limit=None):
+    """[((tag, tag), days used together)], most frequent pairs first"""
+    by_day = {}
+    for day, tag_id in user_tags(user_id, start, end).order_by('date', 'tag_id').values_list('date', 'tag_id'):
+        by_day.setdefault(day, []).append(tag_id)
+
+    pairs = Counter()
+    for day_tags in by_day.values():
+        pairs.update(combinations(day_tags, 2))
+    ids = {tag_id for pair in pairs for tag_id in pair}
+    names = dict(Tag.objects.filter(id__in=ids).values_list('id', 'name'))
+    ranked = sorted(
+        (tuple(sorted((names[a], names[b]))), count) for (a, b), count in pairs.items()
+    )
+    ranked.sort(key=lambda item: -item[1])
+    return ranked[:limit]
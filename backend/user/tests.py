@@ -1,3 +1,1193 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.hashers import check_password
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import Http404, QueryDict
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from firebase_admin import auth
+from PIL import Image
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.media import serve_media
+
+from .accounts import get_profile_cache, get_user_cache
+from .async_views import create_user_view, parse_batch_query, user_detail_view, users_view
+from .authentication import FirebaseAuthentication
+from .batches import keyset_rows
+from .export import aexport_chunks, export_chunks, export_sections
+from .hashing import HashingBusy, PasswordHashingService, counters as hashing_counters
+from .models import CheckinTag, CustomUser, DailyCheckin, MoodStats, Session
+from .mood import rebuild_user_stats
+from .photos import (
+    InvalidPhoto, avatar_url, counters as photo_counters, photo_url, process_photo, set_user_photo, store_original,
+)
+from .tokens import (
+    PrefetchedCertRequest, VerifiedTokenCache, averify_id_token, counters as token_counters,
+    ensure_cert_refresh, start_cert_refresh, verify_id_token,
+)
+from .views import (
+    export_user_data, get_cohort_analytics, get_mood_stats, get_tag_stats,
+    get_user_checkins, save_daily_checkin, sync_checkins,
+)
+
+
+# Autenticação do app/settings.py (os testes podem rodar com outro settings)
+AUTH_SETTINGS = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'user.authentication.FirebaseAuthentication',
+        'rest_framework_simplejwt.authentication.JWTAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
+}
+
+
+class FirebaseUserCacheTests(TestCase):
+    def setUp(self):
+        get_user_cache().clear()
+        self.factory = APIRequestFactory()
+        self.decoded_token = {
+            'uid': 'firebase-uid-1',
+            'email': 'ana@example.com',
+            'name': 'Ana Souza',
+        }
+
+    def authenticate(self, decoded_token=None):
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Bearer token')
+        with mock.patch(
+            'user.authentication.verify_id_token',
+            return_value=decoded_token or self.decoded_token,
+        ):
+            user, _ = FirebaseAuthentication().authenticate(request)
+        return user
+
+    def test_steady_state_runs_no_queries(self):
+        created = self.authenticate()
+
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+
+        self.assertEqual(user.pk, created.pk)
+        self.assertEqual(user.name, 'Ana Souza')
+
+    def test_existing_user_is_not_rewritten(self):
+        CustomUser.objects.create(
+            username='firebase-uid-1', email='ana@example.com', name='Ana Souza'
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            self.authenticate()
+
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]['sql'].upper().startswith('SELECT'))
+
+    def test_changed_name_updates_only_that_column(self):
+        self.authenticate()
+
+        with CaptureQueriesContext(connection) as queries:
+            user = self.authenticate({**self.decoded_token, 'name': 'Ana S.'})
+
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        self.assertTrue(sql.upper().startswith('UPDATE'))
+        self.assertIn('name', sql)
+        self.assertNotIn('email', sql)
+        self.assertEqual(CustomUser.objects.get(pk=user.pk).name, 'Ana S.')
+
+        with self.assertNumQueries(0):
+            self.authenticate({**self.decoded_token, 'name': 'Ana S.'})
+
+    def test_delete_invalidates_cache(self):
+        user = self.authenticate()
+        self.assertIsNotNone(get_user_cache().get('firebase-uid-1', local_only=True))
+
+        request = AsyncRequestFactory().delete(f'/users/{user.pk}/', headers={'Authorization': 'Bearer token'})
+        with override_settings(REST_FRAMEWORK=AUTH_SETTINGS), \
+                mock.patch('user.authentication.averify_id_token', return_value=self.decoded_token):
+            response = async_to_sync(user_detail_view)(request, user_id=user.pk)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(get_user_cache().get('firebase-uid-1', local_only=True))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tokens'},
+})
+class VerifiedTokenCacheTests(TestCase):
+    def setUp(self):
+        self.cache = VerifiedTokenCache(max_entries=2)
+        # Sem thread de certificados (nem rede) nos testes
+        for patcher in (
+            mock.patch('user.tokens._token_cache', self.cache),
+            mock.patch('user.tokens._cert_refresh_started', True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def decoded(self, uid='ana', ttl=3600):
+        return {'uid': uid, 'exp': time.time() + ttl}
+
+    def test_entries_live_until_exp(self):
+        self.cache.set('t1', self.decoded())
+        self.cache.set('t2', self.decoded(ttl=-1))
+        self.assertEqual(self.cache.get('t1')['uid'], 'ana')
+        self.assertIsNone(self.cache.get('t2'))
+
+        with mock.patch('user.tokens.time.time', return_value=time.time() + 3601):
+            self.assertIsNone(self.cache.get('t1'))
+        self.assertIsNone(self.cache.get('t1', local_only=True))
+
+    def test_lru_eviction(self):
+        evictions = token_counters['token_cache_evictions']
+        for token in ('t1', 't2'):
+            self.cache.set(token, self.decoded(token))
+        self.cache.get('t1')
+        self.cache.set('t3', self.decoded('t3'))
+
+        self.assertIsNone(self.cache.get('t2'))
+        self.assertEqual([self.cache.get(t)['uid'] for t in ('t1', 't3')], ['t1', 't3'])
+        self.assertEqual(token_counters['token_cache_evictions'] - evictions, 1)
+
+    def test_shared_cache_serves_other_workers(self):
+        VerifiedTokenCache(shared_alias='shared').set('t1', self.decoded())
+        other_worker = VerifiedTokenCache(shared_alias='shared')
+
+        self.assertIsNone(other_worker.get('t1', local_only=True))
+        self.assertEqual(other_worker.get('t1')['uid'], 'ana')
+        self.assertIsNotNone(other_worker.get('t1', local_only=True))
+
+    def test_verify_once_per_token(self):
+        with mock.patch('user.tokens.auth.verify_id_token', return_value=self.decoded()) as verify:
+            for _ in range(3):
+                self.assertEqual(verify_id_token('t1')['uid'], 'ana')
+            self.assertEqual(verify.call_count, 1)
+
+            # Revogação: sempre pergunta ao Firebase
+            verify_id_token('t1', check_revoked=True)
+            self.assertEqual(verify.call_count, 2)
+            with override_settings(FIREBASE_TOKEN_CACHE_ENABLED=False):
+                verify_id_token('t1')
+            self.assertEqual(verify.call_count, 3)
+
+    def test_revoked_token_is_forgotten(self):
+        self.cache.set('t1', self.decoded())
+        error = auth.RevokedIdTokenError('revogado')
+        with mock.patch('user.tokens.auth.verify_id_token', side_effect=error):
+            with self.assertRaises(auth.RevokedIdTokenError):
+                verify_id_token('t1', check_revoked=True)
+        self.assertIsNone(self.cache.get('t1'))
+
+    def test_concurrent_verifications_are_coalesced(self):
+        release = threading.Event()
+        decoded = self.decoded()
+
+        def slow_verify(token, check_revoked=False):
+            release.wait(5)
+            return decoded
+
+        async def storm():
+            tasks = [asyncio.ensure_future(averify_id_token('t1')) for _ in range(5)]
+            await asyncio.sleep(0.05)
+            release.set()
+            return await asyncio.gather(*tasks)
+
+        started = token_counters['token_verify_started']
+        coalesced = token_counters['token_verify_coalesced']
+        with mock.patch('user.tokens.auth.verify_id_token', side_effect=slow_verify) as verify:
+            results = async_to_sync(storm)()
+            # Depois da verificação, a resposta vem do cache sem ir à thread
+            self.assertEqual(async_to_sync(averify_id_token)('t1'), decoded)
+
+        self.assertEqual(results, [decoded] * 5)
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(token_counters['token_verify_started'] - started, 1)
+        self.assertEqual(token_counters['token_verify_coalesced'] - coalesced, 4)
+
+
+class CertRefreshTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('user.tokens._cert_refresh_started', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_started_once_on_first_verification(self):
+        with mock.patch('user.tokens.start_cert_refresh') as start:
+            ensure_cert_refresh()
+            ensure_cert_refresh()
+        self.assertEqual(start.call_count, 1)
+
+    @override_settings(FIREBASE_CERT_PREFETCH=False)
+    def test_disabled(self):
+        with mock.patch('user.tokens.start_cert_refresh') as start:
+            ensure_cert_refresh()
+        start.assert_not_called()
+
+    def test_wraps_the_verifier_request(self):
+        delegate = mock.Mock()
+        verifier = mock.Mock(spec=['request'], request=delegate)
+        client = mock.Mock(_token_verifier=verifier)
+        with mock.patch('user.tokens.auth._get_client', return_value=client), \
+                mock.patch.object(PrefetchedCertRequest, 'start') as start:
+            request = start_cert_refresh()
+
+        self.assertIs(verifier.request, request)
+        self.assertIs(request.delegate, delegate)
+        start.assert_called_once()
+
+    def test_missing_internals_fall_back_to_normal_fetching(self):
+        with mock.patch('user.tokens.auth._get_client', return_value=mock.Mock(spec=[])):
+            self.assertIsNone(start_cert_refresh())
+
+    def test_certificates_are_served_from_memory(self):
+        response = mock.Mock(status=200, headers={'cache-control': 'public, max-age=20000'}, data=b'{}')
+        delegate = mock.Mock(return_value=response)
+        request = PrefetchedCertRequest(delegate)
+
+        for _ in range(3):
+            self.assertEqual(request('https://certs').data, b'{}')
+        self.assertEqual(delegate.call_count, 1)
+        refresh_at = request._responses['https://certs'][1]
+        self.assertAlmostEqual(refresh_at - time.time(), 20000 - 300, delta=5)
+
+
+@override_settings(REST_FRAMEWORK=AUTH_SETTINGS)
+class AsyncViewAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='firebase-uid-1', email='ana@example.com', name='Ana')
+
+    def get_profile(self, authorization=None):
+        headers = {'Authorization': authorization} if authorization else {}
+        request = AsyncRequestFactory().get(f'/users/{self.user.pk}/', headers=headers)
+        return async_to_sync(user_detail_view)(request, user_id=self.user.pk)
+
+    def test_firebase_token(self):
+        decoded = {'uid': 'firebase-uid-1', 'email': 'ana@example.com', 'name': 'Ana'}
+        with mock.patch('user.authentication.averify_id_token', return_value=decoded):
+            response = self.get_profile('Bearer token')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['id'], self.user.pk)
+
+    def test_every_configured_authenticator_runs(self):
+        token = str(AccessToken.for_user(self.user))
+        # Com o Firebase na frente, o JWT só é aceito se configurado sozinho
+        # ou antes dele, como no @api_view do DRF
+        jwt_only = {**AUTH_SETTINGS, 'DEFAULT_AUTHENTICATION_CLASSES': AUTH_SETTINGS['DEFAULT_AUTHENTICATION_CLASSES'][1:]}
+        with override_settings(REST_FRAMEWORK=jwt_only):
+            self.assertEqual(self.get_profile(f'Bearer {token}').status_code, 200)
+            self.assertEqual(self.get_profile('Bearer invalido').status_code, 401)
+
+    def test_multipart_put(self):
+        decoded = {'uid': 'firebase-uid-1', 'email': 'ana@example.com', 'name': 'Ana'}
+        body = encode_multipart(BOUNDARY, {'name': 'Ana Souza', 'phone': '11999990000'})
+        request = AsyncRequestFactory().put(
+            f'/users/{self.user.pk}/', body, content_type=MULTIPART_CONTENT,
+            headers={'Authorization': 'Bearer token'},
+        )
+        with mock.patch('user.authentication.averify_id_token', return_value=decoded):
+            response = async_to_sync(user_detail_view)(request, user_id=self.user.pk)
+
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.name, self.user.phone), ('Ana Souza', '11999990000'))
+
+    def test_missing_or_invalid_credentials(self):
+        self.assertEqual(self.get_profile().status_code, 401)
+        with mock.patch('user.authentication.averify_id_token', side_effect=ValueError('expirado')):
+            response = self.get_profile('Bearer token')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('expirado', json.loads(response.content)['detail'])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PasswordHashingTests(TestCase):
+    SIGNUP = {
+        'name': 'Ana', 'email': 'ana@example.com', 'username': 'ana', 'password': 'segredo123',
+        'type': 'user', 'birth': '1990-05-01', 'phone': '11999990000',
+    }
+
+    def signup(self):
+        request = AsyncRequestFactory().post('/users/', self.SIGNUP, content_type='application/json')
+        return async_to_sync(create_user_view)(request)
+
+    def test_hash_in_a_worker_process(self):
+        service = PasswordHashingService(workers=1)
+        self.addCleanup(service.shutdown)
+        encoded = service.make_password('segredo123')
+        self.assertTrue(encoded.startswith('md5$'))
+        self.assertTrue(check_password('segredo123', encoded))
+
+    def test_full_queue_is_rejected(self):
+        rejected = hashing_counters['password_hash_rejected']
+        service = PasswordHashingService(max_pending=1, wait=0.01)
+        service._slots.acquire()  # uma senha já na fila
+
+        with self.assertRaises(HashingBusy):
+            service.make_password('segredo123')
+        self.assertEqual(hashing_counters['password_hash_rejected'] - rejected, 1)
+
+    def test_signup_when_busy_is_503(self):
+        with mock.patch('user.async_views.ahash_password', side_effect=HashingBusy()):
+            response = self.signup()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(CustomUser.objects.exists())
+
+    def test_signup(self):
+        with mock.patch('user.async_views.ahash_password', return_value='md5$sal$hash'):
+            response = self.signup()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(CustomUser.objects.get(username='ana').password, 'md5$sal$hash')
+
+
+@override_settings(REST_FRAMEWORK=AUTH_SETTINGS, USER_BATCH_MAX_IDS=3)
+class UserBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            CustomUser.objects.create(username=f'u{n}', email=f'u{n}@example.com', name=f'U{n}', phone=str(n))
+            for n in range(3)
+        ]
+
+    def batch(self, query, **headers):
+        request = AsyncRequestFactory().get(f'/users/?{query}', headers={'Authorization': 'Bearer token', **headers})
+        decoded = {'uid': 'u0', 'email': 'u0@example.com', 'name': 'U0'}
+        with mock.patch('user.authentication.averify_id_token', return_value=decoded):
+            return async_to_sync(users_view)(request)
+
+    def test_request_order_missing_and_fields(self):
+        a, b, c = (user.id for user in self.users)
+        response = self.batch(f'ids={c},999999,{a},{c}&fields=name,phone')
+
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        self.assertEqual(body['users'], [
+            {'id': c, 'name': 'U2', 'phone': '2'},
+            {'id': a, 'name': 'U0', 'phone': '0'},
+        ])
+        self.assertEqual(body['missing'], [999999])
+
+        cached = self.batch(f'ids={c},999999,{a},{c}&fields=name,phone', **{'If-None-Match': response['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_single_query(self):
+        get_user_cache().clear()
+        self.batch('ids=1')  # autenticação coloca o usuário no cache
+        with self.assertNumQueries(1):
+            self.batch('ids=' + ','.join(str(user.id) for user in self.users))
+
+    def test_invalid_queries(self):
+        for query, error in (
+            ('ids=', 'Informe os ids dos usuários (ids=1,2,3).'),
+            ('ids=1,x', 'Id inválido: x.'),
+            ('ids=1,2,3,4', 'No máximo 3 usuários por requisição.'),
+            ('ids=1&fields=name,senha', 'Campos inválidos: senha.'),
+        ):
+            response = self.batch(query)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(json.loads(response.content)['errors'], [error])
+
+    def test_cap_stops_reading_the_list(self):
+        # Repetidos contam uma vez; acima do limite a lista não é mais lida
+        ids, _, errors = parse_batch_query(QueryDict('ids=1,1,2,2,3,4,x,y,z'))
+        self.assertEqual(ids, [1, 2, 3, 4])
+        self.assertEqual(errors, ['No máximo 3 usuários por requisição.'])
+
+
+@override_settings(REST_FRAMEWORK=AUTH_SETTINGS)
+class ProfileCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='firebase-uid-1', email='ana@example.com', name='Ana')
+
+    def setUp(self):
+        get_profile_cache().clear()
+        get_user_cache().clear()
+        self.decoded = {'uid': 'firebase-uid-1', 'email': 'ana@example.com', 'name': 'Ana'}
+
+    def call(self, method='get', data=None, **headers):
+        factory = AsyncRequestFactory()
+        url = f'/users/{self.user.pk}/'
+        headers = {'Authorization': 'Bearer token', **headers}
+        if method == 'put':
+            request = factory.put(url, data, content_type='application/json', headers=headers)
+        else:
+            request = factory.get(url, headers=headers)
+        with mock.patch('user.authentication.averify_id_token', return_value=self.decoded):
+            return async_to_sync(user_detail_view)(request, user_id=self.user.pk)
+
+    def test_validators_and_304(self):
+        response = self.call()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('Authorization', response['Vary'])
+
+        self.assertEqual(self.call(**{'If-None-Match': response['ETag']}).status_code, 304)
+        self.assertEqual(self.call(**{'If-Modified-Since': response['Last-Modified']}).status_code, 304)
+        self.assertEqual(self.call(**{'If-None-Match': '"outro"'}).status_code, 200)
+
+    def test_cache_hit_needs_no_query(self):
+        self.call()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.call().status_code, 200)
+
+    def test_update_invalidates(self):
+        etag = self.call()['ETag']
+        # O nome vem do token do Firebase; o telefone só muda pela API
+        self.assertEqual(self.call('put', {'phone': '11999990000'}).status_code, 200)
+
+        response = self.call(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content)['phone'], '11999990000')
+
+    def test_name_from_token_invalidates(self):
+        etag = self.call()['ETag']
+        self.decoded['name'] = 'Ana S.'
+        response = self.call(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['name'], 'Ana S.')
+
+
+def image_upload(size=(800, 600), color='teal', fmt='PNG', name='foto.png'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class PhotoTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root, PHOTO_VARIANTS={'thumb': 96, 'medium': 512})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # O job roda inline aqui; fechar a conexão quebraria a transação do teste
+        patcher = mock.patch('user.photos.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = CustomUser.objects.create(username='ana', email='ana@example.com', name='Ana')
+
+    def test_original_is_stored_by_content_hash(self):
+        hits = photo_counters['photo_dedup_hits']
+        first = store_original(image_upload(name='a.png'))
+        second = store_original(image_upload(name='outro-nome.png'))
+        other = store_original(image_upload(color='red'))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r'^profile/([0-9a-f]{2})/\1[0-9a-f]{62}\.png$')
+        self.assertEqual(photo_counters['photo_dedup_hits'] - hits, 1)
+
+    def test_rejects_non_images_and_large_files(self):
+        with self.assertRaises(InvalidPhoto):
+            store_original(SimpleUploadedFile('foto.png', b'nao sou uma imagem'))
+        with override_settings(PHOTO_MAX_UPLOAD_SIZE=100), self.assertRaises(InvalidPhoto):
+            store_original(image_upload())
+
+    def test_variants(self):
+        set_user_photo(self.user, image_upload())
+        self.user.save()
+        self.assertEqual(self.user.photo_variants, {})
+        self.assertEqual(photo_url(self.user), self.user.photo.url)
+
+        process_photo(self.user.pk, self.user.photo.name)
+        self.user.refresh_from_db()
+        variants = self.user.photo_variants
+        self.assertEqual(set(variants), {'thumb', 'medium'})
+        sizes = {}
+        for size, formats in variants.items():
+            self.assertEqual(set(formats), {'webp', 'jpeg'})
+            with default_storage.open(formats['webp']) as file, Image.open(file) as image:
+                sizes[size] = (image.format, image.size)
+        self.assertEqual(sizes, {'thumb': ('WEBP', (96, 96)), 'medium': ('WEBP', (512, 384))})
+        self.assertEqual(photo_url(self.user), default_storage.url(variants['medium']['webp']))
+        self.assertEqual(avatar_url(self.user), default_storage.url(variants['thumb']['webp']))
+
+        # A mesma foto de novo já vem com as variantes prontas
+        other = CustomUser.objects.create(username='bia', email='bia@example.com', name='Bia')
+        set_user_photo(other, image_upload())
+        self.assertEqual(other.photo_variants, variants)
+
+    def test_stale_job_does_not_overwrite_a_newer_photo(self):
+        set_user_photo(self.user, image_upload())
+        self.user.save()
+        old_name = self.user.photo.name
+        set_user_photo(self.user, image_upload(color='red'))
+        self.user.save()
+
+        process_photo(self.user.pk, old_name)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.photo_variants, {})
+
+
+class MediaTests(SimpleTestCase):
+    CONTENT = bytes(range(256)) * 4  # 1 KiB
+    NAME = 'profile/ab/ab' + '0' * 62 + '.png'
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root, MEDIA_SENDFILE=None, MEDIA_BLOCK_SIZE=100)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for name in (self.NAME, 'docs/leia.txt'):
+            os.makedirs(os.path.join(self.media_root, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(self.CONTENT)
+
+    def get(self, path=NAME, method='get', **headers):
+        request = getattr(RequestFactory(), method)('/media/' + path, headers=headers)
+        return serve_media(request, path)
+
+    def body(self, response):
+        return b''.join(response) if response.streaming else response.content
+
+    def test_whole_file_and_cache_headers(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.CONTENT)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(self.get('docs/leia.txt')['Cache-Control'], 'public, max-age=3600')
+
+        head = self.get(method='head')
+        self.assertEqual((head.status_code, head['Content-Length'], head.content), (200, '1024', b''))
+
+    def test_ranges(self):
+        for header, status, content_range, body in (
+            ('bytes=2-5', 206, 'bytes 2-5/1024', self.CONTENT[2:6]),
+            ('bytes=1000-', 206, 'bytes 1000-1023/1024', self.CONTENT[1000:]),
+            ('bytes=-3', 206, 'bytes 1021-1023/1024', self.CONTENT[-3:]),
+            ('bytes=0-5000', 206, 'bytes 0-1023/1024', self.CONTENT),
+            ('bytes=0-1,4-5', 200, None, self.CONTENT),
+        ):
+            response = self.get(Range=header)
+            self.assertEqual(response.status_code, status, header)
+            self.assertEqual(response.get('Content-Range'), content_range, header)
+            self.assertEqual(self.body(response), body, header)
+
+        for header in ('bytes=1024-', 'bytes=-0'):
+            response = self.get(Range=header)
+            self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */1024'))
+
+    def test_if_range(self):
+        first = self.get()
+        self.assertEqual(self.get(Range='bytes=0-9', **{'If-Range': first['ETag']}).status_code, 206)
+        self.assertEqual(self.get(Range='bytes=0-9', **{'If-Range': first['Last-Modified']}).status_code, 206)
+        # Arquivo mudou desde a cópia parcial do cliente: arquivo inteiro
+        stale = self.get(Range='bytes=0-9', **{'If-Range': '"outro"'})
+        self.assertEqual((stale.status_code, self.body(stale)), (200, self.CONTENT))
+
+    def test_conditional_requests(self):
+        first = self.get()
+        self.assertEqual(self.get(**{'If-None-Match': first['ETag']}).status_code, 304)
+        self.assertEqual(self.get(**{'If-Modified-Since': first['Last-Modified']}).status_code, 304)
+        self.assertEqual(self.get(**{'If-Match': '"outro"'}).status_code, 412)
+        self.assertEqual(self.get(**{'If-Unmodified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'}).status_code, 412)
+        self.assertEqual(self.get(**{'If-Match': first['ETag']}).status_code, 200)
+
+    def test_asgi_range_is_streamed_in_blocks(self):
+        request = AsyncRequestFactory().get('/media/' + self.NAME, headers={'Range': 'bytes=10-309'})
+        response = serve_media(request, self.NAME)
+
+        async def collect():
+            return [block async for block in response.streaming_content]
+
+        blocks = async_to_sync(collect)()
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual([len(block) for block in blocks], [100, 100, 100])
+        self.assertEqual(b''.join(blocks), self.CONTENT[10:310])
+
+    def test_sendfile(self):
+        with override_settings(MEDIA_SENDFILE='x-accel', MEDIA_ACCEL_PREFIX='/protected/'):
+            response = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.NAME)
+        self.assertEqual(response.content, b'')
+
+    def test_outside_media_root(self):
+        for path in ('../etc/passwd', 'profile', 'nao-existe.png'):
+            with self.assertRaises(Http404):
+                self.get(path)
+
+
+class DailyCheckinTests(TestCase):
+    YEARS = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='ana', email='ana@example.com', type='user')
+        cls.other = CustomUser.objects.create(username='bia', email='bia@example.com', type='user')
+        cls.today = timezone.localdate()
+        days = 365 * cls.YEARS
+        DailyCheckin.objects.bulk_create(
+            DailyCheckin(
+                user=cls.user,
+                date=cls.today - timedelta(days=offset),
+                intensity=offset % 11,
+                energy=(offset * 3) % 11,
+                stability=(offset * 7) % 11,
+                tags=['diario'],
+            )
+            for offset in range(1, days + 1)
+        )
+        rebuild_user_stats(cls.user.pk)
+        cls.history = days
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def save(self, user, data):
+        request = self.factory.post('/save-checkin/', data, format='json')
+        force_authenticate(request, user=user)
+        return save_daily_checkin(request)
+
+    def list(self, user, owner, **params):
+        request = self.factory.get(f'/checkins/{owner.pk}/', params)
+        force_authenticate(request, user=user)
+        return get_user_checkins(request, user_id=owner.pk)
+
+    def checkin_statements(self, queries):
+        # Sem os SAVEPOINTs e as estatísticas de humor gravadas junto
+        return [
+            q['sql'] for q in queries
+            if 'dailycheckin' in q['sql'] and not q['sql'].upper().startswith(('SAVEPOINT', 'RELEASE'))
+        ]
+
+    def test_save_is_a_single_upsert(self):
+        data = {'intensity': 7, 'energy': 4, 'stability': 6, 'notes': 'ok', 'tags': ['trabalho']}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.save(self.user, data)
+        self.assertEqual(response.status_code, 200)
+        writes = self.checkin_statements(queries)
+        self.assertEqual(len(writes), 1)
+        self.assertRegex(writes[0].upper(), r'ON (CONFLICT|DUPLICATE KEY)')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.save(self.user, {**data, 'intensity': 2, 'tags': []})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.checkin_statements(queries)), 1)
+
+        checkin = DailyCheckin.objects.get(user=self.user, date=self.today)
+        self.assertEqual((checkin.intensity, checkin.notes, checkin.tags), (2, 'ok', []))
+        self.assertEqual(DailyCheckin.objects.filter(user=self.user).count(), self.history + 1)
+
+    def test_save_validates_scales(self):
+        with self.assertNumQueries(0):
+            response = self.save(self.user, {'intensity': 11, 'energy': 'x', 'stability': 5})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data['errors']), 2)
+
+    def test_keyset_pages_cover_history_with_one_query_each(self):
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            params = {'limit': 100}
+            if cursor:
+                params['cursor'] = cursor
+            with self.assertNumQueries(1):
+                response = self.list(self.user, self.user, **params)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item['date'] for item in response.data['checkins'])
+            pages += 1
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), self.history)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(set(seen)), len(seen))
+        self.assertEqual(pages, -(-self.history // 100))
+
+    def test_date_range_and_projection(self):
+        start = self.today - timedelta(days=40)
+        end = self.today - timedelta(days=11)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.list(
+                self.user, self.user,
+                **{'from': start.isoformat(), 'to': end.isoformat(), 'fields': 'intensity'},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['checkins']), 30)
+        self.assertEqual(set(response.data['checkins'][0]), {'date', 'intensity'})
+        self.assertEqual(response.data['checkins'][0]['date'], end.isoformat())
+        self.assertIsNone(response.data['next_cursor'])
+        self.assertNotIn('notes', queries[0]['sql'])
+
+    def test_first_page_is_fast_for_years_of_history(self):
+        self.list(self.user, self.user)
+        timings = []
+        for _ in range(20):
+            started = time.perf_counter()
+            response = self.list(self.user, self.user)
+            timings.append(time.perf_counter() - started)
+            self.assertEqual(response.status_code, 200)
+
+        self.assertLess(statistics.median(timings), 0.05)
+
+    def sync(self, user, checkins, **extra):
+        request = self.factory.post('/checkins/sync/', {'checkins': checkins, **extra}, format='json')
+        force_authenticate(request, user=user)
+        return sync_checkins(request)
+
+    def test_sync_a_month_in_one_upsert(self):
+        checkins = [
+            {'date': (self.today - timedelta(days=offset)).isoformat(),
+             'intensity': 5, 'energy': 5, 'stability': 5}
+            for offset in range(30)
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.sync(self.other, checkins)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['saved'], 30)
+        self.assertEqual(len(self.checkin_statements(queries)), 2)
+
+        # Reenvio: os mesmos dias viram "updated"
+        response = self.sync(self.other, checkins[:2])
+        self.assertEqual([r['status'] for r in response.data['results']], ['updated', 'updated'])
+        self.assertEqual(DailyCheckin.objects.filter(user=self.other).count(), 30)
+
+    def test_sync_reports_each_item(self):
+        yesterday = (self.today - timedelta(days=1)).isoformat()
+        checkins = [
+            {'date': self.today.isoformat(), 'intensity': 3, 'energy': 3, 'stability': 3},
+            {'date': yesterday, 'intensity': 11, 'energy': 3, 'stability': 3},
+            {'date': (self.today + timedelta(days=5)).isoformat(), 'intensity': 1, 'energy': 1, 'stability': 1},
+            {'date': yesterday, 'intensity': 4, 'energy': 4, 'stability': 4},
+            {'date': yesterday, 'intensity': 6, 'energy': 6, 'stability': 6},
+        ]
+
+        response = self.sync(self.user, checkins)
+
+        self.assertEqual(response.status_code, 200)
+        statuses = [r['status'] for r in response.data['results']]
+        self.assertEqual(statuses, ['accepted', 'rejected', 'rejected', 'rejected', 'updated'])
+        self.assertEqual(DailyCheckin.objects.get(user=self.user, date=yesterday).intensity, 6)
+
+    def test_atomic_sync_writes_nothing_on_error(self):
+        checkins = [
+            {'date': self.today.isoformat(), 'intensity': 3, 'energy': 3, 'stability': 3},
+            {'date': 'ontem', 'intensity': 3, 'energy': 3, 'stability': 3},
+        ]
+
+        response = self.sync(self.other, checkins, atomic=True)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['saved'], 0)
+        self.assertEqual({r['status'] for r in response.data['results']}, {'rejected'})
+        self.assertFalse(DailyCheckin.objects.filter(user=self.other).exists())
+
+    def test_atomic_is_a_strict_boolean(self):
+        checkins = [
+            {'date': self.today.isoformat(), 'intensity': 3, 'energy': 3, 'stability': 3},
+            {'date': 'ontem', 'intensity': 3, 'energy': 3, 'stability': 3},
+        ]
+
+        for atomic in ('false', '0', 0, False):
+            with self.subTest(atomic=atomic):
+                response = self.sync(self.other, checkins, atomic=atomic)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['saved'], 1)
+        self.assertEqual(self.sync(self.other, checkins, atomic='true').status_code, 400)
+
+    def test_sync_needs_an_object_body(self):
+        request = self.factory.post('/checkins/sync/', [{'date': self.today.isoformat()}], format='json')
+        force_authenticate(request, user=self.other)
+
+        response = sync_checkins(request)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('errors', response.data)
+
+    def mood_stats(self, user, owner):
+        request = self.factory.get(f'/mood-stats/{owner.pk}/')
+        force_authenticate(request, user=user)
+        return get_mood_stats(request, user_id=owner.pk)
+
+    def test_mood_stats_follow_writes(self):
+        self.save(self.user, {'intensity': 9, 'energy': 4, 'stability': 6})
+        self.save(self.user, {'intensity': 10, 'energy': 4, 'stability': 6})
+        # Dias antigos editados fora de ordem, dentro e fora do anel de 90 dias
+        self.sync(self.user, [
+            {'date': (self.today - timedelta(days=days)).isoformat(),
+             'intensity': 1, 'energy': 2, 'stability': 3}
+            for days in (5, 400)
+        ])
+
+        incremental = MoodStats.objects.get(pk=self.user.pk)
+        rebuilt = rebuild_user_stats(self.user.pk)
+        for field in ('total_entries', 'last_date', 'last_values', 'previous_date',
+                      'previous_values', 'windows', 'recent'):
+            self.assertEqual(getattr(incremental, field), getattr(rebuilt, field), field)
+        for old, new in zip(incremental.ema, rebuilt.ema):
+            self.assertAlmostEqual(old, new)
+        self.assertEqual(incremental.total_entries, self.history + 1)
+
+    def test_keyset_rows(self):
+        DailyCheckin.objects.bulk_create(
+            DailyCheckin(user=self.other, date=self.today - timedelta(days=offset), intensity=5, energy=5, stability=5)
+            for offset in range(1, 11)
+        )
+        fields = ('user_id', 'date', 'intensity')
+        expected = list(DailyCheckin.objects.order_by('user_id', 'date').values_list(*fields))
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(keyset_rows(DailyCheckin.objects.all(), fields, ('user_id', 'date'), chunk_size=100))
+
+        self.assertEqual(rows, expected)
+        # Cada consulta traz no máximo um lote: nada de resultado inteiro na memória
+        self.assertEqual(len(queries), len(expected) // 100 + 1)
+
+    def test_rebuild_command_matches_incremental_stats(self):
+        self.save(self.user, {'intensity': 9, 'energy': 4, 'stability': 6})
+        self.save(self.other, {'intensity': 3, 'energy': 4, 'stability': 6})
+        before = {stats.pk: stats for stats in MoodStats.objects.all()}
+
+        call_command('rebuild_mood_stats', batch_size=100, stdout=StringIO())
+
+        rebuilt = {stats.pk: stats for stats in MoodStats.objects.all()}
+        self.assertEqual(set(rebuilt), set(before))
+        for pk, stats in rebuilt.items():
+            for field in ('total_entries', 'last_date', 'last_values', 'previous_date', 'windows'):
+                self.assertEqual(getattr(stats, field), getattr(before[pk], field), field)
+
+    def test_mood_stats_are_one_lookup(self):
+        self.save(self.user, {'intensity': 9, 'energy': 4, 'stability': 6})
+
+        with self.assertNumQueries(1):
+            response = self.mood_stats(self.user, self.user)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_entries'], self.history + 1)
+        self.assertEqual(response.data['last_checkin']['intensity'], 9)
+        self.assertEqual(response.data['trend'], 'up')
+        week = [(self.today - timedelta(days=offset)) for offset in range(1, 7)]
+        self.assertEqual(response.data['windows']['7']['count'], 7)
+        self.assertAlmostEqual(
+            response.data['windows']['7']['intensity'],
+            round((9 + sum((self.today - day).days % 11 for day in week)) / 7, 1),
+        )
+
+        self.assertEqual(self.mood_stats(self.other, self.user).status_code, 403)
+        empty = self.mood_stats(self.other, self.other).data
+        self.assertEqual((empty['total_entries'], empty['last_checkin']), (0, None))
+
+    def test_other_users_need_a_session(self):
+        response = self.list(self.other, self.user)
+        self.assertEqual(response.status_code, 403)
+
+        psychologist = CustomUser.objects.create(
+            username='dra', email='dra@example.com', type='psychologist'
+        )
+        self.assertEqual(self.list(psychologist, self.user).status_code, 403)
+        Session.objects.create(psychologist=psychologist, user=self.user)
+        self.assertEqual(self.list(psychologist, self.user).status_code, 200)
+
+
+class CohortAnalyticsTests(TestCase):
+    DAYS = 120
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.psychologist = CustomUser.objects.create(
+            username='dra', email='dra@example.com', type='psychologist'
+        )
+        cls.today = timezone.localdate()
+        rng = random.Random(7)
+        cls.patients = []
+        checkins = []
+        for i in range(4):
+            patient = CustomUser.objects.create(username=f'p{i}', email=f'p{i}@example.com', type='user')
+            Session.objects.create(psychologist=cls.psychologist, user=patient)
+            cls.patients.append(patient)
+            for offset in range(cls.DAYS):
+                # O paciente 0 cai um ponto a cada 3 dias no último mês
+                base = 5 + offset // 3 if i == 0 and offset < 28 else rng.randint(2, 8)
+                checkins.append(DailyCheckin(
+                    user=patient, date=cls.today - timedelta(days=offset),
+                    intensity=min(base, 10), energy=rng.randint(0, 10), stability=rng.randint(0, 10),
+                ))
+        # Paciente de outro psicólogo fica de fora
+        outsider = CustomUser.objects.create(username='x', email='x@example.com', type='user')
+        checkins.append(DailyCheckin(user=outsider, date=cls.today, intensity=0, energy=0, stability=0))
+        DailyCheckin.objects.bulk_create(checkins)
+        for user_id in {checkin.user_id for checkin in checkins}:
+            rebuild_user_stats(user_id)
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def analytics(self, user, **params):
+        request = self.factory.get('/analytics/cohort/', params)
+        force_authenticate(request, user=user)
+        return get_cohort_analytics(request)
+
+    def test_matches_per_patient_aggregates(self):
+        response = self.analytics(self.psychologist, period='month', days=self.DAYS, series=1)
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+
+        self.assertEqual(data['cohort']['patients'], 4)
+        self.assertEqual(data['cohort']['checkins'], 4 * self.DAYS)
+        self.assertEqual(sum(data['cohort']['count']), 4 * self.DAYS)
+        self.assertEqual(data['periods'][-1], self.today.replace(day=1).isoformat())
+
+        for patient, summary in zip(self.patients, data['patients']):
+            rows = list(DailyCheckin.objects.filter(user=patient).values_list('intensity', 'energy'))
+            intensity = [row[0] for row in rows]
+            energy = [row[1] for row in rows]
+            self.assertEqual(summary['user_id'], patient.pk)
+            self.assertEqual(summary['checkins'], self.DAYS)
+            self.assertAlmostEqual(summary['mean']['intensity'], statistics.fmean(intensity), places=2)
+            self.assertAlmostEqual(summary['variance']['energy'], statistics.pvariance(energy), places=2)
+            self.assertAlmostEqual(
+                summary['correlation']['intensity_energy'],
+                statistics.correlation(intensity, energy), places=2,
+            )
+
+        this_month = DailyCheckin.objects.filter(user=self.patients[1], date__gte=self.today.replace(day=1))
+        self.assertEqual(data['series']['count'][1][-1], this_month.count())
+        self.assertEqual([item['user_id'] for item in data['declining']], [self.patients[0].pk])
+
+    def test_cached_until_a_patient_checks_in(self):
+        first = self.analytics(self.psychologist).data
+        with self.assertNumQueries(1):
+            self.assertEqual(self.analytics(self.psychologist).data, first)
+
+        request = self.factory.post(
+            '/save-checkin/', {'intensity': 10, 'energy': 10, 'stability': 10}, format='json'
+        )
+        force_authenticate(request, user=self.patients[1])
+        save_daily_checkin(request)
+
+        updated = self.analytics(self.psychologist).data
+        self.assertNotEqual(updated['cohort']['mean'], first['cohort']['mean'])
+        self.assertEqual(updated['cohort']['checkins'], first['cohort']['checkins'])
+
+    def test_deleting_a_checkin_invalidates(self):
+        first = self.analytics(self.psychologist).data
+
+        DailyCheckin.objects.filter(user=self.patients[1], date=self.today).delete()
+
+        updated = self.analytics(self.psychologist).data
+        self.assertEqual(updated['cohort']['checkins'], first['cohort']['checkins'] - 1)
+
+    def test_only_psychologists(self):
+        self.assertEqual(self.analytics(self.patients[0]).status_code, 403)
+        self.assertEqual(self.analytics(self.psychologist, period='day').status_code, 400)
+
+
+class CheckinTagIndexTests(TestCase):
+    TAGS = ['ansiedade', 'trabalho', 'sono']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='ana', email='ana@example.com', type='user')
+        cls.today = timezone.localdate()
+        # Dia n: ansiedade se n % 2, trabalho se n % 3, sono se n % 5
+        DailyCheckin.objects.bulk_create(
+            DailyCheckin(
+                user=cls.user, date=cls.today - timedelta(days=offset),
+                intensity=5, energy=5, stability=5,
+                tags=[tag for tag, every in zip(cls.TAGS, (2, 3, 5)) if offset % every == 0],
+            )
+            for offset in range(1, 181)
+        )
+        call_command('backfill_checkin_tags', stdout=StringIO())
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def get(self, view, **params):
+        request = self.factory.get('/', params)
+        force_authenticate(request, user=self.user)
+        return view(request, user_id=self.user.pk)
+
+    def test_backfill_matches_json(self):
+        for checkin in DailyCheckin.objects.filter(user=self.user):
+            indexed = CheckinTag.objects.filter(user=self.user, date=checkin.date)
+            self.assertEqual(sorted(indexed.values_list('tag__name', flat=True)), sorted(checkin.tags))
+
+        # Rodar de novo não duplica nada
+        before = CheckinTag.objects.count()
+        call_command('backfill_checkin_tags', stdout=StringIO())
+        self.assertEqual(CheckinTag.objects.count(), before)
+
+        # Do zero, em lotes pequenos (uma consulta por lote), o mesmo índice
+        call_command('backfill_checkin_tags', clear=True, batch_size=7, stdout=StringIO())
+        self.assertEqual(CheckinTag.objects.count(), before)
+
+    def test_writes_keep_the_index_in_sync(self):
+        request = self.factory.post(
+            '/save-checkin/',
+            {'intensity': 5, 'energy': 5, 'stability': 5, 'tags': ['Ansiedade ', 'sono']},
+            format='json',
+        )
+        force_authenticate(request, user=self.user)
+        save_daily_checkin(request)
+        today = CheckinTag.objects.filter(user=self.user, date=self.today)
+        self.assertEqual(sorted(today.values_list('tag__name', flat=True)), ['ansiedade', 'sono'])
+
+        # Reenvio offline do mesmo dia sem tags limpa o índice daquele dia
+        request = self.factory.post('/checkins/sync/', {'checkins': [
+            {'date': self.today.isoformat(), 'intensity': 5, 'energy': 5, 'stability': 5, 'tags': []},
+        ]}, format='json')
+        force_authenticate(request, user=self.user)
+        sync_checkins(request)
+        self.assertFalse(today.exists())
+
+    def test_filter_by_tag_in_a_range(self):
+        start = self.today - timedelta(days=90)
+        response = self.get(get_user_checkins, tag='Ansiedade', limit=100, **{'from': start.isoformat()})
+
+        self.assertEqual(response.status_code, 200)
+        dates = [item['date'] for item in response.data['checkins']]
+        expected = [
+            (self.today - timedelta(days=offset)).isoformat() for offset in range(2, 91, 2)
+        ]
+        self.assertEqual(dates, expected)
+
+        if connection.vendor == 'sqlite':
+            plan = CheckinTag.objects.filter(
+                tag__name='ansiedade', user=self.user, date__gte=start
+            ).values('date').explain()
+            self.assertNotIn('SCAN user_checkintag', plan)
+
+    def test_counts_and_cooccurrences(self):
+        response = self.get(get_tag_stats, limit=2)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tags'], [
+            {'tag': 'ansiedade', 'count': 90},
+            {'tag': 'trabalho', 'count': 60},
+            {'tag': 'sono', 'count': 36},
+        ])
+        self.assertEqual(response.data['cooccurrences'], [
+            {'tags': ['ansiedade', 'trabalho'], 'count': 30},
+            {'tags': ['ansiedade', 'sono'], 'count': 18},
+        ])
+
+        week = self.get(get_tag_stats, **{'from': (self.today - timedelta(days=6)).isoformat()})
+        self.assertEqual({item['tag']: item['count'] for item in week.data['tags']},
+                         {'ansiedade': 3, 'trabalho': 2, 'sono': 1})
+
+
+class ExportTests(TestCase):
+    DAYS = 400
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='ana', email='ana@example.com', type='user', name='Ana')
+        cls.psychologist = CustomUser.objects.create(
+            username='dra', email='dra@example.com', type='psychologist'
+        )
+        other = CustomUser.objects.create(username='dro', email='dro@example.com', type='psychologist')
+        today = timezone.localdate()
+        DailyCheckin.objects.bulk_create(
+            DailyCheckin(
+                user=cls.user, date=today - timedelta(days=offset),
+                intensity=offset % 11, energy=5, stability=5,
+                notes=f'dia "{offset}", com vírgula', tags=['sono'],
+            )
+            for offset in range(cls.DAYS)
+        )
+        Session.objects.create(psychologist=cls.psychologist, user=cls.user, date=today)
+        Session.objects.create(psychologist=other, user=cls.user, date=today)
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def export(self, user, **params):
+        request = self.factory.get(f'/export/{self.user.pk}/', params)
+        force_authenticate(request, user=user)
+        return export_user_data(request, user_id=self.user.pk)
+
+    def test_ndjson_streams_every_record(self):
+        response = self.export(self.user)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="dados-ana-', response['Content-Disposition'])
+        self.assertIn('no-store', response['Cache-Control'])
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        records = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+
+        types = [record['record'] for record in records]
+        self.assertEqual(types, ['profile'] + ['checkin'] * self.DAYS + ['session'] * 2)
+        self.assertEqual(records[0]['name'], 'Ana')
+        self.assertEqual(records[1]['tags'], ['sono'])
+        self.assertLess(records[1]['date'], records[-3]['date'])
+
+    def test_sections_read_one_query_per_chunk(self):
+        sections = export_sections(self.user, chunk_size=150)
+        _, (_, fields, checkins), (_, _, sessions) = list(sections)
+
+        with self.assertNumQueries(3):  # 150 + 150 + 100
+            dates = [row[fields.index('date')] for row in checkins]
+        self.assertEqual(len(dates), self.DAYS)
+        self.assertEqual(dates, sorted(dates))
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(sessions)), 2)
+
+    def test_csv_and_gzip(self):
+        data = gzip.decompress(b''.join(self.export(self.user, output='csv', gzip=1).streaming_content))
+        rows = list(csv.reader(data.decode().splitlines()))
+
+        self.assertEqual(rows[0][:3], ['record', 'id', 'username'])
+        checkins = [row for row in rows if row[0] == 'checkin']
+        self.assertEqual(len(checkins), self.DAYS)
+        header = rows[2]
+        self.assertEqual(dict(zip(header, checkins[0]))['tags'], '["sono"]')
+        self.assertEqual(dict(zip(header, checkins[-1]))['notes'], 'dia "0", com vírgula')
+
+    def test_async_iterator_matches_sync(self):
+        async def collect():
+            return [chunk async for chunk in aexport_chunks(self.user, 'csv')]
+
+        self.assertEqual(b''.join(async_to_sync(collect)()), b''.join(export_chunks(self.user, 'csv')))
+
+    def test_psychologist_exports_only_their_sessions(self):
+        outsider = CustomUser.objects.create(username='x', email='x@example.com', type='psychologist')
+        self.assertEqual(self.export(outsider).status_code, 403)
+        self.assertEqual(self.export(self.user, output='xml').status_code, 400)
+
+        lines = b''.join(self.export(self.psychologist).streaming_content).decode().splitlines()
+        sessions = [json.loads(line) for line in lines if '"record": "session"' in line]
+        self.assertEqual([s['psychologist_id'] for s in sessions], [self.psychologist.pk])
+
+    def test_command_writes_a_file(self):
+        path = self.id() + '.ndjson.gz'
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+        call_command('export_user_data', 'ana', '--gzip', '-o', path, stdout=StringIO())
+
+        with gzip.open(path, 'rt') as f:
+            self.assertEqual(sum(1 for _ in f), 1 + self.DAYS + 2)
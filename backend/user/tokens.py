@@ -0,0 +1,348 @@
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from firebase_admin import _token_gen, auth
+from google.auth import transport
+
+logger = logging.getLogger(__name__)
+
+# Contadores do processo, expostos em chat/api/metrics/
+counters = {
+    'token_cache_hits': 0,
+    'token_cache_shared_hits': 0,
+    'token_cache_misses': 0,
+    'token_cache_evictions': 0,
+    'token_verify_started': 0,
+    'token_verify_coalesced': 0,
+    'cert_fetches': 0,
+}
+
+
+def token_key(token):
+    """Cache key for an ID token; the raw token is never stored"""
+    return 'firebase:token:' + hashlib.sha256(token.encode()).hexdigest()
+
+
+class VerifiedTokenCache:
+    """Decoded Firebase ID tokens whose signature was already checked.
+
+    The frontend reuses one ID token for up to an hour, so every DRF request
+    and WebSocket connect would otherwise repeat the same RSA verification.
+    Entries live in an in-process LRU until the token's exp. If
+    shared_alias names a Django cache (e.g. Redis), entries are also stored
+    there so other workers skip verification too.
+    """
+
+    def __init__(self, max_entries=10000, shared_alias=None):
+        self.max_entries = max_entries
+        self.shared_alias = shared_alias
+        self._entries = OrderedDict()  # key -> (decoded_token, exp)
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def get(self, token, local_only=False):
+        key = token_key(token)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                decoded, exp = entry
+                if exp > now:
+                    self._entries.move_to_end(key)
+                    counters['token_cache_hits'] += 1
+                    return decoded
+                del self._entries[key]
+
+        if local_only:
+            return None
+
+        if self.shared is not None:
+            decoded = self.shared.get(key)
+            if decoded is not None and decoded.get('exp', 0) > now:
+                self._store_local(key, decoded)
+                counters['token_cache_shared_hits'] += 1
+                return decoded
+
+        counters['token_cache_misses'] += 1
+        return None
+
+    def set(self, token, decoded):
+        ttl = decoded.get('exp', 0) - time.time()
+        if ttl <= 0:
+            return
+        key = token_key(token)
+        self._store_local(key, decoded)
+        if self.shared is not None:
+            self.shared.set(key, decoded, timeout=int(ttl))
+
+    def forget(self, token):
+        key = token_key(token)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store_local(self, key, decoded):
+        with self._lock:
+            self._entries[key] = (decoded, decoded['exp'])
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                counters['token_cache_evictions'] += 1
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                _token_cache = VerifiedTokenCache(
+                    max_entries=getattr(settings, 'FIREBASE_TOKEN_CACHE_SIZE', 10000),
+                    shared_alias=getattr(settings, 'FIREBASE_TOKEN_CACHE', None),
+                )
+    return _token_cache
+
+
+def verify_id_token(token, check_revoked=False):
+    """auth.verify_id_token with a cache in front.
+
+    check_revoked=True always asks Firebase (the revocation state can
+    change at any time) and refreshes the cached entry. With
+    FIREBASE_TOKEN_CACHE_ENABLED = False every call is verified.
+    """
+    enabled = getattr(settings, 'FIREBASE_TOKEN_CACHE_ENABLED', True)
+    cache = get_token_cache()
+
+    if enabled and not check_revoked:
+        decoded = cache.get(token)
+        if decoded is not None:
+            return decoded
+
+    ensure_cert_refresh()
+    try:
+        decoded = auth.verify_id_token(token, check_revoked=check_revoked)
+    except (auth.RevokedIdTokenError, auth.UserDisabledError):
+        cache.forget(token)
+        raise
+
+    if enabled:
+        cache.set(token, decoded)
+    return decoded
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_inflight = {}  # (loop, token key) -> asyncio.Future
+
+
+def get_verify_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'FIREBASE_VERIFY_WORKERS', 4),
+                    thread_name_prefix='firebase-verify',
+                )
+    return _executor
+
+
+async def averify_id_token(token):
+    """verify_id_token for async code (WebSocket middleware).
+
+    A hit in the in-process cache is answered on the event loop. Anything
+    else (shared cache, RSA check, certificate fetch) runs on a bounded
+    thread pool, and concurrent calls for the same token share one
+    in-flight verification, so a reconnect storm verifies each token once.
+    """
+    if getattr(settings, 'FIREBASE_TOKEN_CACHE_ENABLED', True):
+        decoded = get_token_cache().get(token, local_only=True)
+        if decoded is not None:
+            return decoded
+
+    loop = asyncio.get_running_loop()
+    key = (loop, token_key(token))
+    future = _inflight.get(key)
+    if future is None:
+        future = loop.run_in_executor(get_verify_executor(), verify_id_token, token)
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+        counters['token_verify_started'] += 1
+    else:
+        counters['token_verify_coalesced'] += 1
+
+    # shield: um cliente que desconecta no meio não cancela os outros
+    return await asyncio.shield(future)
+
+
+class CachedCertResponse(transport.Response):
+    def __init__(self, status, headers, data):
+        self._status = status
+        self._headers = headers
+        self._data = data
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def headers(self):
+        return self._headers
+
+    @property
+    def data(self):
+        return self._data
+
+
+class PrefetchedCertRequest(transport.Request):
+    """Serves Google's public signing keys from memory.
+
+    firebase_admin fetches the certificate URL on every verification and
+    relies on an HTTP cache, so once max-age runs out the next verification
+    blocks on the network. This transport wraps firebase_admin's own and
+    keeps the last good response per URL; a background thread refetches it
+    before it expires. Only the very first fetch of a URL happens inline.
+    """
+
+    def __init__(self, delegate, margin=300, retry=30):
+        self.delegate = delegate
+        self.margin = margin
+        self.retry = retry
+        self._responses = {}  # url -> (response, refresh_at)
+        self._urls = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def __call__(self, url, method='GET', body=None, headers=None, timeout=None, **kwargs):
+        if method == 'GET' and body is None:
+            entry = self._responses.get(url)
+            if entry is not None:
+                return entry[0]
+            return self.fetch(url)
+        return self.delegate(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+
+    def fetch(self, url):
+        # no-cache: ignorar a cópia do CacheControl e buscar de novo
+        response = self.delegate(url, method='GET', headers={'cache-control': 'no-cache'})
+        if response.status != 200:
+            return response
+
+        cached = CachedCertResponse(response.status, dict(response.headers), response.data)
+        # Atualizar `margin` segundos antes de expirar (ou na metade, se o
+        # max-age for curto); a resposta antiga segue válida até lá
+        age = max_age(cached.headers)
+        refresh_at = time.time() + max(age - self.margin, age / 2)
+        with self._lock:
+            self._responses[url] = (cached, refresh_at)
+        counters['cert_fetches'] += 1
+        return cached
+
+    def start(self, urls):
+        self._urls.update(urls)
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='firebase-certs', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            waits = []
+            for url in list(self._urls):
+                entry = self._responses.get(url)
+                if entry is None or entry[1] <= time.time():
+                    try:
+                        self.fetch(url)
+                    except Exception as e:
+                        logger.warning("⚠️ Falha ao atualizar certificados do Firebase: %s", e)
+                entry = self._responses.get(url)
+                # Sem resposta nova (erro ou status != 200): tentar de novo em breve
+                fresh = entry is not None and entry[1] > time.time()
+                waits.append(entry[1] - time.time() if fresh else self.retry)
+            self._wakeup.wait(max(min(waits, default=self.retry), 1))
+            self._wakeup.clear()
+
+
+def max_age(headers):
+    cache_control = headers.get('cache-control') or headers.get('Cache-Control') or ''
+    match = re.search(r'max-age=(\d+)', cache_control)
+    return int(match.group(1)) if match else 3600
+
+
+def start_cert_refresh(app=None):
+    """Prefetch the ID token signing keys and keep them fresh in the background.
+
+    Relies on firebase_admin internals (the token verifier's HTTP request);
+    if they change, returns None and firebase_admin keeps fetching the keys
+    itself.
+    """
+    from . import authentication  # noqa: F401 - inicializa o firebase_admin
+
+    try:
+        verifier = auth._get_client(app)._token_verifier
+        request = verifier.request
+    except AttributeError as e:
+        logger.warning("⚠️ Sem pré-busca dos certificados do Firebase (firebase_admin mudou?): %s", e)
+        return None
+
+    if not isinstance(request, PrefetchedCertRequest):
+        request = verifier.request = PrefetchedCertRequest(request)
+    request.start([_token_gen.ID_TOKEN_CERT_URI])
+    return request
+
+
+_cert_refresh_started = False
+_cert_refresh_lock = threading.Lock()
+
+
+def ensure_cert_refresh():
+    """start_cert_refresh() once per process, on the first verification.
+
+    Called from verify_id_token, which never runs on the event loop, so
+    neither importing the ASGI app nor a coroutine waits for the network.
+    """
+    global _cert_refresh_started
+    if _cert_refresh_started or not getattr(settings, 'FIREBASE_CERT_PREFETCH', True):
+        return
+    with _cert_refresh_lock:
+        if _cert_refresh_started:
+            return
+        _cert_refresh_started = True
+        try:
+            start_cert_refresh()
+        except Exception as e:
+            logger.warning("⚠️ Falha ao iniciar a atualização dos certificados do Firebase: %s", e)
+
+
+def token_cache_stats():
+    lookups = (
+        counters['token_cache_hits']
+        + counters['token_cache_shared_hits']
+        + counters['token_cache_misses']
+    )
+    hits = counters['token_cache_hits'] + counters['token_cache_shared_hits']
+    return {
+        **counters,
+        'token_cache_hit_ratio': round(hits / lookups, 4) if lookups else None,
+    }
@@ -1,7 +1,15 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
+    path('users/', async_views.users_view, name='users'),
+    path('users/<int:user_id>/', async_views.user_detail_view, name='user_detail'),
+    path('login/', async_views.login_view, name='login'),
     path('save-checkin/', views.save_daily_checkin, name='save_daily_checkin'),
+    path('checkins/sync/', views.sync_checkins, name='sync_checkins'),
     path('checkins/<int:user_id>/', views.get_user_checkins, name='get_user_checkins'),
+    path('tag-stats/<int:user_id>/', views.get_tag_stats, name='get_tag_stats'),
+    path('mood-stats/<int:user_id>/', views.get_mood_stats, name='get_mood_stats'),
+    path('export/<int:user_id>/', views.export_user_data, name='export_user_data'),
+    path('analytics/cohort/', views.get_cohort_analytics, name='get_cohort_analytics'),
 ]
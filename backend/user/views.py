@@ -1,260 +1,502 @@
-from firebase_admin import auth as firebase_auth
-from rest_framework.decorators import api_view, permission_classes, parser_classes
+from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.parsers import MultiPartParser, FormParser
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
 from django.conf import settings
-from datetime import date
-from .models import CustomUser
+from django.utils import timezone
+from datetime import date, timedelta
+import hashlib
+import json
+import re
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from .analytics import PERIODS, cohort_analytics
+from .export import FORMATS, aexport_chunks, export_chunks, export_filename
+from .models import CustomUser, DailyCheckin, MoodStats, Session
+from .mood import record_checkins, summarize
+from .photos import photo_url, variant_urls
+from .tags import TAG_MAX_LENGTH, cooccurrences, sync_checkin_tags, tag_counts, tagged_dates
+
+
+def parse_birth_date(birth, min_age):
+    """Parse an ISO birth date. Returns (birth_date, errors)."""
+    errors = []
+    try:
+        birth_date = date.fromisoformat(birth)  # ISO format (ex: '1990-05-12')
+    except (ValueError, TypeError):
+        return None, ['Formato de data de nascimento inválido.']
 
+    today = date.today()
 
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def create_user_view(request):
-    data = request.data
-    name = data.get('name')
-    email = data.get('email')
-    username = data.get('username')
-    password = data.get('password')
-    type_ = data.get('type')
-    birth = data.get('birth')
-    phone = data.get('phone')
-    crp = data.get('crp') if type_ == 'psychologist' else None
+    if birth_date > today:
+        errors.append('A data de nascimento não pode estar no futuro.')
 
-    errors = []
+    age = (
+        today.year
+        - birth_date.year
+        - ((today.month, today.day) < (birth_date.month, birth_date.day))
+    )
 
-    if not all([name, email, username, password, type_, birth, phone]):
-        errors.append('Todos os campos obrigatórios devem ser preenchidos.')
+    if birth_date.year < today.year - 120:
+        errors.append('A data de nascimento é muito antiga.')
+
+    if age < min_age:
+        errors.append(f'Você precisa ter pelo menos {min_age} anos.')
+
+    return birth_date, errors
+
+
+def unique_errors(exc):
+    """Error messages for a unique constraint violation on CustomUser"""
+    # Nome da constraint/coluna, no formato de cada banco:
+    # SQLite "user_customuser.email", MySQL "key 'user_customuser.email'"
+    # (ou "key 'email'"), PostgreSQL "user_customuser_email_key"
+    match = re.search(r"(?:customuser[._]|key ')(email|username)", str(exc))
+    if match and match.group(1) == 'email':
+        return ['Este e-mail já está em uso.']
+    if match:
+        return ['Este username já está em uso.']
+    return ['Este e-mail ou username já está em uso.']
+
+
+# Campos do perfil, na ordem em que aparecem na resposta
+# photo: maior variante (WebP); photo_variants: todas, por tamanho e formato
+USER_FIELDS = ('id', 'name', 'email', 'username', 'type', 'phone', 'birth', 'photo', 'photo_variants')
+
+
+def absolute_url(request, url, base=None):
+    # base = request.build_absolute_uri('/')[:-1], calculado uma vez por lote
+    if base is not None and url.startswith('/'):
+        return base + url
+    return request.build_absolute_uri(url)
+
+
+def serialize_user(user, request, fields=USER_FIELDS, base=None):
+    # Sem request, as URLs de foto ficam relativas (veja profile_entry)
+    absolute = (lambda url: absolute_url(request, url, base)) if request else (lambda url: url)
+    data = {}
+    for field in fields:
+        if field == 'photo':
+            url = photo_url(user)
+            value = absolute(url) if url else None
+        elif field == 'photo_variants':
+            value = {
+                size: {key: absolute(url) for key, url in formats.items()}
+                for size, formats in variant_urls(user).items()
+            }
+        else:
+            value = getattr(user, field)
+            if field == 'birth':
+                value = value.isoformat() if value else None
+        data[field] = value
+    return data
+
+
+def profile_entry(user):
+    """Profile as kept in the profile cache: payload plus its validators"""
+    # URLs de foto relativas: o host é o da requisição (veja profile_payload)
+    data = serialize_user(user, None)
+    body = json.dumps(data, sort_keys=True).encode()
+    return {
+        'data': data,
+        'etag': quote_etag(hashlib.sha1(body).hexdigest()),
+        'last_modified': int(user.updated_at.timestamp()),
+    }
+
+
+def profile_payload(request, entry):
+    data = dict(entry['data'])
+    base = request.build_absolute_uri('/')[:-1]
+    if data['photo']:
+        data['photo'] = absolute_url(request, data['photo'], base)
+    data['photo_variants'] = {
+        size: {key: absolute_url(request, url, base) for key, url in formats.items()}
+        for size, formats in data['photo_variants'].items()
+    }
+    return data
+
+
+def conditional_response(request, response, etag, last_modified=None):
+    """Add validators to a 200 response, or answer 304 if the client's copy is current"""
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Resposta depende do usuário: só o navegador guarda, e sempre revalida
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return get_conditional_response(
+        request, etag=etag, last_modified=last_modified, response=response,
+    )
 
-    try:
-        birth_date = date.fromisoformat(birth)  # ISO format (ex: '1990-05-12')
-        today = date.today()
 
-        if birth_date > today:
-            errors.append('A data de nascimento não pode estar no futuro.')
+# Campos do check-in, na ordem da resposta
+CHECKIN_FIELDS = ('id', 'date', 'intensity', 'energy', 'stability', 'notes', 'tags')
+CHECKIN_SCALES = (
+    ('intensity', 'intensidade'),
+    ('energy', 'energia'),
+    ('stability', 'estabilidade'),
+)
 
-        age = (
-            today.year
-            - birth_date.year
-            - ((today.month, today.day) < (birth_date.month, birth_date.day))
-        )
 
-        if birth_date.year < today.year - 120:
-            errors.append('A data de nascimento é muito antiga.')
+def parse_checkin(data):
+    """Validated check-in values from request data, as (values, errors)"""
+    values = {}
+    errors = []
 
-        if age < 10:
-            errors.append('Você precisa ter pelo menos 10 anos.')
+    for field, label in CHECKIN_SCALES:
+        value = data.get(field)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            errors.append(f'O campo {label} é obrigatório e deve ser um número.')
+            continue
+        if not 0 <= value <= 10:
+            errors.append(f'O campo {label} deve estar entre 0 e 10.')
+        values[field] = value
+
+    notes = data.get('notes')
+    if notes is not None and not isinstance(notes, str):
+        errors.append('O campo notas deve ser um texto.')
+    values['notes'] = notes or None
+
+    tags = data.get('tags') or []
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        errors.append('O campo tags deve ser uma lista de textos.')
+    elif any(len(tag.strip()) > TAG_MAX_LENGTH for tag in tags):
+        errors.append(f'Cada tag deve ter no máximo {TAG_MAX_LENGTH} caracteres.')
+    values['tags'] = tags
+
+    return values, errors
+
+
+def upsert_checkins(checkins, existing=None):
+    """Insert or update check-ins in one statement, keyed on (user, date).
+
+    INSERT ... ON CONFLICT (PostgreSQL / SQLite) or ON DUPLICATE KEY UPDATE
+    (MySQL), so concurrent saves for the same day never race. MySQL does not
+    return the ids of upserted rows, so pk may stay None there. The users'
+    MoodStats and the tag index are updated in the same transaction;
+    existing is the set of days already stored, when the caller knows it.
+    """
+    unique_fields = ['user', 'date'] if connection.features.supports_update_conflicts_with_target else None
+    by_user = {}
+    for checkin in checkins:
+        by_user.setdefault(checkin.user_id, []).append(checkin)
+
+    with transaction.atomic():
+        saved = DailyCheckin.objects.bulk_create(
+            checkins,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=['intensity', 'energy', 'stability', 'notes', 'tags', 'updated_at'],
+        )
+        for user_id, user_checkins in by_user.items():
+            record_checkins(user_id, user_checkins, existing)
+        sync_checkin_tags(checkins)
+    return saved
 
-    except (ValueError, TypeError):
-        errors.append('Formato de data de nascimento inválido.')
 
-    if type_ == 'psychologist' and not crp:
-        errors.append('O campo CRP é obrigatório para psicólogos.')
+def serialize_checkin(checkin, fields=CHECKIN_FIELDS):
+    data = {}
+    for field in fields:
+        value = getattr(checkin, field)
+        if field == 'date':
+            value = value.isoformat()
+        data[field] = value
+    return data
 
-    if CustomUser.objects.filter(email=email).exists():
-        errors.append('Este e-mail já está em uso.')
 
-    if CustomUser.objects.filter(username=username).exists():
-        errors.append('Este username já está em uso.')
+def can_view_checkins(user, owner_id):
+    """The owner, or a psychologist who has sessions with them"""
+    if user.id == owner_id:
+        return True
+    return user.is_psychologist() and Session.objects.filter(
+        psychologist=user, user_id=owner_id
+    ).exists()
 
+
+@api_view(['POST'])
+def save_daily_checkin(request):
+    values, errors = parse_checkin(request.data)
     if errors:
         return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
 
-    user = CustomUser.objects.create_user(
-        name=name,
-        email=email,
-        username=username,
-        password=password,
-        type=type_,
-        birth=birth_date,
-        phone=phone,
-        crp=crp,
-    )
+    checkin = DailyCheckin(user=request.user, **values)
+    upsert_checkins([checkin])
 
     return Response(
-        {'message': 'Usuário criado com sucesso!'},
-        status=status.HTTP_201_CREATED,
+        {
+            'message': 'Check-in salvo com sucesso!',
+            # Sem id: o upsert não devolve o id em todos os bancos
+            'checkin': serialize_checkin(checkin, CHECKIN_FIELDS[1:]),
+        },
+        status=status.HTTP_200_OK,
     )
 
 
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def login_view(request):
-    # Espera o token no header Authorization: Bearer <token>
-    auth_header = request.headers.get('Authorization', '')
-    if not auth_header.startswith('Bearer '):
-        return Response(
-            {'error': 'Token do Firebase não fornecido.'},
-            status=status.HTTP_401_UNAUTHORIZED,
-        )
-    firebase_token = auth_header.split(' ')[1]
+def parse_sync_item(item, latest):
+    """Validated (date, values) of one offline check-in, plus errors"""
+    if not isinstance(item, dict):
+        return None, None, ['Cada check-in deve ser um objeto.']
 
+    values, errors = parse_checkin(item)
     try:
-        decoded_token = firebase_auth.verify_id_token(firebase_token)
-        firebase_uid = decoded_token['uid']
-        email = decoded_token.get('email')
-    except Exception:
-        return Response(
-            {'error': 'Token do Firebase inválido.'},
-            status=status.HTTP_401_UNAUTHORIZED,
-        )
+        day = date.fromisoformat(item.get('date') or '')
+    except (TypeError, ValueError):
+        day = None
+        errors.append('O campo data é obrigatório, no formato AAAA-MM-DD.')
+    if day and day > latest:
+        errors.append('A data do check-in não pode estar no futuro.')
+    return day, values, errors
 
-    try:
-        user = CustomUser.objects.get(email=email)
-        # Aqui você pode retornar dados do usuário, permissões, etc.
+
+@api_view(['POST'])
+def sync_checkins(request):
+    """Save a batch of check-ins recorded offline, one result per item.
+
+    Items are validated in one pass and written with a single upsert; a
+    SELECT beforehand tells "accepted" (new day) from "updated". When the
+    same day appears more than once the last item wins. With atomic (body
+    or CHECKIN_SYNC_ATOMIC) nothing is written if any item is invalid.
+    """
+    # Um corpo JSON que não é objeto (ex.: a lista sozinha) não tem "checkins"
+    items = request.data.get('checkins') if isinstance(request.data, dict) else None
+    max_items = getattr(settings, 'CHECKIN_SYNC_MAX_ITEMS', 366)
+    if not isinstance(items, list) or not items:
         return Response(
-            {
-                'message': 'Login realizado com sucesso!',
-                'user': {
-                    'id': user.id,
-                    'name': user.name,
-                    'email': user.email,
-                    'username': user.username,
-                    'type': user.type,
-                },
-                'firebase_token': firebase_token,
-            },
-            status=status.HTTP_200_OK,
+            {'errors': ['Envie os check-ins em uma lista "checkins".']},
+            status=status.HTTP_400_BAD_REQUEST,
         )
-    except CustomUser.DoesNotExist:
+    if len(items) > max_items:
         return Response(
-            {'error': 'Usuário não encontrado.'},
-            status=status.HTTP_404_NOT_FOUND,
+            {'errors': [f'No máximo {max_items} check-ins por lote.']},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    # Só true/"true"/"1" ligam: em formulário "false" e "0" chegam como texto
+    atomic = request.data.get('atomic', getattr(settings, 'CHECKIN_SYNC_ATOMIC', False))
+    atomic = atomic is True or atomic in ('1', 'true')
+
+    # Um dia de folga: o fuso do aparelho pode estar à frente do servidor
+    latest = timezone.localdate() + timedelta(days=1)
+    results = []
+    valid = {}  # data -> índice do último item válido daquele dia
+    invalid = False
+    for index, item in enumerate(items):
+        day, values, errors = parse_sync_item(item, latest)
+        result = {'index': index, 'date': day.isoformat() if day else None}
+        if errors:
+            invalid = True
+            result.update(status='rejected', errors=errors)
+        else:
+            if day in valid:
+                replaced = results[valid[day]]
+                del replaced['values']
+                replaced.update(
+                    status='rejected',
+                    errors=['Substituído por um check-in posterior do mesmo dia.'],
+                )
+            valid[day] = index
+            result['values'] = values
+        results.append(result)
+
+    if atomic and invalid:
+        for result in results:
+            if result.pop('values', None) is not None:
+                result.update(status='rejected', errors=['Lote não gravado: há check-ins inválidos.'])
+        return Response({'saved': 0, 'results': results}, status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        existing = set(
+            DailyCheckin.objects.filter(user=request.user, date__in=list(valid))
+            .values_list('date', flat=True)
         )
+        upsert_checkins([
+            DailyCheckin(user=request.user, date=day, **results[index]['values'])
+            for day, index in valid.items()
+        ], existing)
 
+    for day, index in valid.items():
+        result = results[index]
+        del result['values']
+        result['status'] = 'updated' if day in existing else 'accepted'
 
-@api_view(['GET'])
-def get_user_view(request, user_id):
-    try:
-        user = CustomUser.objects.get(id=user_id)
-        return Response(
-            {
-                'id': user.id,
-                'name': user.name,
-                'email': user.email,
-                'username': user.username,
-                'type': user.type,
-                'phone': user.phone,
-                'birth': user.birth.isoformat() if user.birth else None,
-                'photo': request.build_absolute_uri(user.photo.url) if user.photo else None,
-            },
-            status=status.HTTP_200_OK,
-        )
-    except CustomUser.DoesNotExist:
-        return Response({'error': 'Usuário não encontrado.'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'saved': len(valid), 'results': results}, status=status.HTTP_200_OK)
 
 
-@api_view(['PUT'])
-@parser_classes([MultiPartParser, FormParser])
-def update_user_view(request, user_id):
-    try:
-        user = CustomUser.objects.get(id=user_id)
-        data = request.data
-        errors = []
-
-        name = data.get('name', user.name)
-        email = data.get('email', user.email)
-        username = data.get('username', user.username)
-        phone = data.get('phone', user.phone)
-        type_ = data.get('type', user.type)
-
-        if (
-            email != user.email
-            and CustomUser.objects.filter(email=email).exists()
-        ):
-            errors.append('Este e-mail já está em uso.')
-
-        # Verificar se username já existe (excluindo o usuário atual)
-        if (
-            username != user.username
-            and CustomUser.objects.filter(username=username).exists()
-        ):
-            errors.append('Este username já está em uso.')
-
-        # Validação de data de nascimento se for fornecida
-        birth = data.get('birth')
-        if birth:
+def parse_checkin_query(params):
+    """Filters, page size, cursor and fields of a check-in listing, plus errors"""
+    errors = []
+    dates = {}
+    for param in ('from', 'to', 'cursor'):
+        if params.get(param):
             try:
-                birth_date = date.fromisoformat(birth)
-                today = date.today()
-
-                if birth_date > today:
-                    errors.append(
-                        'A data de nascimento não pode estar no futuro.'
-                    )
-
-                age = (
-                    today.year
-                    - birth_date.year
-                    - (
-                        (today.month, today.day)
-                        < (birth_date.month, birth_date.day)
-                    )
-                )
+                dates[param] = date.fromisoformat(params[param])
+            except ValueError:
+                errors.append(f'Data inválida em {param}. Use o formato AAAA-MM-DD.')
 
-                if birth_date.year < today.year - 120:
-                    errors.append('A data de nascimento é muito antiga.')
+    max_limit = getattr(settings, 'CHECKINS_MAX_PAGE_SIZE', 100)
+    try:
+        limit = int(params.get('limit', 30))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= max_limit:
+        errors.append(f'O limite deve estar entre 1 e {max_limit}.')
 
-                if age < 18:
-                    errors.append('Você precisa ter pelo menos 18 anos.')
+    fields = CHECKIN_FIELDS
+    if params.get('fields'):
+        requested = {field.strip() for field in params['fields'].split(',')}
+        unknown = requested - set(CHECKIN_FIELDS)
+        if unknown:
+            errors.append(f'Campos inválidos: {", ".join(sorted(unknown))}.')
+        # date sempre vem: é o cursor da próxima página
+        fields = tuple(f for f in CHECKIN_FIELDS if f in requested or f == 'date')
 
-            except (ValueError, TypeError):
-                errors.append('Formato de data de nascimento inválido.')
-        else:
-            birth_date = user.birth
+    return dates, limit, fields, errors
 
-        if errors:
-            return Response(
-                {'errors': errors}, status=status.HTTP_400_BAD_REQUEST
-            )
 
-        # Atualizar os campos do usuário
-        user.name = name
-        user.email = email
-        user.username = username
-        user.phone = phone
-        user.type = type_
+@api_view(['GET'])
+def get_user_checkins(request, user_id):
+    """Check-ins of a user, newest first, paginated by date (keyset), optionally by tag"""
+    if not can_view_checkins(request.user, user_id):
+        return Response(
+            {'error': 'Você não tem permissão para ver estes check-ins.'},
+            status=status.HTTP_403_FORBIDDEN,
+        )
 
-        if birth:
-            user.birth = birth_date
+    dates, limit, fields, errors = parse_checkin_query(request.query_params)
+    if errors:
+        return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
 
-        password = data.get('password')
-        if password:
-            user.set_password(password)
+    # Um check-in por dia (unique_together), então a data sozinha é o cursor:
+    # a página seguinte é "date < última data", servida pelo índice (user, date)
+    queryset = DailyCheckin.objects.filter(user_id=user_id)
+    if 'from' in dates:
+        queryset = queryset.filter(date__gte=dates['from'])
+    if 'to' in dates:
+        queryset = queryset.filter(date__lte=dates['to'])
+    if 'cursor' in dates:
+        queryset = queryset.filter(date__lt=dates['cursor'])
+    if request.query_params.get('tag'):
+        # Dias da tag pelo índice (user/tags.py), sem ler o JSON das linhas
+        queryset = queryset.filter(date__in=tagged_dates(user_id, request.query_params['tag']))
+
+    checkins = list(queryset.order_by('-date').only(*fields)[:limit + 1])
+    has_more = len(checkins) > limit
+    checkins = checkins[:limit]
 
-        # Upload de foto se enviada como multipart "photo"
-        if 'photo' in request.FILES:
-            uploaded_file = request.FILES['photo']
-            user.photo.save(uploaded_file.name, uploaded_file, save=False)
+    return Response(
+        {
+            'checkins': [serialize_checkin(checkin, fields) for checkin in checkins],
+            'next_cursor': checkins[-1].date.isoformat() if has_more else None,
+        },
+        status=status.HTTP_200_OK,
+    )
 
-        user.save()
 
+@api_view(['GET'])
+def get_mood_stats(request, user_id):
+    """Dashboard mood statistics, read from MoodStats by primary key"""
+    if not can_view_checkins(request.user, user_id):
         return Response(
-            {'message': 'Usuário atualizado com sucesso!'},
-            status=status.HTTP_200_OK,
+            {'error': 'Você não tem permissão para ver estes check-ins.'},
+            status=status.HTTP_403_FORBIDDEN,
         )
 
-    except CustomUser.DoesNotExist:
+    stats = MoodStats.objects.filter(pk=user_id).first() or MoodStats(user_id=user_id)
+    return Response(summarize(stats, timezone.localdate()), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def get_tag_stats(request, user_id):
+    """How often each tag was used, and which tags appear together, in a date range"""
+    if not can_view_checkins(request.user, user_id):
         return Response(
-            {'error': 'Usuário não encontrado.'},
-            status=status.HTTP_404_NOT_FOUND,
+            {'error': 'Você não tem permissão para ver estes check-ins.'},
+            status=status.HTTP_403_FORBIDDEN,
         )
 
+    dates, limit, _, errors = parse_checkin_query(request.query_params)
+    if errors:
+        return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
 
-@api_view(['DELETE'])
-def delete_user_view(request, user_id):
+    start, end = dates.get('from'), dates.get('to')
+    return Response(
+        {
+            'tags': [
+                {'tag': name, 'count': count} for name, count in tag_counts(user_id, start, end)
+            ],
+            'cooccurrences': [
+                {'tags': list(pair), 'count': count}
+                for pair, count in cooccurrences(user_id, start, end, limit)
+            ],
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+@api_view(['GET'])
+def get_cohort_analytics(request):
+    """Aggregates over every patient of the logged-in psychologist"""
+    if not request.user.is_psychologist():
+        return Response(
+            {'error': 'Apenas psicólogos podem ver estas análises.'},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+
+    errors = []
+    period = request.query_params.get('period', 'week')
+    if period not in PERIODS:
+        errors.append(f'Período inválido. Use {" ou ".join(PERIODS)}.')
+    max_days = getattr(settings, 'ANALYTICS_MAX_DAYS', 730)
     try:
-        user = CustomUser.objects.get(id=user_id)
-        user.delete()
+        days = int(request.query_params.get('days', 180))
+    except ValueError:
+        days = 0
+    if not 1 <= days <= max_days:
+        errors.append(f'O número de dias deve estar entre 1 e {max_days}.')
+    if errors:
+        return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    series = request.query_params.get('series') in ('1', 'true')
+    return Response(
+        cohort_analytics(request.user.id, period, days, series, timezone.localdate()),
+        status=status.HTTP_200_OK,
+    )
+
+
+@api_view(['GET'])
+def export_user_data(request, user_id):
+    """Download all data of a user as NDJSON or CSV, streamed (optionally gzipped)"""
+    if not can_view_checkins(request.user, user_id):
         return Response(
-            {'message': 'Usuário deletado com sucesso!'},
-            status=status.HTTP_200_OK,
+            {'error': 'Você não tem permissão para exportar estes dados.'},
+            status=status.HTTP_403_FORBIDDEN,
         )
-    except CustomUser.DoesNotExist:
+    user = CustomUser.objects.filter(pk=user_id).first()
+    if user is None:
+        return Response({'error': 'Usuário não encontrado.'}, status=status.HTTP_404_NOT_FOUND)
+
+    # "output" e não "format": o DRF usa ?format= para escolher o renderer
+    output = request.query_params.get('output', 'ndjson')
+    if output not in FORMATS:
         return Response(
-            {'error': 'Usuário não encontrado.'},
-            status=status.HTTP_404_NOT_FOUND,
+            {'errors': [f'Formato inválido. Use {" ou ".join(FORMATS)}.']},
+            status=status.HTTP_400_BAD_REQUEST,
         )
+    compress = request.query_params.get('gzip') in ('1', 'true')
+    # Psicólogo exportando um paciente: só as sessões entre os dois
+    psychologist = request.user if request.user.id != user_id else None
+
+    if isinstance(request._request, ASGIRequest):
+        chunks = aexport_chunks(user, output, compress, psychologist)
+    else:
+        chunks = export_chunks(user, output, compress, psychologist)
+    response = StreamingHttpResponse(
+        chunks, content_type='application/gzip' if compress else FORMATS[output][0],
+    )
+    filename = export_filename(user, output, compress, timezone.localdate())
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    patch_cache_control(response, private=True, no_store=True)
+    return response
@@ -14,6 +14,9 @@ const LiveChat = () => {
   
   const [partnerId, setPartnerId] = useState('');
   const chatSocketRef = useRef(null);
+  // Último seq visto na sala e seqs já exibidos (dedupe O(1) e resume)
+  const lastSeqRef = useRef(0);
+  const seenSeqsRef = useRef(new Set());
   const [wsMessages, setWsMessages] = useState([]);
   const { user } = useAuth();
   const [roomCode, setRoomCode] = useState('');
@@ -78,6 +81,40 @@ const LiveChat = () => {
 
     console.log('🔌 Tentando conectar WebSocket para sala:', roomName);
     setConnectionStatus('connecting');
+    lastSeqRef.current = 0;
+    seenSeqsRef.current = new Set();
+
+    // Registra o seq; retorna false se a mensagem já foi exibida
+    const markSeen = (seq) => {
+      if (!seq) return true;
+      if (seenSeqsRef.current.has(seq)) return false;
+      seenSeqsRef.current.add(seq);
+      lastSeqRef.current = Math.max(lastSeqRef.current, seq);
+      return true;
+    };
+
+    const addIncomingMessage = (data) => {
+      if (!markSeen(data.seq)) {
+        console.log('⏭️ Mensagem duplicada ignorada');
+        return;
+      }
+
+      const newMessage = {
+        id: data.seq || Date.now() + Math.random(),
+        seq: data.seq,
+        message: data.message,
+        isOwn: false,
+        user: data.user_name || 'Usuário',
+        user_id: data.user_id,
+        user_avatar: data.user_avatar,
+        time: new Date(data.timestamp).toLocaleTimeString(),
+        status: 'delivered',
+        timestamp: data.timestamp
+      };
+
+      console.log('📝 Adicionando nova mensagem:', newMessage);
+      setWsMessages((prev) => [...prev, newMessage]);
+    };
 
     // Conecta ao backend Django
     const connectToDjangoBackend = () => {
@@ -108,6 +145,14 @@ const LiveChat = () => {
             type: 'ping',
             message: 'Teste de conexão'
           }));
+
+          // Reconexão: pedir só o que foi perdido enquanto estava fora
+          if (lastSeqRef.current > 0) {
+            chatSocket.send(JSON.stringify({
+              type: 'resume',
+              after_seq: lastSeqRef.current
+            }));
+          }
         };
 
         chatSocket.onmessage = function(e) {
@@ -119,6 +164,26 @@ const LiveChat = () => {
             switch (data.type) {
               case 'connection_established':
                 console.log('✅ Conexão estabelecida:', data);
+                if (lastSeqRef.current === 0 && data.last_seq) {
+                  lastSeqRef.current = data.last_seq;
+                }
+                break;
+
+              case 'resume':
+                console.log('🔄 Mensagens perdidas recebidas:', data.messages.length);
+                data.messages.forEach((msg) => {
+                  if (msg.is_own) {
+                    markSeen(msg.seq);
+                  } else {
+                    addIncomingMessage(msg);
+                  }
+                });
+                if (data.has_more) {
+                  chatSocket.send(JSON.stringify({
+                    type: 'resume',
+                    after_seq: data.last_seq
+                  }));
+                }
                 break;
 
               case 'pong':
@@ -131,35 +196,7 @@ const LiveChat = () => {
                 
                 // CRÍTICO: Só processar mensagens de OUTROS usuários
                 if (!data.is_own) {
-                  console.log('✅ Adicionando mensagem de outro usuário');
-                  const newMessage = {
-                    id: Date.now() + Math.random(),
-                    message: data.message,
-                    isOwn: false,
-                    user: data.user_name || 'Usuário',
-                    user_id: data.user_id,
-                    user_avatar: data.user_avatar,
-                    time: new Date(data.timestamp).toLocaleTimeString(),
-                    status: 'delivered',
-                    timestamp: data.timestamp
-                  };
-                  
-                  setWsMessages((prev) => {
-                    // Evitar mensagens duplicadas
-                    const exists = prev.some(msg => 
-                      msg.message === newMessage.message && 
-                      msg.user_id === newMessage.user_id &&
-                      Math.abs(new Date(msg.timestamp) - new Date(newMessage.timestamp)) < 1000
-                    );
-                    
-                    if (exists) {
-                      console.log('⏭️ Mensagem duplicada ignorada');
-                      return prev;
-                    }
-                    
-                    console.log('📝 Adicionando nova mensagem:', newMessage);
-                    return [...prev, newMessage];
-                  });
+                  addIncomingMessage(data);
                 } else {
                   console.log('⏭️ Mensagem própria ignorada (já foi adicionada localmente)');
                 }
@@ -167,11 +204,12 @@ const LiveChat = () => {
 
               case 'message_sent':
                 console.log('✅ Confirmação: Mensagem enviada com sucesso!');
+                markSeen(data.seq);
                 // Atualizar status da mensagem para 'delivered'
                 setWsMessages(prev => 
                   prev.map(msg => 
-                    msg.isOwn && msg.status === 'sending' && msg.message === data.message
-                      ? { ...msg, status: 'delivered' }
+                    msg.isOwn && msg.clientId === data.client_id
+                      ? { ...msg, status: 'delivered', seq: data.seq }
                       : msg
                   )
                 );
@@ -255,9 +293,13 @@ const LiveChat = () => {
     const messageText = message.trim();
     const timestamp = new Date().toISOString();
     
+    // Id gerado no cliente: o servidor ignora reenvios com o mesmo client_id
+    const clientId = `${Date.now()}-${Math.random().toString(36).slice(2, 10)}`;
+
     // Cria a nova mensagem localmente
     const newMessage = {
-      id: Date.now() + Math.random(),
+      id: clientId,
+      clientId,
       message: messageText,
       isOwn: true,
       user: user?.displayName || user?.name || 'Você',
@@ -281,7 +323,8 @@ const LiveChat = () => {
       try {
         const messageData = {
           type: 'chat_message',
-          message: messageText
+          message: messageText,
+          client_id: clientId
         };
         
         chatSocket.send(JSON.stringify(messageData));